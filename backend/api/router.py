@@ -1,14 +1,34 @@
 
 
 
-from fastapi import APIRouter, HTTPException, Form, UploadFile, File, Depends, Header, status
+from fastapi import APIRouter, HTTPException, Form, UploadFile, File, Depends, Header, Query, Response, status
 import json
 import logging
 
 logger = logging.getLogger(__name__)
-from core.data_analysis import analyze_product_data
-from core.content_generation import generate_marketing_content
-from core.document_analysis import generate_product_analysis_from_document
+from core.data_analysis import analyze_product_data_async
+from core.content_generation import (
+    generate_marketing_content_async,
+    stream_marketing_content,
+    generate_content_batch,
+    build_variant_overrides,
+    CONTENT_BATCH_MAX_VARIANTS,
+    content_length_stats,
+    content_candidate_stats,
+)
+from core.document_analysis import generate_product_analysis_from_document, document_analysis_stats, extract_document_text
+from core.document_index import (
+    index_document,
+    get_document_index,
+    list_document_indexes,
+    delete_document_index,
+    answer_document_question,
+    document_index_stats,
+    is_document_id,
+    EmbedderUnavailableError,
+)
+from core.parse_sandbox import DocumentRejectedError, parse_stats, shutdown_parse_pool, warm_parse_pool
+from core.ocr import ocr_stats
 
 from core.image_generation import (
     generate_marketing_poster,
@@ -18,12 +38,21 @@ from core.image_generation import (
     build_style_suggestion,
 )
 
-from core.competitor_analysis import analyze_competitor_market
+from core.competitor_analysis import analyze_competitor_market_async
+from core.llm_gateway import gateway as llm_gateway
+from core.ai_clients import LLMUnavailableError, limiter_stats
+from core.result_cache import cache_stats
+from core.singleflight import singleflight_stats
+from core.llm_metrics import metrics as llm_metrics
+from core.jobs import job_queue, job_stats
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from google.genai.errors import ServerError as GeminiServerError
 from models.schemas import (
     ProductAnalysisRequest,
     ProductAnalysisResult,
     ContentGenerationRequest,
+    ContentBatchRequest,
     GeneratedContentResponse,
     ImageGenerationResponse,
     CompetitorAnalysisRequest,
@@ -34,30 +63,90 @@ from models.schemas import (
     AnalysisRecordOut,
     ContentRecordOut,
     ImageRecordOut,
-
+    JobAccepted,
+    JobStatusOut,
+    DocumentQueryRequest,
+    DocumentQueryResponse,
+    DocumentChunkOut,
+    DocumentIndexOut,
 )
 from pathlib import Path
 import time
-from typing import List, Optional
+import threading
+from typing import BinaryIO, List, Optional
 from sqlalchemy.orm import Session
 from db import get_db
 from .auth_utils import get_current_user_email
 from models.history import AnalysisRecord, ContentRecord, ImageRecord
 from .history_router import history_router
+from .uploads import UPLOAD_MAX_DOCUMENT_BYTES, UPLOAD_MAX_IMAGE_BYTES, open_upload, save_upload
 
 router = APIRouter()  # No version prefix; mounted under /api in main.py
 
 
+def _unavailable(e: LLMUnavailableError) -> HTTPException:
+    """503 + Retry-After khi mọi model đang bị ngắt mạch (circuit open) hoặc hàng đợi gọi model đã quá hạn."""
+    retry_after = int(e.retry_after) + 1 if e.retry_after else 30
+    return HTTPException(
+        status_code=503,
+        detail="Mô hình đang quá tải. Vui lòng thử lại sau.",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+# ===============================================
+# JOB NỀN (?async=true): poster, phân tích sản phẩm / đối thủ
+
+@router.on_event("startup")
+async def _start_job_workers():
+    # Chạy sau init_db (auth_router được include trước); nhận lại các job còn dang dở
+    await job_queue.start()
+    # Parse worker khởi động mất vài giây (import pypdf); làm nền để upload đầu tiên không phải chờ
+    threading.Thread(target=warm_parse_pool, name="parse-warmup", daemon=True).start()
+
+
+@router.on_event("shutdown")
+async def _stop_job_workers():
+    await job_queue.stop()
+    await run_in_threadpool(shutdown_parse_pool)
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatusOut)
+def get_job(job_id: str):
+    """Trạng thái job nền; `result` có cùng cấu trúc với endpoint đồng bộ khi status = succeeded."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job (hoặc đã hết hạn).")
+    return job
+
+
+def _accepted(kind: str, payload: dict) -> JSONResponse:
+    """202 + job id; kết quả lấy qua GET /api/jobs/{job_id}."""
+    job_id = job_queue.submit(kind, payload)
+    body = JobAccepted(job_id=job_id, status_url=f"/api/jobs/{job_id}")
+    return JSONResponse(status_code=202, content=body.model_dump(), headers={"Location": body.status_url})
+
 
 # GIAI ĐOẠN 1: PHÂN TÍCH DỮ LIỆU THỊ TRƯỜNG
 
 @router.post("/analyze_product", response_model=ProductAnalysisResult)
-def analyze_product(request: ProductAnalysisRequest):
+async def analyze_product(
+    request: ProductAnalysisRequest,
+    run_async: bool = Query(False, alias="async", description="Trả về job id ngay, kết quả lấy qua /api/jobs/{job_id}."),
+):
+    if run_async:
+        return _accepted("analyze_product", request.model_dump())
+    return await _analyze_product(request)
+
+
+async def _analyze_product(request: ProductAnalysisRequest) -> ProductAnalysisResult:
     print(f"Bắt đầu phân tích sản phẩm: {request.product_name}")
     try:
-        result = analyze_product_data(request.product_name)
+        result = await analyze_product_data_async(request.product_name, force_refresh=bool(request.force_refresh))
         if result:
             return result
+    except LLMUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         print(f"Lỗi phân tích dữ liệu ở Giai đoạn 1: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi Server: Không thể phân tích sản phẩm. Lỗi chi tiết: {str(e)}")
@@ -65,11 +154,16 @@ def analyze_product(request: ProductAnalysisRequest):
     return ProductAnalysisResult(product_name=request.product_name, usps=[], pain_points=[], infor="Khong tim thay du lieu", target_persona="Không tìm thấy dữ liệu.")
 
 
+@job_queue.register("analyze_product")
+async def _analyze_product_job(payload: dict) -> dict:
+    return (await _analyze_product(ProductAnalysisRequest(**payload))).model_dump()
+
+
 # ===============================================
 # GIAI ĐOẠN 2: SÁNG TẠO NỘI DUNG MARKETING
 
 @router.post("/generate_content", response_model=GeneratedContentResponse)
-def generate_content(request: ContentGenerationRequest):
+async def generate_content(request: ContentGenerationRequest):
     """
     Endpoint Giai đoạn 2: Nhận ma trận Marketing và trả về nội dung (copy).
     """
@@ -83,58 +177,208 @@ def generate_content(request: ContentGenerationRequest):
     except Exception:
         print("Bắt đầu tạo nội dung cho USP(s): (không xác định)")
     try:
-        result = generate_marketing_content(request)
+        result = await generate_marketing_content_async(request)
         if result:
             return result
+    except LLMUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         print(f"Lỗi tạo nội dung ở Giai đoạn 2: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi Server: Không thể tạo nội dung. Lỗi chi tiết: {str(e)}")
     raise HTTPException(status_code=400, detail="Không thể tạo nội dung, vui lòng thử lại với các thông số khác.")
 
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@router.post("/generate_content/stream")
+async def generate_content_stream(request: ContentGenerationRequest):
+    """
+    Giai đoạn 2 (streaming, SSE): gửi `title` ngay khi parse được, sau đó các
+    `content` delta, cuối cùng là `final` (kết quả đã hậu xử lý giống /generate_content).
+    Lỗi xảy ra trước sự kiện đầu tiên vẫn trả mã HTTP bình thường (503/500);
+    lỗi giữa chừng được gửi dưới dạng sự kiện `error`.
+    """
+    events = stream_marketing_content(request)
+    try:
+        first = await events.__anext__()
+    except LLMUnavailableError as e:
+        raise _unavailable(e)
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="Không thể tạo nội dung, vui lòng thử lại với các thông số khác.")
+    except Exception as e:
+        print(f"Lỗi tạo nội dung (stream) ở Giai đoạn 2: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi Server: Không thể tạo nội dung. Lỗi chi tiết: {str(e)}")
+
+    async def event_source():
+        try:
+            yield _sse(*first)
+            async for event, payload in events:
+                yield _sse(event, payload)
+        except LLMUnavailableError as e:
+            yield _sse("error", {"status": 503, "detail": "Mô hình đang quá tải. Vui lòng thử lại sau.", "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"Lỗi tạo nội dung (stream) ở Giai đoạn 2: {e}")
+            yield _sse("error", {"status": 500, "detail": f"Lỗi Server: Không thể tạo nội dung. Lỗi chi tiết: {str(e)}"})
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/generate_content/batch")
+async def generate_content_batch_stream(request: ContentBatchRequest):
+    """
+    Giai đoạn 2 (batch, SSE): một yêu cầu gốc + ma trận tone/format/language/ad_copy_style.
+    Sự kiện: `batch` (danh sách biến thể), `variant` / `variant_error` theo thứ tự hoàn thành, `done`.
+    """
+    overrides = build_variant_overrides(request)
+    if len(overrides) > CONTENT_BATCH_MAX_VARIANTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Quá nhiều biến thể ({len(overrides)}). Tối đa {CONTENT_BATCH_MAX_VARIANTS} biến thể mỗi lần.",
+        )
+    if not llm_gateway.is_available():
+        raise HTTPException(status_code=503, detail="Mô hình chưa sẵn sàng. Vui lòng thử lại sau.")
+
+    variants = [{k: getattr(v, "value", v) for k, v in o.items()} for o in overrides]
+
+    async def event_source():
+        started = time.monotonic()
+        succeeded = 0
+        yield _sse("batch", {"total": len(variants), "variants": variants})
+        async for index, result, error in generate_content_batch(request.base, overrides, request.max_concurrency):
+            if result is not None:
+                succeeded += 1
+                yield _sse("variant", {"index": index, "overrides": variants[index], "result": result.model_dump()})
+            elif isinstance(error, LLMUnavailableError):
+                yield _sse("variant_error", {"index": index, "overrides": variants[index], "status": 503, "detail": "Mô hình đang quá tải. Vui lòng thử lại sau.", "retry_after": error.retry_after})
+            else:
+                detail = f"Lỗi Server: {error}" if error else "Không thể tạo nội dung, vui lòng thử lại với các thông số khác."
+                yield _sse("variant_error", {"index": index, "overrides": variants[index], "status": 500 if error else 400, "detail": detail})
+        yield _sse("done", {
+            "total": len(variants),
+            "succeeded": succeeded,
+            "failed": len(variants) - succeeded,
+            "elapsed_seconds": round(time.monotonic() - started, 2),
+        })
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # GIAI ĐOẠN 3: SẢN XUẤT MEDIA (POSTER)
 
 @router.post("/generate_poster", response_model=ImageGenerationResponse)
 async def generate_poster(
     product_name: str = Form(..., description="Tên sản phẩm."),
     style_short: str = Form(None, description="Yêu cầu phong cách ngắn (tuỳ chọn)."),
-    reference_image: UploadFile = File(..., description="Ảnh mẫu (bắt buộc) để chỉnh sửa/biến thể")
+    reference_image: UploadFile = File(..., description="Ảnh mẫu (bắt buộc) để chỉnh sửa/biến thể"),
+    run_async: bool = Query(False, alias="async", description="Trả về job id ngay, kết quả lấy qua /api/jobs/{job_id}."),
 ):
     """
     Endpoint Giai đoạn 3: Nhận các thông số và Ad Copy để tạo Poster/Ảnh quảng cáo.
     Nhận form-data (có thể kèm file).
     """
     logger.info(f"generate_poster called for product: %s, reference_image present: %s", product_name, bool(reference_image))
+    ref_file = None
+    saved_path = None
+    if reference_image:
+        # Stream the spooled upload to static uploads in chunks (size-checked); core reads the file from there
+        uploads_dir = Path(__file__).resolve().parents[1] / "static" / "uploads"
+        filename = f"ref_{int(time.time())}_{Path(reference_image.filename or 'image').name}"
+        saved = await save_upload(reference_image, uploads_dir / filename, UPLOAD_MAX_IMAGE_BYTES)
+        if saved is not None:
+            saved_path = str(saved)
+        elif run_async:
+            # Job chỉ giữ đường dẫn ảnh đã lưu (không lưu bytes vào DB): không lưu được file thì không nhận job
+            raise HTTPException(
+                status_code=503,
+                detail="Không lưu được ảnh tham khảo để xử lý nền. Vui lòng thử lại sau.",
+                headers={"Retry-After": "30"},
+            )
+        else:
+            logger.warning("Failed to save uploaded reference image; passing the upload handle instead")
+            await reference_image.seek(0)
+            ref_file = reference_image.file
+    if run_async:
+        return _accepted("generate_poster", {"product_name": product_name, "style_short": style_short, "reference_path": saved_path})
+    # Core poster pipeline is blocking (Gemini + OpenAI + Cloudinary); keep it off the event loop
+    return await run_in_threadpool(_generate_poster, product_name, style_short, ref_file, saved_path)
+
+
+def _generate_poster(product_name: str, style_short: Optional[str], ref_file: Optional[BinaryIO], saved_path: Optional[str]) -> ImageGenerationResponse:
     try:
-        ref_bytes = None
-        if reference_image:
-            # Read bytes and also save to static uploads so core can use a file path if desired
-            ref_bytes = await reference_image.read()
-            try:
-                uploads_dir = Path(__file__).resolve().parents[1] / "static" / "uploads"
-                uploads_dir.mkdir(parents=True, exist_ok=True)
-                filename = f"ref_{int(time.time())}_{reference_image.filename}"
-                file_path = uploads_dir / filename
-                with open(file_path, "wb") as f:
-                    f.write(ref_bytes)
-                saved_path = str(file_path)
-            except Exception as e:
-                print(f"Warning: failed to save uploaded reference image: {e}")
-                saved_path = None
         # gọi hàm core (trả về ImageGenerationResponse)
         result = generate_marketing_poster(
             product_name=product_name,
             style_short=style_short,
-            original_image_bytes=ref_bytes,
-            original_image_path=saved_path if reference_image else None
+            original_image_bytes=ref_file,
+            original_image_path=saved_path,
         )
         if result:
             return result
+    except LLMUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         msg = str(e)
         print(f"Lỗi tạo Poster ở Giai đoạn 3: {msg}")
         raise HTTPException(status_code=500, detail=msg)
     raise HTTPException(status_code=400, detail="Không thể tạo Poster, vui lòng kiểm tra log backend.")
 
+
+@job_queue.register("generate_poster")
+def _generate_poster_job(payload: dict) -> dict:
+    return _generate_poster(payload["product_name"], payload.get("style_short"), None, payload.get("reference_path")).model_dump()
+
+
+@router.get("/llm_health")
+def llm_health():
+    """Trạng thái circuit breaker, độ trễ (p50/p90), bộ giới hạn và thống kê hedging (tỉ lệ hedge thắng)."""
+    return {
+        "models": llm_gateway.health(),
+        "latency": llm_gateway.latency_stats(),
+        "limiters": limiter_stats(),
+        "hedging": llm_gateway.hedge_stats(),
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Số lần gọi, token, chi phí ước tính và histogram độ trễ theo model/operation (định dạng Prometheus)."""
+    return PlainTextResponse(llm_metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/metrics/summary")
+def get_metrics_summary():
+    """Tổng hợp theo (model, operation), sắp xếp theo chi phí giảm dần, kèm tỉ lệ lỗi parse JSON, tỉ lệ gọi lần hai để đủ độ dài và độ phủ/thời gian phân tích tài liệu."""
+    return {
+        "operations": llm_metrics.summary(),
+        "structured_output": llm_metrics.structured_stats(),
+        "content_length": content_length_stats(),
+        "content_candidates": content_candidate_stats(),
+        "jobs": job_stats(),
+        "documents": document_analysis_stats(),
+        "parsing": parse_stats(),
+        "ocr": ocr_stats(),
+        "document_index": document_index_stats(),
+    }
+
+
+@router.get("/cache_stats")
+def get_cache_stats():
+    """Số lần hit/miss của các cache kết quả (bộ nhớ + SQLite) và số yêu cầu được gộp (single-flight)."""
+    return {**cache_stats(), "singleflight": singleflight_stats()}
+
+
 @router.get("/image_limitations")
 def image_limitations():
     """Trả về danh sách các hạn chế đã biết của mô hình xử lý hình ảnh để hiển thị phía frontend."""
@@ -190,19 +434,30 @@ def poster_prompt_template(
 
 
 @router.post("/analyze_competitor", response_model=CompetitorAnalysisResult)
-def analyze_competitor(request: CompetitorAnalysisRequest):
+async def analyze_competitor(
+    request: CompetitorAnalysisRequest,
+    run_async: bool = Query(False, alias="async", description="Trả về job id ngay, kết quả lấy qua /api/jobs/{job_id}."),
+):
     """
     Endpoint để phân tích đối thủ cạnh tranh.
     """
+    if run_async:
+        return _accepted("analyze_competitor", request.model_dump())
+    return await _analyze_competitor(request)
+
+
+async def _analyze_competitor(request: CompetitorAnalysisRequest) -> CompetitorAnalysisResult:
     print(f"Bắt đầu phân tích đối thủ: {request.competitor_name}")
     try:
         # analyze_competitor_market expects a competitor name (string)
-        result = analyze_competitor_market(request.competitor_name)
+        result = await analyze_competitor_market_async(request.competitor_name, hedge=request.hedge)
         if result:
             # Ensure response matches Pydantic model
             return CompetitorAnalysisResult(**result)
         # Không có kết quả nhưng không lỗi cụ thể -> 502 Bad Gateway (lỗi xử lý từ dịch vụ ngoài)
         raise HTTPException(status_code=502, detail="Không thể phân tích đối thủ (không nhận được dữ liệu hợp lệ từ mô hình). Vui lòng thử lại.")
+    except LLMUnavailableError as e:
+        raise _unavailable(e)
     except GeminiServerError as ge:
         msg = str(ge)
         # Map đúng mã 503 khi model quá tải
@@ -216,15 +471,26 @@ def analyze_competitor(request: CompetitorAnalysisRequest):
         print(f"Lỗi phân tích đối thủ: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi Server: Không thể phân tích đối thủ. Lỗi chi tiết: {str(e)}")
 
+
+@job_queue.register("analyze_competitor")
+async def _analyze_competitor_job(payload: dict) -> dict:
+    return (await _analyze_competitor(CompetitorAnalysisRequest(**payload))).model_dump()
+
+
 @router.post("/analyze_document", response_model=ProductAnalysisResult)
 async def analyze_document(
+    response: Response,
     file: UploadFile = File(..., description="Tài liệu sản phẩm (PDF, DOCX, TXT)"),
+    force_refresh: bool = Form(False, description="Bỏ qua kết quả đã cache cho cùng nội dung file và phân tích lại."),
     user_email: str = Depends(get_current_user_email),
     db: Session = Depends(get_db)
 ):
     """Phân tích tài liệu để trích xuất thông tin sản phẩm chuẩn hóa.
 
     Tự động suy luận loại file từ phần mở rộng. Hỗ trợ: pdf, docx, txt.
+    File đã tải lên trước đó (cùng nội dung, theo SHA-256) trả kết quả từ cache; bản ghi lịch sử vẫn được lưu.
+    Tài liệu được index cho người dùng; header X-Document-Id dùng cho POST /api/documents/{id}/query
+    (hỏi tiếp mà không cần tải lại file).
     """
     filename_lower = file.filename.lower()
     if not filename_lower.endswith((".pdf", ".docx", ".txt")):
@@ -239,9 +505,12 @@ async def analyze_document(
         file_type = "txt"
 
     try:
-        contents = await file.read()
+        # Spooled upload handle + its SHA-256; parsers read it in place instead of a bytes copy
+        upload = await open_upload(file, UPLOAD_MAX_DOCUMENT_BYTES)
         # Pass empty product_name to allow auto-guessing inside core function
-        analysis_result = generate_product_analysis_from_document("", contents, file_type)
+        analysis_result = await run_in_threadpool(
+            generate_product_analysis_from_document, "", upload.file, file_type, force_refresh, upload.sha256
+        )
         if not analysis_result:
             raise HTTPException(status_code=500, detail="Không thể phân tích tài liệu (kết quả rỗng).")
 
@@ -258,12 +527,77 @@ async def analyze_document(
         db.commit()
         db.refresh(analysis_record)
 
+        if await run_in_threadpool(_index_upload, user_email, upload, file_type, analysis_result.product_name):
+            response.headers["X-Document-Id"] = upload.sha256
         return analysis_result
 
     except HTTPException:
         db.rollback()
         raise
+    except DocumentRejectedError as e:
+        # File vượt giới hạn của parse worker (quá thời gian, quá bộ nhớ, làm crash parser)
+        db.rollback()
+        logger.warning("Document rejected by parse sandbox (%s): %s", e.reason, e)
+        raise HTTPException(status_code=422, detail="Không thể đọc tài liệu: file quá phức tạp hoặc bị lỗi.")
+    except LLMUnavailableError as e:
+        db.rollback()
+        raise _unavailable(e)
     except Exception as e:
         db.rollback()
         logger.exception("Lỗi khi phân tích tài liệu")
         raise HTTPException(status_code=500, detail=f"Lỗi Server: {str(e)}")
+
+
+def _index_upload(user_email: str, upload, file_type: str, product_name: str) -> bool:
+    """Index văn bản của file cho câu hỏi tiếp theo; lỗi chỉ ghi log, không làm hỏng kết quả phân tích."""
+    try:
+        # Cùng budget với bước phân tích nên thường lấy lại từ cache document_text
+        text = extract_document_text(upload.file, file_type, upload.sha256)
+        return index_document(user_email, upload.sha256, text or "", upload.filename, product_name) is not None
+    except Exception as e:
+        logger.warning("Could not index document %s for follow-up questions: %s", upload.sha256[:12], e)
+        return False
+
+
+@router.get("/documents", response_model=List[DocumentIndexOut])
+async def list_documents(user_email: str = Depends(get_current_user_email)):
+    """Các tài liệu đã index của người dùng (mới nhất trước)."""
+    return await run_in_threadpool(list_document_indexes, user_email)
+
+
+@router.post("/documents/{document_id}/query", response_model=DocumentQueryResponse)
+async def query_document(document_id: str, request: DocumentQueryRequest, user_email: str = Depends(get_current_user_email)):
+    """Hỏi tiếp về một tài liệu đã tải lên: chỉ các đoạn liên quan nhất (top_k) được gửi cho mô hình."""
+    # document_id là SHA-256 của file và được dùng làm tên file index
+    index = await run_in_threadpool(get_document_index, user_email, document_id) if is_document_id(document_id) else None
+    if index is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu. Vui lòng tải lên lại qua /api/analyze_document.")
+    try:
+        answer, hits, context_chars = await run_in_threadpool(answer_document_question, index, request.question, request.top_k)
+    except LLMUnavailableError as e:
+        raise _unavailable(e)
+    except EmbedderUnavailableError as e:
+        logger.warning("Document index %s cannot be searched: %s", document_id[:12], e)
+        raise HTTPException(
+            status_code=409,
+            detail="Index của tài liệu này không còn dùng được. Vui lòng tải lên lại qua /api/analyze_document.",
+        )
+    except Exception as e:
+        logger.exception("Lỗi khi trả lời câu hỏi về tài liệu")
+        raise HTTPException(status_code=500, detail=f"Lỗi Server: {str(e)}")
+    if not answer:
+        raise HTTPException(status_code=500, detail="Không thể trả lời câu hỏi (kết quả rỗng).")
+    return DocumentQueryResponse(
+        document_id=document_id,
+        answer=answer,
+        sources=[DocumentChunkOut(index=h.index, score=round(h.score, 4), text=h.text) for h in hits],
+        context_chars=context_chars,
+    )
+
+
+@router.delete("/documents/{document_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_document(document_id: str, user_email: str = Depends(get_current_user_email)):
+    """Xóa tài liệu khỏi index của người dùng (không ảnh hưởng lịch sử phân tích)."""
+    if not is_document_id(document_id) or not await run_in_threadpool(delete_document_index, user_email, document_id):
+        raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu.")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,176 @@
+"""Size-bounded uploads that stay on disk.
+
+Starlette's multipart parser already spools each file into a
+SpooledTemporaryFile (1 MB in memory, the rest on disk). Routes hand the
+spooled handle to parsers/clients instead of `await file.read()`, which
+copied the whole upload into memory (and the poster route then wrote it out
+and reopened it).
+
+Limits are enforced while the body is received. `UploadLimitMiddleware`
+rejects a request whose Content-Length is over the route limit before
+anything is parsed. It also counts the bytes of chunked bodies and aborts
+with 413 once the limit is passed. `open_upload` / `save_upload` check the
+per-file limit and hash the file in chunks (the SHA-256 is the document cache
+key).
+"""
+import os
+import hashlib
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_MAX_DOCUMENT_BYTES = int(os.getenv("UPLOAD_MAX_DOCUMENT_BYTES", 25 * 1024 * 1024))
+UPLOAD_MAX_IMAGE_BYTES = int(os.getenv("UPLOAD_MAX_IMAGE_BYTES", 20 * 1024 * 1024))
+# Multipart framing and the small form fields on top of the file itself
+_MULTIPART_OVERHEAD = 64 * 1024
+
+# Request body limits by route; other multipart requests get the largest one
+UPLOAD_ROUTE_LIMITS = {
+    "/api/analyze_document": UPLOAD_MAX_DOCUMENT_BYTES + _MULTIPART_OVERHEAD,
+    "/api/generate_poster": UPLOAD_MAX_IMAGE_BYTES + _MULTIPART_OVERHEAD,
+}
+_DEFAULT_LIMIT = max(UPLOAD_ROUTE_LIMITS.values())
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File tải lên quá lớn (tối đa {limit // (1024 * 1024)} MB).")
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware: hard cap on multipart request bodies, enforced while reading."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") not in ("POST", "PUT"):
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        limit = UPLOAD_ROUTE_LIMITS.get(scope.get("path", ""), _DEFAULT_LIMIT)
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            return await self._reject(scope, receive, send, limit)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing, so this becomes the 413 response
+                    raise _too_large(limit)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            # Raised while a route outside FastAPI's handler was reading the body
+            if e.status_code != 413 or response_started:
+                raise
+            await self._reject(scope, receive, send, limit)
+
+    @staticmethod
+    async def _reject(scope, receive, send, limit: int):
+        logger.warning("Rejected upload to %s over %d bytes", scope.get("path"), limit)
+        err = _too_large(limit)
+        response = JSONResponse({"detail": err.detail}, status_code=413, headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+
+@dataclass
+class OpenedUpload:
+    """A validated upload: the spooled handle (rewound), its size and SHA-256."""
+
+    file: BinaryIO
+    size: int
+    sha256: str
+    filename: str
+
+
+def _hash_and_size(fh: BinaryIO, max_bytes: int) -> tuple[int, str]:
+    fh.seek(0)
+    h = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = fh.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large(max_bytes)
+        h.update(chunk)
+    fh.seek(0)
+    return size, h.hexdigest()
+
+
+async def open_upload(upload: UploadFile, max_bytes: int) -> OpenedUpload:
+    """Check the per-file limit and hash the spooled upload without copying it."""
+    size, digest = await run_in_threadpool(_hash_and_size, upload.file, max_bytes)
+    if size == 0:
+        raise HTTPException(status_code=400, detail="File tải lên rỗng.")
+    return OpenedUpload(file=upload.file, size=size, sha256=digest, filename=upload.filename or "")
+
+
+def _copy_to(fh: BinaryIO, dest: Path, max_bytes: int) -> int:
+    fh.seek(0)
+    size = 0
+    try:
+        with open(dest, "wb") as out:
+            while True:
+                chunk = fh.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                out.write(chunk)
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+    finally:
+        # Callers fall back to reading the handle when the copy fails, so always rewind
+        fh.seek(0)
+    return size
+
+
+async def save_upload(upload: UploadFile, dest: Path, max_bytes: int) -> Optional[Path]:
+    """Stream the spooled upload to `dest` in chunks; None if the file can't be written."""
+    try:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        await run_in_threadpool(_copy_to, upload.file, dest, max_bytes)
+        return dest
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.warning("Failed to save upload to %s: %s", dest, e)
+        return None
+
+
+__all__ = [
+    "UPLOAD_MAX_DOCUMENT_BYTES",
+    "UPLOAD_MAX_IMAGE_BYTES",
+    "UploadLimitMiddleware",
+    "OpenedUpload",
+    "open_upload",
+    "save_upload",
+]
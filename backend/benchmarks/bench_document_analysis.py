@@ -0,0 +1,122 @@
+"""End-to-end latency of document analysis without a product name (/api/analyze_document).
+
+Compares the previous two-call flow (raw file to Gemini for the product name,
+then the text analysis) with the current single structured call. The old
+detection call lives here only; production code no longer uploads the file
+for it.
+
+    cd backend && python benchmarks/bench_document_analysis.py [--file doc.pdf] [--runs 5]
+
+Runs against the offline fake provider unless LLM_PROVIDER is set. The fake
+latency can be tuned with LLM_FAKE_LATENCY_MEDIAN / LLM_FAKE_LATENCY_SIGMA.
+With a real GEMINI_API_KEY (LLM_PROVIDER=gemini) it measures the live API.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("LLM_FAKE_LATENCY_MEDIAN", "1.5")
+os.environ.setdefault("LLM_FAKE_LATENCY_SIGMA", "0.2")
+
+from core.document_analysis import generate_product_analysis_from_document  # noqa: E402
+from core.json_extract import JSONExtractError, extract_object  # noqa: E402
+from core.llm_gateway import gateway, ModelCandidate  # noqa: E402
+from core.llm_metrics import metrics  # noqa: E402
+from google.genai import types  # noqa: E402
+
+SAMPLE_TEXT = (
+    "Máy lọc nước AquaPure X5 — công nghệ RO 9 cấp lọc, bù khoáng tự nhiên.\n"
+    "Công suất 20 lít/giờ, tủ đứng gọn, lõi lọc thay sau 12 tháng, bảo hành 36 tháng.\n"
+    "Phù hợp gia đình 4-6 người ở thành phố, nơi nguồn nước nhiễm vôi và clo.\n"
+) * 40
+
+
+_MIME_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "txt": "text/plain",
+}
+_DETECT_PROMPT = """
+Bạn là một chuyên gia marketing.
+Nhiệm vụ: đọc tài liệu (PDF/DOC/TXT) được gửi kèm và xác định 1 sản phẩm/chương trình/dịch vụ CHÍNH đang được quảng bá.
+
+Quy tắc:
+- Nếu có nhiều sản phẩm, hãy chọn sản phẩm làm trọng tâm, được nhắc đến nhiều nhất hoặc rõ nhất.
+- Không bịa thêm tên sản phẩm nếu tài liệu không đề cập.
+
+ĐẦU RA BẮT BUỘC: trả về DUY NHẤT một JSON hợp lệ, KHÔNG thêm chữ nào khác:
+{
+  "product_name": "tên sản phẩm chính hoặc null nếu không rõ",
+  "confidence": 0.0-1.0,
+  "reason": "giải thích ngắn (tối đa 40 từ) vì sao chọn tên này"
+}
+"""
+
+
+def detect_product_name(file_bytes: bytes, file_type: str):
+    """The removed first call of the old flow: the raw file goes to Gemini just to name the product."""
+    contents = [types.Part.from_bytes(data=file_bytes, mime_type=_MIME_TYPES[file_type]), _DETECT_PROMPT]
+    cfg = types.GenerateContentConfig(response_mime_type="application/json")
+    response = gateway.generate_content([ModelCandidate("gemini-2.5-flash", cfg)], contents, operation="detect_product_name")
+    try:
+        data = extract_object(getattr(response, "text", None) or "")
+    except JSONExtractError:
+        return None
+    name = data.get("product_name") if isinstance(data, dict) else None
+    return name.strip() or None if isinstance(name, str) else None
+
+
+def legacy(file_bytes: bytes, file_type: str):
+    name = detect_product_name(file_bytes, file_type)
+    return generate_product_analysis_from_document(name or "Sản phẩm", file_bytes, file_type)
+
+
+def single_pass(file_bytes: bytes, file_type: str):
+    return generate_product_analysis_from_document("", file_bytes, file_type)
+
+
+def _calls() -> int:
+    return sum(row["calls"] for row in metrics.summary())
+
+
+def _run(fn, file_bytes: bytes, file_type: str, runs: int) -> tuple[list[float], float]:
+    times = []
+    before = _calls()
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn(file_bytes, file_type)
+        times.append(time.perf_counter() - start)
+        if result is None:
+            print(f"  {fn.__name__}: analysis returned None")
+    return times, (_calls() - before) / runs
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--file", help="pdf/docx/txt document (default: built-in Vietnamese product sheet)")
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            file_bytes = f.read()
+        file_type = args.file.rsplit(".", 1)[-1].lower()
+    else:
+        file_bytes, file_type = SAMPLE_TEXT.encode("utf-8"), "txt"
+
+    print(f"provider={os.environ['LLM_PROVIDER']} file_type={file_type} size={len(file_bytes)} bytes runs={args.runs}\n")
+    print(f"{'flow':<14}{'calls/run':>10}{'p50 s':>10}{'mean s':>10}{'max s':>10}")
+    for fn in (legacy, single_pass):
+        times, calls = _run(fn, file_bytes, file_type, args.runs)
+        print(f"{fn.__name__:<14}{calls:>10.1f}{statistics.median(times):>10.2f}{statistics.mean(times):>10.2f}{max(times):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Context sent per follow-up question: re-upload vs top-k chunks from the document index.
+
+A product document is generated with `--sections` sections of boilerplate.
+Each topic (battery, display, camera, ...) has one section, and the topic
+sections are spread through the document, so some fall past the 15,000
+characters a re-upload reads. For each question the benchmark reports:
+  context chars  document text in the prompt (re-upload: the first 15,000)
+  hit            the re-upload window / the top-k chunks contain the asked topic
+  rank           position of the topic's chunk among the top-k (1 = best, - = missed)
+
+    cd backend && python benchmarks/bench_document_query.py [--sections 120] [--top-k 4] [--embedder hashing]
+
+Retrieval only; no model call is made. Prompt tokens are roughly chars / 4.
+The hashing embedder is lexical: an English question over a Vietnamese
+document only matches shared terms (5G, NFC, camera); use --embedder gemini
+for cross-language questions.
+"""
+import os
+import sys
+import time
+import argparse
+import hashlib
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+
+REUPLOAD_CHARS = 15000
+
+# topic -> (marker in the section, section text, questions)
+TOPICS = {
+    "battery": (
+        "Pin và sạc",
+        "Dung lượng pin 5000 mAh, sạc nhanh 33W, sạc đầy trong 55 phút, pin Li-ion dùng 2 ngày.",
+        ["now pull out the battery specs", "liệt kê thông số pin và thời gian sạc"],
+    ),
+    "display": (
+        "Màn hình",
+        "Màn hình AMOLED 6.7 inch, độ phân giải 2400x1080, tần số quét 120Hz, độ sáng 1200 nits.",
+        ["màn hình bao nhiêu inch, tần số quét?", "display resolution and brightness"],
+    ),
+    "camera": (
+        "Camera",
+        "Camera chính 50MP khẩu độ f/1.8, góc siêu rộng 12MP, quay video 4K 60fps, chống rung OIS.",
+        ["viết copy về camera", "camera megapixels and video recording"],
+    ),
+    "warranty": (
+        "Bảo hành",
+        "Bảo hành chính hãng 18 tháng, đổi mới trong 30 ngày nếu lỗi nhà sản xuất, bảo hành tận nhà.",
+        ["chính sách bảo hành và đổi trả", "warranty period"],
+    ),
+    "size": (
+        "Kích thước và trọng lượng",
+        "Kích thước 162 x 75 x 8.1 mm, trọng lượng 189 g, khung nhôm, mặt lưng kính cường lực.",
+        ["máy nặng bao nhiêu gram, kích thước?", "weight and dimensions"],
+    ),
+    "connectivity": (
+        "Kết nối",
+        "Hỗ trợ 5G, Wi-Fi 6E, Bluetooth 5.3, NFC thanh toán, cổng USB-C 3.2, hai SIM.",
+        ["các chuẩn kết nối không dây", "does it support 5G and NFC"],
+    ),
+}
+BOILERPLATE = (
+    "Sản phẩm được thiết kế cho người dùng hiện đại, tinh gọn và bền bỉ. Đọc kỹ hướng dẫn an toàn trước khi sử dụng, "
+    "không tự ý tháo rời thiết bị. Giữ sản phẩm tránh xa nguồn nhiệt và nơi ẩm ướt."
+)
+
+
+def make_document(sections: int) -> str:
+    """Product-line boilerplate sections, with each topic's section once, spread through the document."""
+    names = list(TOPICS)
+    at = {(i + 1) * sections // (len(names) + 1): topic for i, topic in enumerate(names)}
+    parts = []
+    for s in range(sections):
+        if s in at:
+            marker, body, _ = TOPICS[at[s]]
+            parts.append(f"Phần {s + 1}. {marker}\n{body}\n{BOILERPLATE}")
+        else:
+            parts.append(f"Phần {s + 1}. Dòng sản phẩm X{s}\n{BOILERPLATE}\nPhiên bản X{s} có nhiều màu sắc, phù hợp văn phòng và gia đình.")
+    return "\n\n".join(parts)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sections", type=int, default=120)
+    ap.add_argument("--top-k", type=int, default=4)
+    ap.add_argument("--embedder", default="hashing")
+    args = ap.parse_args(argv)
+
+    os.environ["DOCUMENT_INDEX_DIR"] = tempfile.mkdtemp(prefix="bench-index-")
+    os.environ["DOCUMENT_INDEX_EMBEDDER"] = args.embedder
+    from core.document_index import build_index, search_index, get_embedder, index_store
+
+    text = make_document(args.sections)
+    start = time.perf_counter()
+    index = build_index(hashlib.sha256(text.encode("utf-8")).hexdigest(), text, "spec.txt", "X", embedder=get_embedder(args.embedder))
+    build_s = time.perf_counter() - start
+    index_store.save("bench@example.com", index)
+    size = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(os.environ["DOCUMENT_INDEX_DIR"]) for f in fs)
+    print(f"document: {len(text):,} chars, {args.sections} sections -> {len(index.chunks)} chunks, "
+          f"index built in {build_s:.2f}s via {index.embedder}, {size / 1024:.0f} KB on disk\n")
+
+    window = text[:REUPLOAD_CHARS]
+    print(f"{'question':<44}{'re-upload':>10}{'hit':>5}{'top-k':>8}{'hit':>5}{'rank':>6}{'ms':>7}")
+    totals = {"re": 0, "re_hit": 0, "k": 0, "k_hit": 0, "top1": 0, "n": 0}
+    for topic, (marker, _, questions) in TOPICS.items():
+        for q in questions:
+            start = time.perf_counter()
+            hits = search_index(index, q, args.top_k)
+            ms = (time.perf_counter() - start) * 1000
+            chars = sum(len(h.text) for h in hits)
+            rank = next((r for r, h in enumerate(hits, start=1) if marker in h.text), None)
+            re_hit = marker in window
+            print(f"{q[:42]:<44}{len(window):>10,}{'yes' if re_hit else 'no':>5}{chars:>8,}"
+                  f"{'yes' if rank else 'no':>5}{rank or '-':>6}{ms:>7.1f}")
+            totals["re"] += len(window)
+            totals["re_hit"] += re_hit
+            totals["k"] += chars
+            totals["k_hit"] += rank is not None
+            totals["top1"] += rank == 1
+            totals["n"] += 1
+    n = totals["n"]
+    print(f"\navg context: re-upload {totals['re'] / n:,.0f} chars (~{totals['re'] / n / 4:,.0f} tokens), "
+          f"top-{args.top_k} {totals['k'] / n:,.0f} chars (~{totals['k'] / n / 4:,.0f} tokens), "
+          f"{totals['k'] / totals['re']:.0%} of re-upload")
+    print(f"hit rate: re-upload {totals['re_hit']}/{n}, top-{args.top_k} {totals['k_hit']}/{n}; "
+          f"ranked first {totals['top1']}/{n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Speed, peak RSS and table coverage of DOCX extraction: python-docx vs the streaming reader.
+
+Modes (each run in a fresh subprocess so RSS is not shared):
+  legacy         python-docx, `document.paragraphs` (the previous code; no tables)
+  stream_budget  extract_docx_text(max_chars=--budget)
+  stream_full    extract_docx_text(max_chars=None)
+
+    cd backend && python benchmarks/bench_docx_extract.py [--sections 400] [--file spec.docx] [--budget 15000]
+
+/api/analyze_document reads 15,000 characters per analysis call, and up to
+192,000 in chunked mode. Without --file a spec sheet is generated. Each
+section has a few boilerplate paragraphs followed by a spec table. `specs`
+counts how many table values appear in the first 15,000 characters of the
+output (only for the generated file).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import zipfile
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.bench_parse_sandbox import _CONTENT_TYPES, _DOC_HEAD, _DOC_TAIL, _RELS  # noqa: E402
+
+MODES = ("legacy", "stream_budget", "stream_full")
+BUDGET = 15000
+ROWS_PER_TABLE = 12
+
+
+def _p(text: str) -> bytes:
+    return b"<w:p><w:r><w:t xml:space=\"preserve\">" + text.encode("utf-8") + b"</w:t></w:r></w:p>"
+
+
+def _row(*cells: str) -> bytes:
+    return b"<w:tr>" + b"".join(b"<w:tc>" + _p(c) + b"</w:tc>" for c in cells) + b"</w:tr>"
+
+
+def make_spec_docx(path: str, sections: int) -> None:
+    """Generated spec sheet: boilerplate paragraphs then a spec table, per section."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _RELS)
+        with zf.open("word/document.xml", "w", force_zip64=True) as doc:
+            doc.write(_DOC_HEAD)
+            for s in range(sections):
+                body = [_p(f"Model X{s} — product line overview")]
+                body += [
+                    _p(f"Section {s}.{i}: read all safety instructions before installation. Keep the unit away "
+                       f"from direct sunlight and do not disassemble; warranty is void if seals are broken.")
+                    for i in range(3)
+                ]
+                rows = [_row("Parameter", "Value")]
+                rows += [_row(f"Spec {k}", f"SPEC-{s:04d}-{k:02d}") for k in range(ROWS_PER_TABLE)]
+                body.append(b"<w:tbl>" + b"".join(rows) + b"</w:tbl>")
+                doc.write(b"".join(body))
+            doc.write(_DOC_TAIL)
+
+
+# ---------- child ----------
+def _legacy(path: str) -> str:
+    import docx
+    document = docx.Document(path)
+    return "\n".join(p.text for p in document.paragraphs)
+
+
+def _child(mode: str, path: str, budget: int) -> None:
+    from core.docx_extract import extract_docx_text
+    start = time.perf_counter()
+    if mode == "legacy":
+        text = _legacy(path)
+    elif mode == "stream_budget":
+        text = extract_docx_text(path, budget)
+    else:
+        text = extract_docx_text(path, None)
+    seconds = time.perf_counter() - start
+    head = text[:BUDGET]
+    out = {"seconds": seconds, "chars": len(text), "specs": head.count("SPEC-")}
+    try:
+        import resource
+        out["rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        pass
+    print(json.dumps(out))
+
+
+# ---------- parent ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sections", type=int, default=400)
+    ap.add_argument("--file", help="existing .docx instead of the generated one")
+    ap.add_argument("--budget", type=int, default=BUDGET)
+    ap.add_argument("--modes", default=",".join(MODES))
+    ap.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    ap.add_argument("--path", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        _child(args.child, args.path, args.budget)
+        return
+
+    tmp = None
+    if args.file:
+        path = args.file
+    else:
+        fd, tmp = tempfile.mkstemp(suffix=".docx")
+        os.close(fd)
+        make_spec_docx(tmp, args.sections)
+        path = tmp
+    try:
+        print(f"docx: {path} ({os.path.getsize(path) / 1e6:.1f} MB)\n")
+        print(f"{'mode':<15}{'seconds':>9}{'chars':>12}{'rss MB':>9}{'specs in first 15k':>20}")
+        for mode in args.modes.split(","):
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode, "--path", path, "--budget", str(args.budget)],
+                capture_output=True, text=True, cwd=BACKEND_DIR,
+            )
+            if proc.returncode != 0:
+                print(f"{mode:<15} failed: {proc.stderr.strip().splitlines()[-1:]}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{mode:<15}{r['seconds']:>9.2f}{r['chars']:>12,}{r.get('rss_mb', 0):>9.1f}{r['specs']:>20}")
+    finally:
+        if tmp:
+            os.remove(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Microbenchmark for core/json_extract.py over benchmarks/json_corpus.jsonl.
+
+Reports parses/second and success rate per failure kind, next to the legacy
+pipeline the modules used before (fence replace + json.loads + balanced-brace
+scan). A sample succeeds when the extracted object has all of its
+`expect_keys`; samples with `expect_keys: null` succeed when extraction fails.
+
+    cd backend && python benchmarks/bench_json_extract.py [--corpus PATH] [--seconds 1.0]
+
+Samples captured in production (JSON_EXTRACT_CAPTURE_PATH) have the same
+format and can be appended to the corpus; they carry no `expect_keys` and
+count as a success when any object is recovered.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from core.json_extract import JSONExtractError, extract_object  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_corpus.jsonl")
+
+
+# ---------- legacy baseline (what the modules did before json_extract) ----------
+def _legacy_fragment(text):
+    start = text.find('{')
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        else:
+            if ch == '"':
+                in_string = True
+            elif ch == '{':
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+                if depth == 0:
+                    return text[start:i+1]
+    return None
+
+
+def legacy_extract(text):
+    cleaned = text.strip().replace("```json", "").replace("```", "").strip()
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError:
+        frag = _legacy_fragment(cleaned)
+        if frag is None:
+            raise ValueError("no fragment")
+        data = json.loads(frag)
+    if not isinstance(data, dict):
+        raise ValueError("not an object")
+    return data
+
+
+# ---------- harness ----------
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _succeeds(fn, sample) -> bool:
+    expect = sample.get("expect_keys", ())
+    try:
+        data = fn(sample["text"])
+    except (JSONExtractError, ValueError):
+        return expect is None
+    if expect is None:
+        return False
+    return all(k in data for k in expect)
+
+
+def _throughput(fn, samples, seconds: float) -> float:
+    n = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for s in samples:
+            try:
+                fn(s["text"])
+            except (JSONExtractError, ValueError):
+                pass
+        n += len(samples)
+    return n / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--corpus", default=DEFAULT_CORPUS)
+    ap.add_argument("--seconds", type=float, default=1.0, help="timing budget per implementation")
+    args = ap.parse_args(argv)
+
+    samples = load_corpus(args.corpus)
+    impls = {"json_extract": extract_object, "legacy": legacy_extract}
+
+    by_kind = defaultdict(lambda: defaultdict(int))
+    totals = defaultdict(int)
+    failures = defaultdict(list)
+    for s in samples:
+        kind = s.get("kind", "captured")
+        by_kind[kind]["n"] += 1
+        for name, fn in impls.items():
+            ok = _succeeds(fn, s)
+            by_kind[kind][name] += ok
+            totals[name] += ok
+            if not ok:
+                failures[name].append(s.get("id"))
+
+    print(f"corpus: {args.corpus} ({len(samples)} samples)\n")
+    print(f"{'kind':<16}{'n':>4}" + "".join(f"{name:>14}" for name in impls))
+    for kind in sorted(by_kind):
+        row = by_kind[kind]
+        print(f"{kind:<16}{row['n']:>4}" + "".join(f"{row[name]:>14}" for name in impls))
+    print()
+    for name, fn in impls.items():
+        rate = totals[name] / len(samples) if samples else 0.0
+        pps = _throughput(fn, samples, args.seconds)
+        print(f"{name:<14} success {rate:6.1%}   {pps:>12,.0f} parses/s")
+        if failures[name]:
+            print(f"{'':<14} failed: {', '.join(failures[name])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Vision/OCR cost of scanned PDFs: whole-file vs routing only the image-only pages.
+
+Documents (generated, text pages from bench_pdf_extract.make_pdf's layout plus
+scanned pages carrying one ~`--scan-kb` KB image and no text layer):
+  mixed    `--pages` pages, every `--scan-every`-th page scanned
+  scanned  `--scanned-pages` pages, all scanned
+
+Strategies:
+  before   text layer only; the raw file goes to the model when there is no text
+           at all (the previous code: a mixed document loses its scanned pages)
+  whole    any scanned page sends the whole file to the vision model
+  routed   core.ocr: image-only pages copied into small PDFs, OCR_BATCH_PAGES each
+
+    cd backend && python benchmarks/bench_ocr_routing.py [--pages 40] [--scan-every 10] [--scan-kb 400]
+
+Vision input is billed per page (each PDF page counts as an image), so `page
+share` is the cost; bytes sent are mostly the scan images either way.
+The OCR backend is the local stub (OCR_BACKEND=stub) unless set otherwise, so
+`seconds` is the classification and page-copy overhead, not model latency.
+"""
+import os
+import sys
+import time
+import argparse
+import random
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("OCR_BACKEND", "stub")
+
+BUDGET = 192000  # chunked analysis reads up to DOCUMENT_MAX_CHUNKS x DOCUMENT_CHUNK_CHARS
+
+
+# ---------- sample documents ----------
+def make_mixed_pdf(n_pages: int, scanned: set, scan_bytes: int, lines_per_page: int = 45) -> bytes:
+    """Text pages plus image-only pages (one DCT image each, random bytes of JPEG-like size)."""
+    rng = random.Random(0)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # pages tree
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for p in range(n_pages):
+        if p in scanned:
+            image = rng.randbytes(scan_bytes)
+            objects.append(
+                b"<< /Type /XObject /Subtype /Image /Width 1654 /Height 2339 /ColorSpace /DeviceGray "
+                b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n" % len(image) + image + b"\nendstream"
+            )
+            image_id = len(objects)
+            stream = b"q 595 0 0 842 0 0 cm /Im0 Do Q"
+            resources = b"/XObject << /Im0 %d 0 R >>" % image_id
+        else:
+            lines = [
+                f"Page {p + 1} line {i + 1}: Model X{p % 7}-{i} stainless body, 12 month warranty, 2.4 kg, eco mode."
+                for i in range(lines_per_page)
+            ]
+            stream = ("BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET").encode("latin-1")
+            resources = b"/Font << /F1 3 0 R >>"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << %s >> /Contents %d 0 R >>"
+            % (resources, content_id)
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), n_pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+# ---------- strategies ----------
+def _before(data: bytes, n_pages: int, n_scanned: int) -> dict:
+    from core.parse_sandbox import parse_document
+    text = parse_document("pdf", data, BUDGET)
+    if text.strip():
+        return {"pages_sent": 0, "bytes_sent": 0, "scanned_read": 0}
+    return {"pages_sent": n_pages, "bytes_sent": len(data), "scanned_read": n_scanned}
+
+
+def _whole(data: bytes, n_pages: int, n_scanned: int) -> dict:
+    from core.parse_sandbox import parse_pdf_scan
+    scan = parse_pdf_scan(data, BUDGET, max_image_pages=n_pages)
+    if not scan.batches:
+        return {"pages_sent": 0, "bytes_sent": 0, "scanned_read": 0}
+    return {"pages_sent": n_pages, "bytes_sent": len(data), "scanned_read": n_scanned}
+
+
+def _routed(data: bytes, n_pages: int, n_scanned: int) -> dict:
+    from core.document_analysis import extract_text_from_pdf
+    from core.ocr import ocr_stats
+    before = ocr_stats()
+    text = extract_text_from_pdf(data, BUDGET)
+    after = ocr_stats()
+    return {
+        "pages_sent": after["pages_sent"] - before["pages_sent"],
+        "bytes_sent": (after["mb_sent"] - before["mb_sent"]) * 1024 * 1024,
+        "scanned_read": sum(1 for page in text.split("\f") if page.startswith(("[OCR]", "Trang scan"))),
+    }
+
+
+STRATEGIES = {"before": _before, "whole": _whole, "routed": _routed}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--pages", type=int, default=40)
+    ap.add_argument("--scan-every", type=int, default=10)
+    ap.add_argument("--scanned-pages", type=int, default=10)
+    ap.add_argument("--scan-kb", type=int, default=400, help="image bytes per scanned page")
+    ap.add_argument("--strategies", default=",".join(STRATEGIES))
+    args = ap.parse_args(argv)
+
+    # Import the app modules up front so `seconds` doesn't include them
+    import core.document_analysis  # noqa: F401
+    from core.parse_sandbox import shutdown_parse_pool
+
+    mixed_scanned = {p for p in range(args.pages) if p % args.scan_every == args.scan_every - 1}
+    docs = [
+        ("mixed", args.pages, mixed_scanned),
+        ("scanned", args.scanned_pages, set(range(args.scanned_pages))),
+    ]
+    try:
+        for name, n_pages, scanned in docs:
+            data = make_mixed_pdf(n_pages, scanned, args.scan_kb * 1024)
+            print(f"\n{name}: {n_pages} pages, {len(scanned)} scanned, {len(data) / 1e6:.1f} MB")
+            print(f"{'strategy':<10}{'pages sent':>12}{'MB sent':>10}{'page share':>12}{'scanned read':>14}{'seconds':>9}")
+            for strategy in args.strategies.split(","):
+                start = time.perf_counter()
+                r = STRATEGIES[strategy](data, n_pages, len(scanned))
+                seconds = time.perf_counter() - start
+                share = r["pages_sent"] / n_pages
+                print(f"{strategy:<10}{r['pages_sent']:>12}{r['bytes_sent'] / 1e6:>10.2f}{share:>12.0%}"
+                      f"{r['scanned_read']:>9}/{len(scanned):<4}{seconds:>9.2f}")
+    finally:
+        shutdown_parse_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Throughput and isolation of document parsing with good and adversarial files.
+
+Parses a mixed batch, `--good` normal PDFs/DOCX plus one of each adversarial
+file:
+  slow_pdf    one page with millions of text operators (flate-compressed, small on disk)
+  docx_bomb   one paragraph of millions of runs: under 1 MB zipped, hundreds of MB as XML
+  garbage     random bytes named .pdf
+
+Each mode runs in a fresh subprocess:
+  in_process  PARSE_SANDBOX=0, parsers in the calling threads (the previous behaviour)
+  sandbox     core.parse_sandbox worker pool (timeout + RSS cap + restarts)
+
+    cd backend && python benchmarks/bench_parse_sandbox.py [--good 40] [--threads 2] [--clean]
+
+`--clean` leaves the adversarial files out, for the sandbox's overhead on
+normal uploads.
+
+The in_process child gets RLIMIT_AS (--inproc-mem-mb) and a wall-clock limit
+(--inproc-timeout) so a bomb can't take the host down; hitting either is the
+outcome being measured.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import zipfile
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.bench_pdf_extract import make_pdf  # noqa: E402
+
+MODES = ("in_process", "sandbox")
+BUDGET = 15000
+
+
+# ---------- sample documents ----------
+def make_slow_pdf(ops: int = 3_000_000) -> bytes:
+    """Single page whose (compressed) content stream has `ops` show-text operators."""
+    content = zlib.compress(b"BT /F1 9 Tf 40 800 Td " + b"(x) Tj " * ops + b"ET", 9)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [5 0 R] /Count 1 >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents 4 0 R >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+_CONTENT_TYPES = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    b'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    b'<Default Extension="xml" ContentType="application/xml"/>'
+    b'<Override PartName="/word/document.xml" '
+    b'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    b"</Types>"
+)
+_RELS = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    b'<Relationship Id="rId1" '
+    b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    b'Target="word/document.xml"/></Relationships>'
+)
+_DOC_HEAD = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+)
+_DOC_TAIL = b"</w:body></w:document>"
+
+
+def make_docx_xml(body_chunks, path: str) -> None:
+    """Minimal .docx (no styles part) whose body is the concatenated XML chunks."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _RELS)
+        with zf.open("word/document.xml", "w", force_zip64=True) as doc:
+            doc.write(_DOC_HEAD)
+            for chunk in body_chunks:
+                doc.write(chunk)
+            doc.write(_DOC_TAIL)
+
+
+def make_docx(paragraphs, path: str) -> None:
+    """Minimal .docx from an iterable of paragraph byte strings."""
+    make_docx_xml((b"<w:p><w:r><w:t>" + text + b"</w:t></w:r></w:p>" for text in paragraphs), path)
+
+
+def _bomb_body(runs: int = 8_000_000):
+    # A paragraph only ends at </w:p>, so every run stays in the parse tree until then
+    yield b"<w:p>"
+    run = b"<w:r><w:t>x</w:t></w:r>" * 10000
+    for _ in range(runs // 10000):
+        yield run
+    yield b"</w:p>"
+
+
+def build_corpus(workdir: str, n_good: int, adversarial: bool = True) -> list[tuple[str, str, str]]:
+    """[(kind, file_type, path)]: good files with the adversarial ones spread through the batch."""
+    good_pdf = os.path.join(workdir, "good.pdf")
+    with open(good_pdf, "wb") as f:
+        f.write(make_pdf(40))
+    good_docx = os.path.join(workdir, "good.docx")
+    make_docx((f"Section {i}: stainless body, 12 month warranty, eco mode.".encode() for i in range(600)), good_docx)
+    good = [("good", "pdf" if i % 2 == 0 else "docx", good_pdf if i % 2 == 0 else good_docx) for i in range(n_good)]
+    if not adversarial:
+        return good
+    slow = os.path.join(workdir, "slow.pdf")
+    with open(slow, "wb") as f:
+        f.write(make_slow_pdf())
+    bomb = os.path.join(workdir, "bomb.docx")
+    make_docx_xml(_bomb_body(), bomb)
+    garbage = os.path.join(workdir, "garbage.pdf")
+    with open(garbage, "wb") as f:
+        f.write(random.Random(0).randbytes(2 * 1024 * 1024))
+
+    bad = [("slow_pdf", "pdf", slow), ("docx_bomb", "docx", bomb), ("garbage", "pdf", garbage)]
+    for j, item in enumerate(bad):
+        good.insert((j + 1) * len(good) // (len(bad) + 1), item)
+    return good
+
+
+# ---------- child ----------
+def _child(corpus_path: str, threads: int) -> None:
+    from core.document_analysis import extract_text
+    from core.parse_sandbox import DocumentRejectedError, parse_stats, shutdown_parse_pool
+
+    with open(corpus_path) as f:
+        corpus = json.load(f)
+
+    def one(item):
+        kind, file_type, path = item
+        start = time.perf_counter()
+        try:
+            with open(path, "rb") as fh:
+                text = extract_text(fh, file_type, BUDGET)
+            outcome = "ok" if text else "empty"
+        except DocumentRejectedError as e:
+            outcome = f"rejected:{e.reason}"
+        except MemoryError:
+            outcome = "MemoryError"
+        return {"kind": kind, "outcome": outcome, "seconds": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        rows = list(pool.map(one, corpus))
+    out = {"seconds": time.perf_counter() - start, "rows": rows, "parse": parse_stats()}
+    shutdown_parse_pool()
+    import resource
+    out["rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(out))
+
+
+def _limit_child(mem_mb: int):
+    def apply():
+        import resource
+        limit = mem_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return apply
+
+
+# ---------- parent ----------
+def _report(mode: str, r: dict) -> None:
+    good = [row for row in r["rows"] if row["kind"] == "good"]
+    good_ok = [row for row in good if row["outcome"] == "ok"]
+    good_s = sorted(row["seconds"] for row in good_ok) or [0.0]
+    print(f"\n{mode}: {r['seconds']:.1f}s wall, {len(good_ok)}/{len(good)} good ok, "
+          f"{len(good_ok) / r['seconds']:.1f} good docs/s, good p50 {good_s[len(good_s) // 2]:.2f}s "
+          f"max {good_s[-1]:.2f}s, peak RSS {r['rss_mb']:.0f} MB")
+    for row in r["rows"]:
+        if row["kind"] != "good":
+            print(f"  {row['kind']:<10} {row['outcome']:<18} {row['seconds']:.2f}s")
+    if mode == "sandbox":
+        p = r["parse"]
+        print(f"  workers started {p['workers_started']}, peak worker RSS {p['peak_worker_rss_mb']} MB, rejected {p['rejected']}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--good", type=int, default=40)
+    ap.add_argument("--threads", type=int, default=2, help="concurrent parses (= PARSE_WORKERS in sandbox mode)")
+    ap.add_argument("--modes", default=",".join(MODES))
+    ap.add_argument("--inproc-mem-mb", type=int, default=3072)
+    ap.add_argument("--inproc-timeout", type=float, default=120)
+    ap.add_argument("--clean", action="store_true", help="good files only")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--corpus", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        _child(args.corpus, args.threads)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="bench-parse-") as workdir:
+        corpus = build_corpus(workdir, args.good, adversarial=not args.clean)
+        corpus_path = os.path.join(workdir, "corpus.json")
+        with open(corpus_path, "w") as f:
+            json.dump(corpus, f)
+        print(f"{len(corpus)} files ({args.good} good + {len(corpus) - args.good} adversarial), {args.threads} concurrent parses, budget {BUDGET} chars")
+
+        for mode in args.modes.split(","):
+            env = dict(os.environ, LLM_PROVIDER=os.getenv("LLM_PROVIDER", "fake"), PARSE_WORKERS=str(args.threads))
+            env["PARSE_SANDBOX"] = "0" if mode == "in_process" else "1"
+            cmd = [sys.executable, os.path.abspath(__file__), "--child", "--corpus", corpus_path, "--threads", str(args.threads)]
+            start = time.perf_counter()
+            try:
+                proc = subprocess.run(
+                    cmd, capture_output=True, text=True, cwd=BACKEND_DIR, env=env,
+                    timeout=args.inproc_timeout if mode == "in_process" else None,
+                    preexec_fn=_limit_child(args.inproc_mem_mb) if mode == "in_process" else None,
+                )
+            except subprocess.TimeoutExpired:
+                print(f"\n{mode}: still parsing after {args.inproc_timeout:.0f}s, killed (the API worker would be stuck)")
+                continue
+            if proc.returncode != 0:
+                last = (proc.stderr.strip().splitlines() or ["?"])[-1]
+                print(f"\n{mode}: process died after {time.perf_counter() - start:.1f}s (exit {proc.returncode}): {last}")
+                continue
+            _report(mode, json.loads(proc.stdout.strip().splitlines()[-1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Wall time and peak RSS of PDF text extraction on a large multi-page PDF.
+
+Modes (each run in a fresh subprocess so RSS is not shared):
+  legacy         every page, `text += page.extract_text()` (the previous code)
+  budget         extract_pdf_text(max_chars=15000), what /api/analyze_document uses
+  full_seq       extract_pdf_text(max_chars=None, parallel=False)
+  full_parallel  extract_pdf_text(max_chars=None), page ranges in the process pool
+
+    cd backend && python benchmarks/bench_pdf_extract.py [--pages 200] [--file catalogue.pdf]
+
+Without --file a text-only PDF with `--pages` pages is generated. Peak RSS
+comes from `resource` (POSIX only); `children` is the largest pool worker.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+MODES = ("legacy", "budget", "full_seq", "full_parallel")
+BUDGET = 15000
+
+
+# ---------- sample document ----------
+def make_pdf(n_pages: int, lines_per_page: int = 45) -> bytes:
+    """Minimal text PDF (Helvetica, ASCII) built by hand; no writer dependency."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # pages tree, filled in once the kids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for p in range(n_pages):
+        lines = [
+            f"Page {p + 1} line {i + 1}: Model X{p % 7}-{i} stainless body, 12 month warranty, 2.4 kg, eco mode."
+            for i in range(lines_per_page)
+        ]
+        body = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), n_pages
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+# ---------- child ----------
+def _legacy(file_bytes: bytes) -> str:
+    from io import BytesIO
+    from pypdf import PdfReader
+    reader = PdfReader(BytesIO(file_bytes))
+    text = ""
+    for page in reader.pages:
+        text += page.extract_text() or ""
+    return text
+
+
+def _child(mode: str, path: str) -> None:
+    from core.pdf_extract import extract_pdf_text, shutdown_pool
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    start = time.perf_counter()
+    if mode == "legacy":
+        text = _legacy(file_bytes)
+    elif mode == "budget":
+        text = extract_pdf_text(file_bytes, BUDGET)
+    elif mode == "full_seq":
+        text = extract_pdf_text(file_bytes, None, parallel=False)
+    else:
+        text = extract_pdf_text(file_bytes, None)
+    seconds = time.perf_counter() - start
+    shutdown_pool()  # reap the workers so their peak RSS is reported
+    out = {"seconds": seconds, "chars": len(text)}
+    try:
+        import resource
+        out["rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        out["children_rss_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    except ImportError:
+        pass
+    print(json.dumps(out))
+
+
+# ---------- parent ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--pages", type=int, default=200)
+    ap.add_argument("--file", help="existing PDF instead of the generated one")
+    ap.add_argument("--modes", default=",".join(MODES))
+    ap.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    ap.add_argument("--path", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        _child(args.child, args.path)
+        return
+
+    tmp = None
+    if args.file:
+        path = args.file
+    else:
+        fd, tmp = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(make_pdf(args.pages))
+        path = tmp
+    try:
+        print(f"pdf: {path} ({os.path.getsize(path) / 1e6:.1f} MB), workers={os.getenv('PDF_EXTRACT_WORKERS', 'default')}\n")
+        print(f"{'mode':<15}{'seconds':>9}{'chars':>11}{'rss MB':>9}{'children':>10}")
+        for mode in args.modes.split(","):
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode, "--path", path],
+                capture_output=True, text=True, cwd=BACKEND_DIR,
+            )
+            if proc.returncode != 0:
+                print(f"{mode:<15} failed: {proc.stderr.strip().splitlines()[-1:]}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{mode:<15}{r['seconds']:>9.2f}{r['chars']:>11,}{r.get('rss_mb', 0):>9.1f}{r.get('children_rss_mb', 0):>10.1f}")
+    finally:
+        if tmp:
+            os.remove(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Peak server RSS while many large documents are uploaded at once.
+
+Starts uvicorn on the app (offline fake provider, throwaway SQLite files) and
+posts `--concurrency` distinct `--size-mb` text documents to
+/api/analyze_document at the same time. Bodies are generated lazily on the
+client, so only the server's memory is measured. Reports status codes, wall
+time, and the server's peak RSS (VmHWM, Linux only).
+
+    cd backend && python benchmarks/bench_uploads.py [--concurrency 50] [--size-mb 20]
+    cd backend && python benchmarks/bench_uploads.py --ref HEAD~1   # same load against an older commit
+
+`--ref` runs the server from a temporary `git worktree` of that commit, so the
+numbers before and after a change can be compared directly.
+"""
+import os
+import sys
+import time
+import json
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_LINE = "Máy lọc nước AquaPure X5 — RO 9 cấp lọc, bù khoáng, công suất 20 lít/giờ, bảo hành 36 tháng.\n".encode("utf-8")
+
+
+class LazyDocument:
+    """Read-only file object of `size` bytes, produced on demand (distinct per `seed`)."""
+
+    def __init__(self, size: int, seed: int):
+        self.size = size
+        self.pos = 0
+        self.head = f"Tài liệu #{seed}\n".encode("utf-8")
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        self.pos = {0: offset, 1: self.pos + offset, 2: self.size + offset}[whence]
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0:
+            n = self.size - self.pos
+        n = min(n, self.size - self.pos)
+        if n <= 0:
+            return b""
+        unit = self.head + _LINE * 64
+        start = self.pos % len(unit)
+        reps = (start + n) // len(unit) + 1
+        out = (unit * reps)[start:start + n]
+        self.pos += n
+        return out
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proc_status(pid: int) -> dict:
+    out = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    out[key] = int(value.split()[0]) / 1024  # kB -> MB
+    except OSError:
+        pass
+    return out
+
+
+def _start_server(backend_dir: str, port: int, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.setdefault("LLM_PROVIDER", "fake")
+    env.setdefault("LLM_FAKE_LATENCY_MEDIAN", "0.3")
+    env.setdefault("CLOUDINARY_CLOUD_NAME", "bench")
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'app.db')}"
+    env["RESULT_CACHE_DB"] = os.path.join(workdir, "cache.sqlite3")
+    env["TMPDIR"] = workdir  # spooled uploads land here
+    # App logs go to a file: an unread pipe would fill up and stall the server
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=backend_dir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def _wait_ready(client: httpx.AsyncClient, proc: subprocess.Popen, log_path: str) -> None:
+    for _ in range(300):
+        if proc.poll() is not None:
+            with open(log_path, "rb") as f:
+                raise RuntimeError("server exited: " + f.read().decode(errors="replace")[-2000:])
+        try:
+            await client.get("/")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def _token(client: httpx.AsyncClient) -> str:
+    creds = {"email": f"bench-{os.getpid()}@example.com", "password": "bench-password", "name": "bench"}
+    r = await client.post("/api/auth/register", json=creds)
+    if r.status_code != 200:
+        r = await client.post("/api/auth/login", json={"email": creds["email"], "password": creds["password"]})
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+
+async def _run(base_url: str, proc: subprocess.Popen, log_path: str, concurrency: int, size: int) -> dict:
+    timeout = httpx.Timeout(600.0)
+    limits = httpx.Limits(max_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        await _wait_ready(client, proc, log_path)
+        headers = {"Authorization": f"Bearer {await _token(client)}"}
+        idle = _proc_status(proc.pid).get("VmRSS", 0.0)
+
+        peak_sampled = 0.0
+        done = asyncio.Event()
+
+        async def sample():
+            nonlocal peak_sampled
+            while not done.is_set():
+                peak_sampled = max(peak_sampled, _proc_status(proc.pid).get("VmRSS", 0.0))
+                await asyncio.sleep(0.05)
+
+        async def upload(i: int):
+            files = {"file": (f"doc-{i}.txt", LazyDocument(size, i), "text/plain")}
+            try:
+                r = await client.post("/api/analyze_document", files=files, headers=headers)
+                return r.status_code
+            except httpx.HTTPError as e:
+                return type(e).__name__
+
+        sampler = asyncio.create_task(sample())
+        start = time.perf_counter()
+        codes = await asyncio.gather(*(upload(i) for i in range(concurrency)))
+        seconds = time.perf_counter() - start
+        done.set()
+        await sampler
+        status = _proc_status(proc.pid)
+        return {
+            "codes": dict(Counter(codes)),
+            "seconds": seconds,
+            "idle_rss_mb": idle,
+            "peak_rss_mb": status.get("VmHWM", peak_sampled),
+        }
+
+
+def _repo_root() -> str:
+    return subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+
+
+def _worktree(ref: str) -> str:
+    path = tempfile.mkdtemp(prefix="bench-uploads-")
+    subprocess.run(["git", "worktree", "add", "--detach", path, ref], cwd=_repo_root(), check=True, capture_output=True)
+    return path
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--size-mb", type=float, default=20)
+    ap.add_argument("--ref", help="git ref to run the server from (temporary worktree)")
+    args = ap.parse_args(argv)
+
+    tree = _worktree(args.ref) if args.ref else None
+    backend_dir = os.path.join(tree, os.path.relpath(BACKEND_DIR, _repo_root())) if tree else BACKEND_DIR
+    workdir = tempfile.mkdtemp(prefix="bench-uploads-data-")
+    port = _free_port()
+    proc = _start_server(backend_dir, port, workdir)
+    try:
+        size = int(args.size_mb * 1024 * 1024)
+        r = asyncio.run(_run(f"http://127.0.0.1:{port}", proc, os.path.join(workdir, "server.log"), args.concurrency, size))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+        if tree:
+            subprocess.run(["git", "worktree", "remove", "--force", tree], cwd=BACKEND_DIR, capture_output=True)
+
+    print(f"server: {args.ref or 'working tree'}  uploads: {args.concurrency} x {args.size_mb:g} MB\n")
+    print(f"{'status codes':<14}{json.dumps(r['codes'])}")
+    print(f"{'wall s':<14}{r['seconds']:.2f}")
+    print(f"{'idle RSS MB':<14}{r['idle_rss_mb']:.1f}")
+    print(f"{'peak RSS MB':<14}{r['peak_rss_mb']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
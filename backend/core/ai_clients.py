@@ -1,7 +1,16 @@
 import os
+import json
+import time
+import asyncio
 import logging
-from typing import Optional, Any
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, Any, AsyncIterator
 from dotenv import load_dotenv
+from core.llm_metrics import LLMCall, record_call
+from core.json_extract import JSONExtractError, extract_object
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -16,13 +25,24 @@ try:
 except Exception:
     genai = None  # type: ignore
 
+try:
+    from google.genai import types as genai_types  # type: ignore
+except Exception:
+    genai_types = None  # type: ignore
+
 try:
     from openai import OpenAI  # type: ignore
 except Exception:
     OpenAI = None  # type: ignore
 
+try:
+    from openai import AsyncOpenAI  # type: ignore
+except Exception:
+    AsyncOpenAI = None  # type: ignore
+
 _gemini_client: Any = None
 _openai_client: Any = None
+_async_openai_client: Any = None
 
 
 def get_gemini_client() -> Optional[Any]:
@@ -66,9 +86,577 @@ def get_openai_client() -> Optional[Any]:
     return _openai_client
 
 
+def get_gemini_async_client() -> Optional[Any]:
+    """Return the async surface (`client.aio`) of the Gemini client, else None.
+
+    The aio client shares credentials and the HTTP session config with the sync
+    client, so callers can await `aio.models.generate_content(...)` without
+    occupying a worker thread for the duration of the model call.
+    """
+    client = get_gemini_client()
+    if client is None:
+        return None
+    return getattr(client, "aio", None)
+
+
+def get_async_openai_client() -> Optional[Any]:
+    """Return an AsyncOpenAI client instance if possible, else None."""
+    global _async_openai_client
+    if _async_openai_client is not None:
+        return _async_openai_client
+    if AsyncOpenAI is None or not OPENAI_API_KEY:
+        _async_openai_client = None
+        return _async_openai_client
+    try:
+        _async_openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    except Exception as e:
+        logger.info("AsyncOpenAI client init failed: %s", e)
+        _async_openai_client = None
+    return _async_openai_client
+
+
+# ===================== ERRORS =====================
+class LLMUnavailableError(RuntimeError):
+    """The model provider cannot take this call right now (circuit open, queue full...).
+
+    `retry_after` is a hint in seconds for the HTTP `Retry-After` header.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMQueueTimeout(LLMUnavailableError):
+    """Raised when a caller waited past the limiter's queue deadline."""
+
+
+# ===================== RATE / CONCURRENCY LIMITER =====================
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 20))
+
+# Provider-wide defaults; 0 disables the corresponding limit
+PROVIDER_LIMITS = {
+    "gemini": {
+        "max_concurrency": int(os.getenv("GEMINI_MAX_CONCURRENCY", 64)),
+        "rpm": int(os.getenv("GEMINI_RPM", 0)),
+        "tpm": int(os.getenv("GEMINI_TPM", 0)),
+    },
+    "openai": {
+        "max_concurrency": int(os.getenv("OPENAI_MAX_CONCURRENCY", 8)),
+        "rpm": int(os.getenv("OPENAI_RPM", 0)),
+        "tpm": int(os.getenv("OPENAI_TPM", 0)),
+    },
+}
+
+# Per-model overrides, e.g. LLM_MODEL_LIMITS='{"gemini/gemini-2.5-flash": {"max_concurrency": 32, "rpm": 1000}}'
+try:
+    MODEL_LIMITS: dict = json.loads(os.getenv("LLM_MODEL_LIMITS", "") or "{}")
+except Exception as e:
+    logger.warning("Invalid LLM_MODEL_LIMITS, ignoring: %s", e)
+    MODEL_LIMITS = {}
+
+
+class _TokenBucket:
+    """Per-minute bucket that may go into debt; the debt is the caller's wait time."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def reserve(self, n: float) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= min(n, self.capacity)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, n: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + min(n, self.capacity))
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.event = event
+        self.loop = loop
+        self.future = future
+        self.granted = False
+
+
+def _resolve(fut: "asyncio.Future") -> None:
+    if not fut.done():
+        fut.set_result(True)
+
+
+class RateLimiter:
+    """FIFO concurrency limiter plus requests/tokens-per-minute buckets.
+
+    Usable from threads (`acquire`) and from the event loop (`acquire_async`);
+    both share the same counters, so the limit holds across sync and async callers.
+    Released slots are handed directly to the oldest waiter.
+    """
+
+    def __init__(self, name: str, max_concurrency: int = 0, rpm: int = 0, tpm: int = 0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._req_bucket = _TokenBucket(rpm) if rpm else None
+        self._tok_bucket = _TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters: deque = deque()
+        self._throttled = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # ---------- concurrency ----------
+    def _take_locked(self) -> bool:
+        if self.max_concurrency <= 0:
+            self._in_flight += 1
+            return True
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            return True
+        return False
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                w = self._waiters.popleft()
+                if w.event is not None:
+                    w.granted = True
+                    w.event.set()
+                    return
+                if w.future.done():
+                    continue
+                try:
+                    w.loop.call_soon_threadsafe(_resolve, w.future)
+                except RuntimeError:
+                    # Loop already closed; skip this waiter
+                    continue
+                w.granted = True
+                return
+            self._in_flight -= 1
+
+    def _abandon_locked(self, w: _Waiter) -> bool:
+        """Drop a waiter that gave up. Returns True if it had already been granted a slot."""
+        if w.granted:
+            return True
+        try:
+            self._waiters.remove(w)
+        except ValueError:
+            pass
+        return False
+
+    # ---------- buckets ----------
+    def _reserve(self, tokens: float) -> float:
+        with self._lock:
+            wait = 0.0
+            if self._req_bucket:
+                wait = max(wait, self._req_bucket.reserve(1))
+            if self._tok_bucket and tokens:
+                wait = max(wait, self._tok_bucket.reserve(tokens))
+            return wait
+
+    def _refund(self, tokens: float) -> None:
+        with self._lock:
+            if self._req_bucket:
+                self._req_bucket.refund(1)
+            if self._tok_bucket and tokens:
+                self._tok_bucket.refund(tokens)
+
+    def _timeout(self, timeout: float) -> LLMQueueTimeout:
+        with self._lock:
+            self.timeouts += 1
+        return LLMQueueTimeout(f"LLM queue timeout for {self.name}", retry_after=max(1.0, timeout))
+
+    def _record_wait(self, waited: float) -> None:
+        with self._lock:
+            self.acquired += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    # ---------- sync ----------
+    def acquire(self, tokens: float = 0, timeout: Optional[float] = None) -> None:
+        timeout = LLM_QUEUE_TIMEOUT_SECONDS if timeout is None else timeout
+        start = time.monotonic()
+        waiter = None
+        with self._lock:
+            if not self._take_locked():
+                waiter = _Waiter(event=threading.Event())
+                self._waiters.append(waiter)
+        if waiter is not None:
+            waiter.event.wait(timeout)
+            with self._lock:
+                granted = self._abandon_locked(waiter)
+            if not granted:
+                raise self._timeout(timeout)
+
+        wait = self._reserve(tokens)
+        if wait > 0:
+            remaining = timeout - (time.monotonic() - start)
+            if wait > remaining:
+                self._refund(tokens)
+                self.release()
+                raise self._timeout(timeout)
+            with self._lock:
+                self._throttled += 1
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self._throttled -= 1
+        self._record_wait(time.monotonic() - start)
+
+    # ---------- async ----------
+    async def acquire_async(self, tokens: float = 0, timeout: Optional[float] = None) -> None:
+        timeout = LLM_QUEUE_TIMEOUT_SECONDS if timeout is None else timeout
+        start = time.monotonic()
+        waiter = None
+        with self._lock:
+            if not self._take_locked():
+                loop = asyncio.get_running_loop()
+                waiter = _Waiter(loop=loop, future=loop.create_future())
+                self._waiters.append(waiter)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                # Cancelled while queued: give back a slot we may already own
+                with self._lock:
+                    granted = self._abandon_locked(waiter)
+                if granted:
+                    self.release()
+                raise
+            with self._lock:
+                granted = self._abandon_locked(waiter)
+            if not granted:
+                raise self._timeout(timeout)
+
+        wait = self._reserve(tokens)
+        if wait > 0:
+            remaining = timeout - (time.monotonic() - start)
+            if wait > remaining:
+                self._refund(tokens)
+                self.release()
+                raise self._timeout(timeout)
+            with self._lock:
+                self._throttled += 1
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                self.release()
+                raise
+            finally:
+                with self._lock:
+                    self._throttled -= 1
+        self._record_wait(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiters) + self._throttled,
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "avg_wait_seconds": round(self.wait_total / self.acquired, 3) if self.acquired else 0.0,
+                "max_wait_seconds": round(self.wait_max, 3),
+            }
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str, model: Optional[str] = None) -> RateLimiter:
+    """Provider-wide limiter (model=None) or the per-model limiter under it."""
+    name = f"{provider}/{model}" if model else provider
+    with _limiters_lock:
+        lim = _limiters.get(name)
+        if lim is None:
+            cfg = MODEL_LIMITS.get(name, {}) if model else PROVIDER_LIMITS.get(provider, {})
+            lim = RateLimiter(
+                name,
+                max_concurrency=int(cfg.get("max_concurrency", 0)),
+                rpm=int(cfg.get("rpm", 0)),
+                tpm=int(cfg.get("tpm", 0)),
+            )
+            _limiters[name] = lim
+        return lim
+
+
+def estimate_tokens(contents: Any) -> int:
+    """Rough prompt size (~4 chars/token) used only for the tokens-per-minute bucket."""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return len(contents) // 4 + 1
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(c) for c in contents)
+    text = getattr(contents, "text", None)
+    if isinstance(text, str):
+        return len(text) // 4 + 1
+    # Binary parts (documents, images): flat estimate
+    return 258
+
+
+@contextmanager
+def llm_slot(
+    provider: str,
+    model: Optional[str] = None,
+    tokens: float = 0,
+    timeout: Optional[float] = None,
+    operation: str = "",
+    attempt: int = 1,
+):
+    """Hold a provider-wide and a per-model slot for the duration of one model call.
+
+    Yields an `LLMCall`; set `call.response` (or `call.streamed_chars`) so the
+    call's latency, token usage, cost and outcome are recorded on exit.
+    """
+    timeout = LLM_QUEUE_TIMEOUT_SECONDS if timeout is None else timeout
+    start = time.monotonic()
+    held = []
+    call = LLMCall(provider, model, operation, attempt, tokens)
+    try:
+        for lim in ([get_limiter(provider)] + ([get_limiter(provider, model)] if model else [])):
+            lim.acquire(tokens, max(0.0, timeout - (time.monotonic() - start)))
+            held.append(lim)
+        call.start()
+        yield call
+    except LLMQueueTimeout as e:
+        call.finish(e, outcome="queue_timeout")
+        raise
+    except BaseException as e:
+        call.finish(e)
+        raise
+    else:
+        call.finish()
+    finally:
+        for lim in reversed(held):
+            lim.release()
+        record_call(call)
+
+
+@asynccontextmanager
+async def allm_slot(
+    provider: str,
+    model: Optional[str] = None,
+    tokens: float = 0,
+    timeout: Optional[float] = None,
+    operation: str = "",
+    attempt: int = 1,
+):
+    """Async twin of `llm_slot`."""
+    timeout = LLM_QUEUE_TIMEOUT_SECONDS if timeout is None else timeout
+    start = time.monotonic()
+    held = []
+    call = LLMCall(provider, model, operation, attempt, tokens)
+    try:
+        for lim in ([get_limiter(provider)] + ([get_limiter(provider, model)] if model else [])):
+            await lim.acquire_async(tokens, max(0.0, timeout - (time.monotonic() - start)))
+            held.append(lim)
+        call.start()
+        yield call
+    except LLMQueueTimeout as e:
+        call.finish(e, outcome="queue_timeout")
+        raise
+    except BaseException as e:
+        call.finish(e)
+        raise
+    else:
+        call.finish()
+    finally:
+        for lim in reversed(held):
+            lim.release()
+        record_call(call)
+
+
+def limiter_stats() -> list[dict]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [lim.stats() for lim in limiters]
+
+
+# ===================== PROVIDERS =====================
+# "gemini" (default): live Gemini text + OpenAI images. "fake": offline stand-in (core/fake_provider.py)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").strip().lower()
+
+
+class LLMProvider(ABC):
+    """What the app needs from a model vendor: text, JSON and image generate/edit.
+
+    Text responses expose `.text` (and `.usage_metadata` when known) like the
+    Gemini SDK; image responses expose `.data[i].b64_json` / `.url` like the
+    OpenAI Images API, so callers parse one shape whatever the backend.
+    A provider missing one of the abstract methods fails when it is created.
+    """
+
+    name = "base"
+    # Limiter buckets the calls are accounted against (see `llm_slot`)
+    text_limiter = "gemini"
+    image_limiter = "openai"
+
+    @abstractmethod
+    def is_available(self) -> bool:
+        raise NotImplementedError
+
+    def images_available(self) -> bool:
+        return False
+
+    @abstractmethod
+    def generate(self, model: str, contents: Any, config: Any = None, operation: str = "") -> Any:
+        raise NotImplementedError
+
+    async def agenerate(self, model: str, contents: Any, config: Any = None, operation: str = "") -> Any:
+        return await asyncio.to_thread(self.generate, model, contents, config, operation)
+
+    async def astream(self, model: str, contents: Any, config: Any = None, operation: str = "") -> AsyncIterator[str]:
+        """Yield text chunks; providers without streaming yield the whole answer once."""
+        response = await self.agenerate(model, contents, config, operation)
+        text = getattr(response, "text", None)
+        if text:
+            yield text
+
+    def generate_json(self, model: str, contents: Any, config: Any = None, operation: str = "") -> Any:
+        """Generate and decode a JSON answer; raises ValueError if it does not parse."""
+        response = self.generate(model, contents, self._json_config(config), operation)
+        return self._decode_json(response)
+
+    async def agenerate_json(self, model: str, contents: Any, config: Any = None, operation: str = "") -> Any:
+        response = await self.agenerate(model, contents, self._json_config(config), operation)
+        return self._decode_json(response)
+
+    @abstractmethod
+    def generate_image(self, model: str, prompt: str, size: str = "1024x1024", n: int = 1) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def edit_image(self, model: str, image: Any, prompt: str, size: str = "1024x1024", n: int = 1, **kwargs) -> Any:
+        raise NotImplementedError
+
+    @staticmethod
+    def _json_config(config: Any) -> Any:
+        if config is not None or genai_types is None:
+            return config
+        return genai_types.GenerateContentConfig(response_mime_type="application/json")
+
+    @staticmethod
+    def _decode_json(response: Any) -> Any:
+        text = getattr(response, "text", None)
+        if not text:
+            raise ValueError("Model returned no text for a JSON request.")
+        try:
+            return extract_object(text)
+        except JSONExtractError as e:
+            raise ValueError(f"Model returned malformed JSON: {e}") from e
+
+
+class SDKProvider(LLMProvider):
+    """Live provider: Gemini (google-genai) for text, OpenAI Images for generate/edit."""
+
+    name = "gemini"
+
+    def is_available(self) -> bool:
+        return bool(get_gemini_client() and GEMINI_API_KEY)
+
+    def images_available(self) -> bool:
+        return get_openai_client() is not None
+
+    def generate(self, model: str, contents: Any, config: Any = None, operation: str = "") -> Any:
+        client = get_gemini_client()
+        if client is None:
+            raise RuntimeError("Gemini client not initialized.")
+        if hasattr(client, "models") and hasattr(client.models, "generate_content"):
+            return client.models.generate_content(model=model, contents=contents, config=config)
+        if hasattr(client, "generate_content"):
+            # Legacy SDK shape without per-call config
+            return client.generate_content(contents)
+        raise RuntimeError("Gemini client lacks a known generate_content entrypoint.")
+
+    async def agenerate(self, model: str, contents: Any, config: Any = None, operation: str = "") -> Any:
+        aclient = get_gemini_async_client()
+        if aclient is None:
+            return await super().agenerate(model, contents, config, operation)
+        return await aclient.models.generate_content(model=model, contents=contents, config=config)
+
+    async def astream(self, model: str, contents: Any, config: Any = None, operation: str = "") -> AsyncIterator[str]:
+        aclient = get_gemini_async_client()
+        if aclient is None or not hasattr(aclient.models, "generate_content_stream"):
+            async for text in super().astream(model, contents, config, operation):
+                yield text
+            return
+        stream = await aclient.models.generate_content_stream(model=model, contents=contents, config=config)
+        async for chunk in stream:
+            text = getattr(chunk, "text", None)
+            if text:
+                yield text
+
+    def generate_image(self, model: str, prompt: str, size: str = "1024x1024", n: int = 1) -> Any:
+        client = get_openai_client()
+        if client is None:
+            raise RuntimeError("OpenAI client not initialized.")
+        return client.images.generate(model=model, prompt=prompt, size=size, n=n)
+
+    def edit_image(self, model: str, image: Any, prompt: str, size: str = "1024x1024", n: int = 1, **kwargs) -> Any:
+        client = get_openai_client()
+        if client is None:
+            raise RuntimeError("OpenAI client not initialized.")
+        return client.images.edit(model=model, image=image, prompt=prompt, size=size, n=n, **kwargs)
+
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_llm_provider() -> LLMProvider:
+    """Process-wide provider chosen by LLM_PROVIDER."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                if LLM_PROVIDER == "fake":
+                    from core.fake_provider import FakeProvider
+                    _provider = FakeProvider.from_env()
+                else:
+                    _provider = SDKProvider()
+                logger.info("LLM provider: %s", _provider.name)
+    return _provider
+
+
+def set_llm_provider(provider: LLMProvider) -> None:
+    """Swap the provider at runtime (benchmarks, load tests)."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
+
+
 __all__ = [
     "OPENAI_API_KEY",
     "GEMINI_API_KEY",
     "get_gemini_client",
     "get_openai_client",
+    "get_gemini_async_client",
+    "get_async_openai_client",
+    "LLMUnavailableError",
+    "LLMQueueTimeout",
+    "RateLimiter",
+    "get_limiter",
+    "estimate_tokens",
+    "llm_slot",
+    "allm_slot",
+    "limiter_stats",
+    "LLM_PROVIDER",
+    "LLMProvider",
+    "SDKProvider",
+    "get_llm_provider",
+    "set_llm_provider",
 ]
@@ -1,27 +1,32 @@
-import json
+import os
+import hashlib
 import logging
 from typing import Optional
 from google.genai import types
 from google.genai.errors import ServerError as GeminiServerError
-from core.ai_clients import get_gemini_client, GEMINI_API_KEY
+from core.llm_gateway import gateway, ModelCandidate
+from core.result_cache import make_key, normalize_text_key
+from core.singleflight import get_group
+from core.structured_output import StructuredOutputError, parse_structured, decode_structured, adecode_structured
+from core.llm_metrics import record_structured
+from models.schemas import CompetitorAnalysisResult
 
 logger = logging.getLogger(__name__)
 
+# Thử nhiều model để tránh lỗi quá tải 503
+CANDIDATE_MODELS = [
+    "gemini-2.5-flash",
+    "gemini-1.5-flash",
+    "gemini-1.5-flash-8b",
+]
 
-def analyze_competitor_market(competitor_name: str) -> dict | None:
-    """
-    Sử dụng Gemini API với chức năng tìm kiếm web để phân tích chiến lược thị trường 
-    của đối thủ cạnh tranh.
-    
-    Args:
-        competitor_name: Tên đối thủ cạnh tranh cần phân tích
-        
-    Returns:
-        dict: Kết quả phân tích theo cấu trúc JSON định sẵn hoặc None nếu có lỗi
-    """
-    
+# Hedged requests (opt-in): race the next model once the primary is slower than its p90
+COMPETITOR_HEDGING = os.getenv("COMPETITOR_HEDGING", "false").lower() in ("1", "true", "yes")
+
+
+def _build_prompt(competitor_name: str) -> str:
     # Prompt Engineering để lấy phân tích chi tiết
-    prompt = f"""Thực hiện phân tích chuyên sâu về chiến lược thị trường của đối thủ cạnh tranh trực tiếp: '{competitor_name}'.
+    return f"""Thực hiện phân tích chuyên sâu về chiến lược thị trường của đối thủ cạnh tranh trực tiếp: '{competitor_name}'.
 
 Sử dụng tính năng tìm kiếm web công khai, phân tích và trích xuất thông tin theo 4 hạng mục chính dưới đây.
 
@@ -64,126 +69,140 @@ Cấu trúc JSON phải là:
   }}
 }}"""
 
+
+def _search_config():
+    # Cấu hình để sử dụng Google Search
+    return types.GenerateContentConfig(
+        tools=[{"google_search": {}}]
+    ) if hasattr(types, "GenerateContentConfig") else None
+
+
+def _parse_response(competitor_name: str, response) -> dict | None:
+    # Grounded call (google_search) can't carry response_schema: validate locally, one repair call if needed
+    result = decode_structured(response, CompetitorAnalysisResult, "analyze_competitor")
+    if result is None:
+        logger.error("Không thể parse JSON từ phản hồi Gemini cho đối thủ '%s'", competitor_name)
+        return None
+    logger.info("Phân tích đối thủ thành công")
+    return result.model_dump()
+
+
+async def _aparse_response(competitor_name: str, response) -> dict | None:
+    result = await adecode_structured(response, CompetitorAnalysisResult, "analyze_competitor")
+    if result is None:
+        logger.error("Không thể parse JSON từ phản hồi Gemini cho đối thủ '%s'", competitor_name)
+        return None
+    logger.info("Phân tích đối thủ thành công")
+    return result.model_dump()
+
+
+def _candidates() -> list[ModelCandidate]:
+    cfg = _search_config()
+    return [ModelCandidate(m, cfg) for m in CANDIDATE_MODELS]
+
+
+PROMPT_VERSION = hashlib.sha256(
+    (_build_prompt("{competitor_name}") + "|".join(CANDIDATE_MODELS)).encode("utf-8")
+).hexdigest()[:12]
+
+inflight = get_group("analyze_competitor")
+
+
+def _inflight_key(competitor_name: str, hedge: bool = False) -> str:
+    # A hedged call may answer from the fallback model, so it doesn't share a flight with a plain one
+    return make_key("analyze_competitor", normalize_text_key(competitor_name), PROMPT_VERSION, "hedge" if hedge else "")
+
+
+def _run_analysis(competitor_name: str) -> dict | None:
+    prompt = _build_prompt(competitor_name)
+
     try:
-        client = get_gemini_client()
-        if not client or not GEMINI_API_KEY:
+        if not gateway.is_available():
             logger.error("Gemini client không khả dụng hoặc API key không được cấu hình")
             return None
 
-        # Cấu hình để sử dụng Google Search
-        cfg = types.GenerateContentConfig(
-            tools=[{"google_search": {}}]
-        ) if hasattr(types, "GenerateContentConfig") else None
-
         logger.info(f"Đang phân tích đối thủ cạnh tranh: {competitor_name}")
 
-        # Thử nhiều model để tránh lỗi quá tải 503
-        candidate_models = [
-            "gemini-2.5-flash",
-            "gemini-1.5-flash",
-            "gemini-1.5-flash-8b",
-        ]
-
-        last_error: Exception | None = None
-        response = None
-        for model_name in candidate_models:
-            try:
-                if hasattr(client, "models") and hasattr(client.models, "generate_content"):
-                    response = client.models.generate_content(
-                        model=model_name,
-                        contents=prompt,
-                        config=cfg
-                    )
-                elif hasattr(client, "generate_content"):
-                    # Fallback nếu không có tools config
-                    response = client.generate_content(prompt)
-                else:
-                    logger.error("Không thể gọi generate_content từ Gemini client")
-                    return None
-                logger.info("Gọi model '%s' thành công", model_name)
-                break
-            except GeminiServerError as ge:
-                last_error = ge
-                # Nếu quá tải 503 thì thử model khác
-                if getattr(ge, "status_code", None) == 503 or "UNAVAILABLE" in str(ge):
-                    logger.warning("Model '%s' quá tải (503). Thử model khác...", model_name)
-                    continue
-                # Lỗi server khác: ném ra luôn
-                raise
-            except Exception as e:
-                last_error = e
-                logger.warning("Gọi model '%s' thất bại: %s", model_name, e)
-                continue
-
+        # Gateway bỏ qua model đang quá tải (circuit open) và ném lỗi cuối cùng
+        # nếu tất cả đều thất bại (để router map đúng mã lỗi)
+        response = gateway.generate_content(_candidates(), prompt, operation="analyze_competitor", attempts_per_model=1)
         if response is None:
-            # Nếu tất cả đều thất bại, ném lỗi cuối cùng (để router map đúng mã lỗi)
-            if last_error:
-                raise last_error
             return None
-        
-        # Xử lý response an toàn (có thể text bị None)
-        raw_text = getattr(response, "text", None)
-        if not raw_text:
-            logger.warning("Gemini trả về response không có text cho đối thủ '%s'", competitor_name)
+
+        return _parse_response(competitor_name, response)
+
+    except GeminiServerError as e:
+        # Để router có thể trả về mã 503 phù hợp khi model quá tải
+        logger.error("Lỗi khi phân tích đối thủ cạnh tranh: %s", e, exc_info=True)
+        raise
+    except Exception as e:
+        logger.error(f"Lỗi khi phân tích đối thủ cạnh tranh: {e}", exc_info=True)
+        raise
+
+
+async def _run_analysis_async(competitor_name: str, hedge: bool = False) -> dict | None:
+    prompt = _build_prompt(competitor_name)
+
+    try:
+        if not gateway.is_available():
+            logger.error("Gemini client không khả dụng hoặc API key không được cấu hình")
             return None
 
-        raw_text = raw_text.strip()
-        logger.info("Phản hồi từ Gemini: %s...", raw_text[:200])
-
-        # Làm sạch markdown code fences nếu có
-        cleaned = raw_text.replace("```json", "").replace("```", "").strip()
-
-        # Thử parse trực tiếp
-        try:
-            parsed_data = json.loads(cleaned)
-            logger.info("Phân tích đối thủ thành công")
-            return parsed_data
-        except json.JSONDecodeError:
-            # Thử tìm đoạn JSON cân bằng dấu ngoặc
-            def _balanced_json_fragment(text: str):
-                start = text.find('{')
-                if start == -1:
-                    return None
-                depth = 0
-                in_string = False
-                escape = False
-                for i in range(start, len(text)):
-                    ch = text[i]
-                    if in_string:
-                        if escape:
-                            escape = False
-                        elif ch == '\\':
-                            escape = True
-                        elif ch == '"':
-                            in_string = False
-                    else:
-                        if ch == '"':
-                            in_string = True
-                        elif ch == '{':
-                            depth += 1
-                        elif ch == '}':
-                            depth -= 1
-                            if depth == 0:
-                                return text[start:i+1]
-                return None
-
-            frag = _balanced_json_fragment(cleaned)
-            if frag:
+        logger.info(f"Đang phân tích đối thủ cạnh tranh: {competitor_name}")
+
+        if hedge:
+            # Only an answer that validates locally wins the race; repair the last rejected one if none does
+            rejected = []
+
+            def accept(r):
                 try:
-                    parsed_data = json.loads(frag)
-                    logger.info("Phân tích đối thủ thành công (từ JSON fragment)")
-                    return parsed_data
-                except Exception as je2:
-                    logger.error("Lỗi parse JSON fragment: %s", je2)
-                    logger.debug("Fragment: %s", frag[:500])
-            logger.error("Không thể parse JSON từ phản hồi Gemini")
-            logger.debug("Raw text: %s", raw_text[:2000])
+                    return parse_structured(getattr(r, "text", None), CompetitorAnalysisResult).model_dump()
+                except StructuredOutputError:
+                    rejected.append(r)
+                    return None
+
+            result = await gateway.ahedge(_candidates(), prompt, accept=accept, operation="analyze_competitor")
+            if result is not None:
+                record_structured("analyze_competitor", "ok")
+                return result
+            return await _aparse_response(competitor_name, rejected[-1]) if rejected else None
+
+        response = await gateway.agenerate_content(_candidates(), prompt, operation="analyze_competitor", attempts_per_model=1)
+        if response is None:
             return None
-            
+
+        return await _aparse_response(competitor_name, response)
+
     except GeminiServerError as e:
-        # Để router có thể trả về mã 503 phù hợp khi model quá tải
         logger.error("Lỗi khi phân tích đối thủ cạnh tranh: %s", e, exc_info=True)
         raise
     except Exception as e:
         logger.error(f"Lỗi khi phân tích đối thủ cạnh tranh: {e}", exc_info=True)
         raise
+
+
+def analyze_competitor_market(competitor_name: str) -> dict | None:
+    """
+    Sử dụng Gemini API với chức năng tìm kiếm web để phân tích chiến lược thị trường 
+    của đối thủ cạnh tranh.
+
+    Các yêu cầu giống hệt nhau đang chạy đồng thời chỉ gọi Gemini một lần.
+    
+    Args:
+        competitor_name: Tên đối thủ cạnh tranh cần phân tích
+        
+    Returns:
+        dict: Kết quả phân tích theo cấu trúc JSON định sẵn hoặc None nếu có lỗi
+    """
+    return inflight.do(_inflight_key(competitor_name), _run_analysis, competitor_name)
+
+
+async def analyze_competitor_market_async(competitor_name: str, hedge: Optional[bool] = None) -> dict | None:
+    """Async variant of `analyze_competitor_market` built on the gateway's aio path.
+
+    `hedge=True` races the fallback model against a slow primary (see
+    `LLMGateway.ahedge`); `None` follows the COMPETITOR_HEDGING env default.
+    """
+    if hedge is None:
+        hedge = COMPETITOR_HEDGING
+    return await inflight.do_async(_inflight_key(competitor_name, hedge), _run_analysis_async, competitor_name, hedge)
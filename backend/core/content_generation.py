@@ -1,15 +1,30 @@
+import os
 import json
 import re
+import asyncio
 import logging
+import itertools
+import threading
+from typing import AsyncIterator, Optional
 from models.schemas import (
     ContentGenerationRequest,
+    ContentBatchRequest,
     GeneratedContentResponse,
+    ContentDraft,
     Format,
     AdCopyStyle,
     CTAIntent,
     CopyIntensity,
 )
-from core.ai_clients import get_gemini_client, GEMINI_API_KEY
+from core.llm_gateway import gateway, ModelCandidate, LLMUnavailableError
+from google.genai import types
+from core.json_extract import JSONExtractError, extract_object
+from core.structured_output import (
+    json_fields,
+    plain_candidates,
+    decode_structured,
+    adecode_structured,
+)
 
 
 def _parse_required_keywords(request: ContentGenerationRequest) -> list:
@@ -126,9 +141,25 @@ def _get_selected_usps_list(request: ContentGenerationRequest) -> list[str]:
     return uniq
 
 
-def generate_marketing_content(request: ContentGenerationRequest) -> GeneratedContentResponse | None:
-    """Sinh nội dung Marketing với Prompt đa tầng + cải tiến theo format, framework, angle, localization & self-review."""
+# New default length windows (min,max) used only if user did not specify desired_length.
+WORD_LIMITS = {
+    Format.FACEBOOK_POST: (260, 340),  # ~300 words target
+    Format.ADx_COPY: (170, 230),       # ~200 words target
+    Format.VIDEO_SCRIPT: (120, 180),   # ~150 words target (~55–65s)
+}
+
+GEMINI_CONTENT_MODEL = "gemini-2.5-flash"
+
 
+def _build_prompt_layers(
+    request: ContentGenerationRequest,
+    selected_usps: Optional[list[str]] = None,
+    required_keywords: Optional[list[str]] = None,
+) -> tuple[str, str]:
+    """Return (engine_layer, user_layer) for the multi-layer content prompt.
+
+    `selected_usps` / `required_keywords` may be passed pre-parsed (batch runs parse them once).
+    """
     format_rules = FORMAT_RULES.get(request.selected_format, "")
     framework_hint = FRAMEWORK_HINTS.get(request.selected_format, "")
 
@@ -136,9 +167,16 @@ def generate_marketing_content(request: ContentGenerationRequest) -> GeneratedCo
     # Language preferences and SEO flags
     lang = (getattr(request, "language", None) or "vi").strip().lower()
     lang_label = "Vietnamese" if lang in ("vi", "vi-vn", "vietnamese", "tiếng việt", "tieng viet") else lang
-    required_keywords = _parse_required_keywords(request)
+    if required_keywords is None:
+        required_keywords = _parse_required_keywords(request)
     seo_flag = bool(getattr(request, "seo_enabled", False))
 
+    seo_section = (
+        "SEO MODE:\n"
+        "SEO is enabled: include the required keywords exactly (no spelling changes) where natural. Prefer placing at least one keyword in the title and the first 100 words. Avoid keyword stuffing; keep density reasonable. Use short paragraphs and clear structure.\n\n"
+    ) if seo_flag else ""
+
+    # Static per (format, language, SEO flag): sent as system_instruction, never per request
     engine_layer = f"""
 SYSTEM ROLE: You are an elite marketing copywriter who writes natively for the target language audience.
 
@@ -159,10 +197,7 @@ For Facebook Post format, also suggest 3–6 relevant hashtags based on Product,
 LOCALIZATION:
 Make wording natural for the selected language: friendly, concise, real-life phrasing. Avoid overly formal or machine-like translation artifacts.
 
-SEO MODE:
-If SEO is enabled, include the required keywords exactly (no spelling changes) where natural. Prefer placing at least one keyword in the title and the first 100 words. Avoid keyword stuffing; keep density reasonable. Use short paragraphs and clear structure.
-
-SELF-REVIEW BEFORE OUTPUT:
+{seo_section}SELF-REVIEW BEFORE OUTPUT:
 Before returning final JSON, internally check:
 - Title has a clear hook and respects any provided custom title.
 - Format rules are followed (paragraph length, structure, CTA style).
@@ -172,7 +207,8 @@ Before returning final JSON, internally check:
 Refine once if any item is weak, then output only final JSON.
 
 OUTPUT CONSTRAINTS:
-Return ONLY a single valid JSON object (no surrounding text, no markdown fences). Keys required: "title", "content".
+Return ONLY a single valid JSON object (no surrounding text, no markdown fences). Keys required: "title", "content", "word_count".
+"word_count" is your own count of the words in "content". Count before answering; if it falls outside Target Length, rewrite the content (add or remove whole sentences) until it fits.
 Title MUST include a clear hook.
 DEFAULT LENGTH TARGETS (when user does NOT provide desired_length):
 - Facebook Post: ~300 words (dễ đọc, vẫn giữ đoạn ngắn 1–3 câu).
@@ -188,8 +224,10 @@ If user supplies desired_length, honor it (±15%) instead of defaults.
     custom_title = (getattr(request, "custom_title", None) or "").strip()
     key_points = getattr(request, "key_points", None) or ""
     keywords_str = ", ".join(required_keywords) if required_keywords else ""
+    min_w, max_w = _length_window(request)
 
-    selected_usps = _get_selected_usps_list(request)
+    if selected_usps is None:
+        selected_usps = _get_selected_usps_list(request)
     usps_text = "; ".join(selected_usps) if selected_usps else ""
 
     user_layer = f"""
@@ -202,252 +240,795 @@ Tone: {request.selected_tone.value}
 Format: {request.selected_format.value}
 Category: {category}
 Desired Length (words): {desired_len}
+Target Length (words): {min_w}-{max_w}
 Custom Title (if any): {custom_title}
 Key Points / Requirements: {key_points}
 Required Keywords: {keywords_str}
 SEO Enabled: {seo_flag}
 """
+    return engine_layer, user_layer
+
+
+def _engine_key(request: ContentGenerationRequest) -> str:
+    lang = (getattr(request, "language", None) or "vi").strip().lower()
+    seo = "seo" if getattr(request, "seo_enabled", False) else "noseo"
+    return f"content:{request.selected_format.name}:{lang}:{seo}"
+
+
+def _content_candidates(request: ContentGenerationRequest, engine_layer: str) -> list[ModelCandidate]:
+    # The engine layer goes first as system_instruction, identical for every request with the
+    # same key, so Gemini's implicit prefix caching can reuse it
+    config = types.GenerateContentConfig(
+        system_instruction=engine_layer, **json_fields(ContentDraft), **_length_config(request),
+    )
+    return [ModelCandidate(GEMINI_CONTENT_MODEL, config)]
+
+
+def _draft_defaults(data: dict) -> dict:
+    # A missing self-check is not worth a repair call
+    return {"word_count": 0, **data}
+
+
+def _decode_title_content(response) -> dict | None:
+    """Validated {"title", "content", "word_count"} from a schema-constrained answer (one repair call at most)."""
+    draft = decode_structured(response, ContentDraft, "generate_content", normalize=_draft_defaults)
+    return draft.model_dump() if draft else None
+
+
+async def _adecode_title_content(response) -> dict | None:
+    draft = await adecode_structured(response, ContentDraft, "generate_content", normalize=_draft_defaults)
+    return draft.model_dump() if draft else None
+
+
+def _shorten_title(t: str, max_words: int = 14, max_chars: int = 80) -> str:
+    # Giới hạn độ dài tiêu đề tự động (nếu người dùng không cung cấp)
+    # Quy ước: tối đa 14 từ hoặc 80 ký tự; giữ hook nếu có.
+    original = t.strip()
+    if not original:
+        return original
+    hook_prefix = ""
+    # Giữ emoji / ký tự hook đầu nếu có
+    if original.startswith(("🔥", "🚀", "⚡", "💥", "✨")):
+        parts = original.split(" ", 1)
+        if len(parts) == 2:
+            hook_prefix = parts[0] + " "
+            original = parts[1]
+    words = re.findall(r"\S+", original)
+    if len(words) <= max_words and len(original) <= max_chars:
+        return (hook_prefix + original).strip()
+    # Cắt theo giới hạn từ trước, sau đó kiểm tra ký tự
+    trimmed_words = words[:max_words]
+    candidate = " ".join(trimmed_words)
+    # Nếu vẫn quá dài về ký tự, rút ngắn thêm
+    if len(candidate) > max_chars:
+        # cắt theo ký tự nhưng không cắt giữa từ; thêm dấu … nếu mất thông tin
+        cut = []
+        total = 0
+        for w in trimmed_words:
+            if total + len(w) + (1 if cut else 0) > max_chars - 1:  # chừa chỗ cho …
+                break
+            cut.append(w)
+            total += len(w) + (1 if cut else 0)
+        candidate = " ".join(cut)
+        if candidate != original:
+            candidate += "…"
+    else:
+        # Thêm … nếu đã bị cắt từ so với bản gốc dài hơn đáng kể
+        if len(words) > max_words:
+            candidate += "…"
+    return (hook_prefix + candidate).strip()
+
+
+# =========== LENGTH ENFORCEMENT (words) ===========
+def count_words(text: str) -> int:
+    return len(re.findall(r"\w+", text, flags=re.UNICODE))
+
+
+def truncate_to_max_words(text: str, max_words: int) -> str:
+    # Try to preserve sentence boundaries when truncating
+    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
+    out = []
+    total = 0
+    for s in sentences:
+        w = count_words(s)
+        if total + w <= max_words:
+            out.append(s)
+            total += w
+        else:
+            # partial sentence: take remaining words
+            remain = max_words - total
+            if remain <= 0:
+                break
+            parts = re.findall(r"\S+", s)
+            out.append(" ".join(parts[:remain]))
+            total = max_words
+            break
+    return " ".join(out).strip()
+
+
+def _length_window(request: ContentGenerationRequest) -> tuple[int, int]:
+    desired_len = getattr(request, "desired_length", None)
+    # Override by desired length if provided (±15%)
+    if isinstance(desired_len, int) and desired_len > 0:
+        return max(10, int(desired_len * 0.85)), int(desired_len * 1.15)
+    return WORD_LIMITS.get(request.selected_format, (20, 220))
+
+
+# =========== LENGTH-AWARE GENERATION ===========
+# The output budget follows the word window, the model reports its own word
+# count, and a draft that misses the window is trimmed or padded locally; a
+# second (expansion) call is only the last resort.
+CONTENT_LENGTH_CONTROL = os.getenv("CONTENT_LENGTH_CONTROL", "true").lower() in ("1", "true", "yes")
+# 2.5 models count thinking tokens against max_output_tokens
+CONTENT_THINKING_BUDGET = int(os.getenv("CONTENT_THINKING_BUDGET", 1024))
+# Largest shortfall (words) that is filled locally from the request's own USPs / key points
+CONTENT_LOCAL_PAD_MAX_WORDS = int(os.getenv("CONTENT_LOCAL_PAD_MAX_WORDS", 60))
+
+# Output tokens per counted word (count_words splits on \w+, i.e. per syllable in Vietnamese).
+# Starting points only: refined per language from usage_metadata as answers come in.
+TOKENS_PER_WORD = {"vi": 1.7, "en": 1.35}
+_DEFAULT_TOKENS_PER_WORD = 1.6
+_OUTPUT_HEADROOM = 1.3        # room above max_w so an overrun is trimmed at a sentence, not cut mid-JSON
+_JSON_OVERHEAD_TOKENS = 64    # keys, quotes, title, word_count
+
+
+def _lang_code(request) -> str:
+    lang = (getattr(request, "language", None) or "vi").strip().lower()
+    if lang in ("vi", "vi-vn", "vietnamese", "tiếng việt", "tieng viet"):
+        return "vi"
+    return lang[:2] or "vi"
+
+
+class _LengthStats:
+    """Where drafts land relative to the word window, and the running tokens/word calibration."""
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._tokens_per_word: dict[str, float] = dict(TOKENS_PER_WORD)
+        self._samples: dict[str, int] = {}
+        self.counts = {"drafts": 0, "in_window": 0, "trimmed": 0, "padded": 0, "second_calls": 0, "self_check_off": 0}
+
+    def add(self, outcome: str) -> None:
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def tokens_per_word(self, lang: str) -> float:
+        with self._lock:
+            return self._tokens_per_word.get(lang, _DEFAULT_TOKENS_PER_WORD)
+
+    def observe(self, lang: str, output_tokens: int, words: int) -> None:
+        if words < 20 or output_tokens <= _JSON_OVERHEAD_TOKENS:
+            return
+        sample = (output_tokens - _JSON_OVERHEAD_TOKENS) / words
+        if not 0.5 <= sample <= 5.0:
+            return
+        with self._lock:
+            current = self._tokens_per_word.get(lang, _DEFAULT_TOKENS_PER_WORD)
+            self._tokens_per_word[lang] = current + self.alpha * (sample - current)
+            self._samples[lang] = self._samples.get(lang, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+            tpw = {k: round(v, 3) for k, v in self._tokens_per_word.items()}
+            samples = dict(self._samples)
+        drafts = counts["drafts"]
+        return {
+            **counts,
+            "second_call_rate": round(counts["second_calls"] / drafts, 4) if drafts else 0.0,
+            "tokens_per_word": tpw,
+            "calibration_samples": samples,
+        }
 
+
+length_stats = _LengthStats()
+
+
+def content_length_stats() -> dict:
+    return {"enabled": CONTENT_LENGTH_CONTROL, **length_stats.stats()}
+
+
+def _length_config(request: ContentGenerationRequest) -> dict:
+    """max_output_tokens (and a bounded thinking budget) sized from the word window."""
+    if not CONTENT_LENGTH_CONTROL:
+        return {}
+    _, max_w = _length_window(request)
+    budget = int(max_w * length_stats.tokens_per_word(_lang_code(request)) * _OUTPUT_HEADROOM) + _JSON_OVERHEAD_TOKENS
+    if GEMINI_CONTENT_MODEL.startswith("gemini-2.5"):
+        return {
+            "max_output_tokens": budget + CONTENT_THINKING_BUDGET,
+            "thinking_config": types.ThinkingConfig(thinking_budget=CONTENT_THINKING_BUDGET),
+        }
+    return {"max_output_tokens": budget}
+
+
+def _observe_draft(request: ContentGenerationRequest, data: dict, response=None) -> None:
+    words = count_words(data.get("content", ""))
+    reported = data.get("word_count") or 0
+    length_stats.add("drafts")
+    if reported and abs(reported - words) > max(10, 0.1 * words):
+        length_stats.add("self_check_off")
+    meta = getattr(response, "usage_metadata", None)
+    output_tokens = getattr(meta, "candidates_token_count", None) if meta is not None else None
+    if output_tokens:
+        length_stats.observe(_lang_code(request), int(output_tokens), words + count_words(data.get("title", "")))
+
+
+_PAD_LABELS = {"vi": "Điểm nổi bật", "en": "Highlights"}
+
+
+def _pad_locally(request: ContentGenerationRequest, content: str, min_w: int) -> str:
+    """Cheap local expansion: list the request's own USPs / key points / highlights the draft doesn't mention yet."""
+    missing = min_w - count_words(content)
+    # Video scripts are scene-structured; a trailing list would break them
+    if missing <= 0 or missing > CONTENT_LOCAL_PAD_MAX_WORDS or request.selected_format == Format.VIDEO_SCRIPT:
+        return content
+    lowered = content.lower()
+    sources = _get_selected_usps_list(request)
+    sources += re.split(r"[\n;]", getattr(request, "key_points", None) or "")
+    sources += re.split(r"[\n,;]", request.infor or "")
+    points: list[str] = []
+    for item in sources:
+        item = item.strip().strip("-•*✔ ").strip()
+        if item and item.lower() not in lowered and item not in points:
+            points.append(item)
+    if not points:
+        return content
+    lines, added = [], 0
+    for point in points:
+        lines.append(f"✔ {point}")
+        added += count_words(point)
+        if added >= missing:
+            break
+    label = _PAD_LABELS.get(_lang_code(request), _PAD_LABELS["en"])
+    return content.rstrip() + f"\n\n{label}:\n" + "\n".join(lines)
+
+
+def _fit_length(request: ContentGenerationRequest, content: str) -> tuple[str, bool]:
+    """Trim or pad `content` into the word window locally; the flag asks for an expansion call."""
+    min_w, max_w = _length_window(request)
+    words = count_words(content)
+    if words > max_w:
+        length_stats.add("trimmed")
+        return truncate_to_max_words(content, max_w), False
+    if words >= min_w:
+        length_stats.add("in_window")
+        return content, False
+    if CONTENT_LENGTH_CONTROL:
+        padded = _pad_locally(request, content, min_w)
+        if count_words(padded) >= min_w:
+            length_stats.add("padded")
+            return padded, False
+    length_stats.add("second_calls")
+    return content, True
+
+
+def _accept_expansion(request: ContentGenerationRequest, content: str, expanded: str) -> str:
+    min_w, max_w = _length_window(request)
+    if count_words(expanded) < min_w:
+        return content
+    return truncate_to_max_words(expanded, max_w) if count_words(expanded) > max_w else expanded
+
+
+def _expansion_prompt(original: str, target_min: int) -> str:
+    # Ask model once to expand the given content to reach the target_min words
+    # (engine rules travel in the system instruction of the same candidates)
+    return (
+        "EXPANSION REQUEST: Please expand the CONTENT below to be at least "
+        f"{target_min} words while preserving the same Tone and Format. "
+        "Return ONLY the expanded content (no JSON, no explanation).\n\n"
+    ) + f"EXISTING CONTENT:\n{original}\n"
+
+
+def _clean_expansion(r, original: str) -> str:
+    if not r or not getattr(r, "text", None):
+        return original
+    text = r.text.strip()
+    # remove fences
+    text = text.replace("```", "").strip()
+    # if model returned JSON accidentally, extract plain text
+    m = re.search(r"\{[\s\S]*\}", text)
+    if m:
+        # prefer non-json content if there's any
+        before = text[:m.start()].strip()
+        if before:
+            text = before
+        else:
+            # fallback: extract a plausible content field
+            try:
+                return extract_object(m.group(0)).get("content", original)
+            except JSONExtractError:
+                pass
+    return text
+
+
+def _apply_title_rules(request: ContentGenerationRequest, title: str) -> str:
+    custom_title = (getattr(request, "custom_title", None) or "").strip()
+    # Favor custom title when provided
+    if custom_title:
+        return custom_title
+    return _shorten_title(title)
+
+
+_TITLE_HOOK_RE = re.compile(r"!|\?|\b(đột phá|bí mật|mẹo|cảnh báo)\b", re.I)
+
+
+def _build_response(request: ContentGenerationRequest, title: str, content: str, prompt: str) -> GeneratedContentResponse:
+    # Post-process: ensure hook in title (very simple heuristic)
+    if request.selected_format == Format.FACEBOOK_POST and not _TITLE_HOOK_RE.search(title):
+        # Nếu sau rút gọn chưa có hook emoji, thêm vào đầu nhưng đảm bảo không vượt quá max_chars (80)
+        if not title.startswith("🔥"):
+            decorated = "🔥 " + title
+            if len(decorated) <= 80:
+                title = decorated
+
+    # ========== AD/CALL-TO-ACTION DETECTION & PROMPT ENHANCEMENTS ==========
+    ad_style = choose_ad_copy_style(request)
+    cta_intent = choose_cta_intent(request)
+    copy_intensity = choose_copy_intensity(request)
+
+    # If ad_style exists, append a short guideline to the prompt_used for traceability
+    if ad_style:
+        prompt += f"\nAD_STYLE_USED: {ad_style.value}"
+    if cta_intent:
+        prompt += f"\nCTA_INTENT: {cta_intent.value}"
+    if copy_intensity:
+        prompt += f"\nCOPY_INTENSITY: {copy_intensity.value}"
+
+    # Facebook hashtag generation intentionally removed.
+
+    return GeneratedContentResponse(
+        title=title,
+        content=content,
+        prompt_used=prompt,
+    )
+
+
+def generate_marketing_content(request: ContentGenerationRequest) -> GeneratedContentResponse | None:
+    """Sinh nội dung Marketing với Prompt đa tầng + cải tiến theo format, framework, angle, localization & self-review."""
+    engine_layer, user_layer = _build_prompt_layers(request)
     prompt = engine_layer + "\n" + user_layer
 
     try:
-        client = get_gemini_client()
-        if not client or not GEMINI_API_KEY:
+        if not gateway.is_available():
             return None
 
-        response = None
-        if hasattr(client, "models") and hasattr(client.models, "generate_content"):
-            response = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        elif hasattr(client, "generate_content"):
-            response = client.generate_content(prompt)
+        candidates = _content_candidates(request, engine_layer)
+        response = gateway.generate_content(candidates, user_layer, operation="generate_content")
         if not response or not getattr(response, "text", None):
             return None
 
-        raw_text = response.text.strip()
-        # Remove markdown fences if present
-        cleaned = raw_text.replace("```json", "").replace("```", "").strip()
-
-        # Attempt direct JSON parse with robust fallbacks
-        def _balanced_json_fragment(text: str):
-            start = text.find('{')
-            if start == -1:
-                return None
-            depth = 0
-            in_string = False
-            escape = False
-            for i in range(start, len(text)):
-                ch = text[i]
-                if in_string:
-                    if escape:
-                        escape = False
-                    elif ch == '\\':
-                        escape = True
-                    elif ch == '"':
-                        in_string = False
-                else:
-                    if ch == '"':
-                        in_string = True
-                    elif ch == '{':
-                        depth += 1
-                    elif ch == '}':
-                        depth -= 1
-                        if depth == 0:
-                            return text[start:i+1]
+        data = _decode_title_content(response)
+        if data is None:
             return None
+        _observe_draft(request, data, response)
+        title = _apply_title_rules(request, data.get("title", "Không có tiêu đề"))
+        content, needs_expansion = _fit_length(request, data.get("content", "Không có nội dung được tạo."))
 
-        def _extract_title_content(text: str):
-            # Non-strict extraction if JSON malformed
-            title_match = re.search(r'"title"\s*:\s*"([^"]*)"', text)
-            content_match = re.search(r'"content"\s*:\s*"([\s\S]*?)"\s*(?:\n|$|,"|"content"|\})', text)
-            title_val = title_match.group(1) if title_match else "Không có tiêu đề"
-            content_val = content_match.group(1) if content_match else "Không có nội dung được tạo."
-            # Unescape common escaped characters
-            return {
-                "title": title_val.replace('\\n', '\n').replace('\\"', '"'),
-                "content": content_val.replace('\\n', '\n').replace('\\"', '"')
-            }
+        # Last resort: one expansion call to the model
+        if needs_expansion:
+            min_w, _ = _length_window(request)
+            try:
+                r = gateway.generate_content(plain_candidates(candidates), _expansion_prompt(content, min_w), operation="expand_content")
+                content = _accept_expansion(request, content, _clean_expansion(r, content))
+            except Exception:
+                pass
+
+        return _build_response(request, title, content, prompt)
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        print(f"Lỗi API Gemini hoặc lỗi phân tích JSON (nâng cấp) ở Giai đoạn 2: {e}")
+        return None
 
-        data = None
+
+async def _finalize_async(
+    request: ContentGenerationRequest,
+    prompt: str,
+    data: dict,
+    candidates: list[ModelCandidate],
+) -> GeneratedContentResponse:
+    """Title rules + length window (local trim/pad, expansion call as last resort) on parsed model output."""
+    title = _apply_title_rules(request, data.get("title", "Không có tiêu đề"))
+    content, needs_expansion = _fit_length(request, data.get("content", "Không có nội dung được tạo."))
+
+    if needs_expansion:
+        min_w, _ = _length_window(request)
         try:
-            data = json.loads(cleaned)
-        except json.JSONDecodeError as e1:
-            frag = _balanced_json_fragment(cleaned)
-            if frag:
-                try:
-                    data = json.loads(frag)
-                except json.JSONDecodeError as e2:
-                    logging.warning(f"JSON fragment parse failed (balanced scan). e1={e1} e2={e2}. Using regex key extraction.")
-                    data = _extract_title_content(cleaned)
-            else:
-                logging.warning(f"No balanced JSON fragment found. e1={e1}. Using regex key extraction.")
-                data = _extract_title_content(cleaned)
+            r = await gateway.agenerate_content(plain_candidates(candidates), _expansion_prompt(content, min_w), operation="expand_content")
+            content = _accept_expansion(request, content, _clean_expansion(r, content))
+        except Exception:
+            pass
 
-        title = data.get("title", "Không có tiêu đề")
-        content = data.get("content", "Không có nội dung được tạo.")
+    return _build_response(request, title, content, prompt)
 
-        # Favor custom title when provided
-        if custom_title:
-            title = custom_title
-        else:
-            # Giới hạn độ dài tiêu đề tự động (nếu người dùng không cung cấp)
-            # Quy ước: tối đa 14 từ hoặc 80 ký tự; giữ hook nếu có.
-            def _shorten_title(t: str, max_words: int = 14, max_chars: int = 80) -> str:
-                original = t.strip()
-                if not original:
-                    return original
-                hook_prefix = ""
-                # Giữ emoji / ký tự hook đầu nếu có
-                if original.startswith(("🔥", "🚀", "⚡", "💥", "✨")):
-                    parts = original.split(" ", 1)
-                    if len(parts) == 2:
-                        hook_prefix = parts[0] + " "
-                        original = parts[1]
-                words = re.findall(r"\S+", original)
-                if len(words) <= max_words and len(original) <= max_chars:
-                    return (hook_prefix + original).strip()
-                # Cắt theo giới hạn từ trước, sau đó kiểm tra ký tự
-                trimmed_words = words[:max_words]
-                candidate = " ".join(trimmed_words)
-                # Nếu vẫn quá dài về ký tự, rút ngắn thêm
-                if len(candidate) > max_chars:
-                    # cắt theo ký tự nhưng không cắt giữa từ; thêm dấu … nếu mất thông tin
-                    cut = []
-                    total = 0
-                    for w in trimmed_words:
-                        if total + len(w) + (1 if cut else 0) > max_chars - 1:  # chừa chỗ cho …
-                            break
-                        cut.append(w)
-                        total += len(w) + (1 if cut else 0)
-                    candidate = " ".join(cut)
-                    if candidate != original:
-                        candidate += "…"
-                else:
-                    # Thêm … nếu đã bị cắt từ so với bản gốc dài hơn đáng kể
-                    if len(words) > max_words:
-                        candidate += "…"
-                return (hook_prefix + candidate).strip()
-
-            title = _shorten_title(title)
-
-        # =========== LENGTH ENFORCEMENT (words) ===========
-        def count_words(text: str) -> int:
-            return len(re.findall(r"\w+", text, flags=re.UNICODE))
-
-        def truncate_to_max_words(text: str, max_words: int) -> str:
-            # Try to preserve sentence boundaries when truncating
-            sentences = re.split(r'(?<=[.!?])\s+', text.strip())
-            out = []
-            total = 0
-            for s in sentences:
-                w = count_words(s)
-                if total + w <= max_words:
-                    out.append(s)
-                    total += w
-                else:
-                    # partial sentence: take remaining words
-                    remain = max_words - total
-                    if remain <= 0:
-                        break
-                    parts = re.findall(r"\S+", s)
-                    out.append(" ".join(parts[:remain]))
-                    total = max_words
-                    break
-            return " ".join(out).strip()
-
-        def expand_content_once(original: str, target_min: int) -> str:
-            # Ask model once to expand the given content to reach the target_min words
-            refine_prompt = engine_layer + "\n" + (
-                "EXPANSION REQUEST: Please expand the CONTENT below to be at least "
-                f"{target_min} words while preserving the same Tone and Format. "
-                "Return ONLY the expanded content (no JSON, no explanation).\n\n"
-            ) + f"EXISTING CONTENT:\n{original}\n"
-            try:
-                if hasattr(client, "models") and hasattr(client.models, "generate_content"):
-                    r = client.models.generate_content(model="gemini-2.5-flash", contents=refine_prompt)
-                elif hasattr(client, "generate_content"):
-                    r = client.generate_content(refine_prompt)
-                else:
-                    return original
-                if not r or not getattr(r, "text", None):
-                    return original
-                text = r.text.strip()
-                # remove fences
-                text = text.replace("```", "").strip()
-                # if model returned JSON accidentally, extract plain text
-                m = re.search(r"\{[\s\S]*\}", text)
-                if m:
-                    # prefer non-json content if there's any
-                    before = text[:m.start()].strip()
-                    if before:
-                        text = before
-                    else:
-                        # fallback: extract a plausible content field
-                        try:
-                            js = json.loads(m.group(0))
-                            return js.get("content", original)
-                        except Exception:
-                            pass
-                return text
-            except Exception:
-                return original
 
-        # New default length windows (min,max) used only if user did not specify desired_length.
-        WORD_LIMITS = {
-            Format.FACEBOOK_POST: (260, 340),  # ~300 words target
-            Format.ADx_COPY: (170, 230),       # ~200 words target
-            Format.VIDEO_SCRIPT: (120, 180),   # ~150 words target (~55–65s)
-        }
-        # Override by desired length if provided (±15%)
-        if isinstance(desired_len, int) and desired_len > 0:
-            min_w = max(10, int(desired_len * 0.85))
-            max_w = int(desired_len * 1.15)
-        else:
-            min_w, max_w = WORD_LIMITS.get(request.selected_format, (20, 220))
-        words = count_words(content)
-
-        # If too long -> truncate
-        if words > max_w:
-            content = truncate_to_max_words(content, max_w)
-
-        # If too short -> attempt one expansion call to the model
-        elif words < min_w:
-            expanded = expand_content_once(content, min_w)
-            if count_words(expanded) >= min_w:
-                content = expanded
-
-        # Post-process: ensure hook in title (very simple heuristic)
-        if request.selected_format == Format.FACEBOOK_POST and not re.search(r"!|\?|\b(đột phá|bí mật|mẹo|cảnh báo)\b", title, re.I):
-            # Nếu sau rút gọn chưa có hook emoji, thêm vào đầu nhưng đảm bảo không vượt quá max_chars (80)
-            if not title.startswith("🔥"):
-                decorated = "🔥 " + title
-                if len(decorated) <= 80:
-                    title = decorated
-
-        # ========== AD/CALL-TO-ACTION DETECTION & PROMPT ENHANCEMENTS ==========
-        ad_style = choose_ad_copy_style(request)
-        cta_intent = choose_cta_intent(request)
-        copy_intensity = choose_copy_intensity(request)
-
-        # If ad_style exists, append a short guideline to the prompt_used for traceability
-        if ad_style:
-            prompt += f"\nAD_STYLE_USED: {ad_style.value}"
-        if cta_intent:
-            prompt += f"\nCTA_INTENT: {cta_intent.value}"
-        if copy_intensity:
-            prompt += f"\nCOPY_INTENSITY: {copy_intensity.value}"
-
-        # Facebook hashtag generation intentionally removed.
-
-        return GeneratedContentResponse(
-            title=title,
-            content=content,
-            prompt_used=prompt,
-        )
+async def _agenerate(
+    request: ContentGenerationRequest,
+    candidates: Optional[list[ModelCandidate]] = None,
+    selected_usps: Optional[list[str]] = None,
+    required_keywords: Optional[list[str]] = None,
+) -> GeneratedContentResponse | None:
+    engine_layer, user_layer = _build_prompt_layers(request, selected_usps, required_keywords)
+    prompt = engine_layer + "\n" + user_layer
+    if candidates is None:
+        candidates = _content_candidates(request, engine_layer)
+
+    response = await gateway.agenerate_content(candidates, user_layer, operation="generate_content")
+    if not response or not getattr(response, "text", None):
+        return None
+
+    data = await _adecode_title_content(response)
+    if data is None:
+        return None
+    _observe_draft(request, data, response)
+    return await _finalize_async(request, prompt, data, candidates)
+
+
+async def generate_marketing_content_async(request: ContentGenerationRequest) -> GeneratedContentResponse | None:
+    """Async variant of `generate_marketing_content`; both model calls go through the gateway's aio path."""
+    try:
+        if not gateway.is_available():
+            return None
+        n = min(request.candidates or 1, CONTENT_MAX_CANDIDATES)
+        if n > 1:
+            return await _agenerate_best_of(request, n)
+        return await _agenerate(request)
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         print(f"Lỗi API Gemini hoặc lỗi phân tích JSON (nâng cấp) ở Giai đoạn 2: {e}")
         return None
 
 
+# =========== BEST-OF-N (candidates=N) ===========
+# N drafts run concurrently and are scored locally; the first one to clear
+# CONTENT_ACCEPT_SCORE wins and the rest are cancelled, otherwise the best
+# draft is kept. Only the winner is post-processed (trim/pad/expansion).
+CONTENT_MAX_CANDIDATES = int(os.getenv("CONTENT_MAX_CANDIDATES", 4))
+CONTENT_ACCEPT_SCORE = float(os.getenv("CONTENT_ACCEPT_SCORE", 0.85))
+
+_SCORE_WEIGHTS = {"keywords": 0.35, "length": 0.25, "hook": 0.2, "cta": 0.2}
+# Lead words of each CTA template ("mua ngay", "đăng ký", ...) plus common generic calls to action
+_CTA_CUES = {intent: " ".join(t.split()[:2]).lower() for intent, t in CTA_TEMPLATES.items()}
+_GENERIC_CTA_RE = re.compile(
+    r"\b(đặt hàng|đặt mua|liên hệ|inbox|nhắn tin|gọi ngay|mua ngay|đăng ký|tìm hiểu|khám phá ngay|"
+    r"shop now|buy now|order now|sign up|learn more|contact us|download)\b",
+    re.I,
+)
+
+
+def _score_draft(request: ContentGenerationRequest, data: dict, required_keywords: list[str]) -> tuple[float, dict]:
+    """Local quality score in [0, 1]: keyword coverage, word-window fit, title hook, CTA presence."""
+    title = data.get("title", "") or ""
+    content = data.get("content", "") or ""
+    text = f"{title}\n{content}".lower()
+
+    if required_keywords:
+        keywords = sum(1 for k in required_keywords if k.lower() in text) / len(required_keywords)
+    else:
+        keywords = 1.0
+
+    min_w, max_w = _length_window(request)
+    words = count_words(content)
+    if min_w <= words <= max_w:
+        length = 1.0
+    elif words > max_w:
+        # Trimmed locally at a sentence boundary: cheap, but content is lost
+        length = max(0.0, 0.9 - (words - max_w) / max_w)
+    else:
+        length = max(0.0, 1.0 - 2 * (min_w - words) / min_w)
+
+    if (getattr(request, "custom_title", None) or "").strip():
+        hook = 1.0
+    else:
+        hook = 1.0 if _TITLE_HOOK_RE.search(title) else 0.4
+        if len(re.findall(r"\S+", title)) > 14:
+            hook -= 0.3
+
+    cue = _CTA_CUES.get(choose_cta_intent(request))
+    if cue and cue in text:
+        cta = 1.0
+    else:
+        cta = 0.6 if _GENERIC_CTA_RE.search(content) else 0.0
+
+    parts = {"keywords": keywords, "length": length, "hook": max(0.0, hook), "cta": cta}
+    return sum(_SCORE_WEIGHTS[k] * v for k, v in parts.items()), parts
+
+
+class _BestOfStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"runs": 0, "drafts_requested": 0, "drafts_scored": 0, "early_accepts": 0, "cancelled": 0}
+        self.best_score_sum = 0.0
+
+    def record(self, requested: int, scored: int, early: bool, cancelled: int, best_score: Optional[float]) -> None:
+        with self._lock:
+            self.counts["runs"] += 1
+            self.counts["drafts_requested"] += requested
+            self.counts["drafts_scored"] += scored
+            self.counts["early_accepts"] += int(early)
+            self.counts["cancelled"] += cancelled
+            if best_score is not None:
+                self.best_score_sum += best_score
+
+    def stats(self) -> dict:
+        with self._lock:
+            runs = self.counts["runs"]
+            return {
+                **self.counts,
+                "avg_best_score": round(self.best_score_sum / runs, 4) if runs else 0.0,
+                "accept_score": CONTENT_ACCEPT_SCORE,
+                "max_candidates": CONTENT_MAX_CANDIDATES,
+            }
+
+
+best_of_stats = _BestOfStats()
+
+
+def content_candidate_stats() -> dict:
+    return best_of_stats.stats()
+
+
+async def _adraft(candidates: list[ModelCandidate], user_layer: str) -> tuple[dict | None, object]:
+    response = await gateway.agenerate_content(candidates, user_layer, operation="generate_content")
+    if not response or not getattr(response, "text", None):
+        return None, response
+    return await _adecode_title_content(response), response
+
+
+async def _agenerate_best_of(request: ContentGenerationRequest, n: int) -> GeneratedContentResponse | None:
+    engine_layer, user_layer = _build_prompt_layers(request)
+    prompt = engine_layer + "\n" + user_layer
+    candidates = _content_candidates(request, engine_layer)
+    required_keywords = _parse_required_keywords(request)
+
+    tasks = [asyncio.ensure_future(_adraft(candidates, user_layer)) for _ in range(n)]
+    best: Optional[tuple[float, dict, object]] = None
+    last_error: Optional[Exception] = None
+    scored = 0
+    early = False
+    try:
+        for fut in asyncio.as_completed(tasks):
+            try:
+                data, response = await fut
+            except Exception as e:
+                last_error = e
+                continue
+            if data is None:
+                continue
+            score, parts = _score_draft(request, data, required_keywords)
+            scored += 1
+            logging.info("Content candidate scored %.2f %s", score, {k: round(v, 2) for k, v in parts.items()})
+            if best is None or score > best[0]:
+                best = (score, data, response)
+            if score >= CONTENT_ACCEPT_SCORE:
+                early = True
+                break
+    finally:
+        pending = [t for t in tasks if not t.done()]
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        best_of_stats.record(n, scored, early, len(pending), best[0] if best else None)
+
+    if best is None:
+        if last_error is not None:
+            raise last_error
+        return None
+    _, data, response = best
+    _observe_draft(request, data, response)
+    return await _finalize_async(request, prompt, data, candidates)
+
+
+# =========== BATCH VARIANTS ===========
+CONTENT_BATCH_MAX_VARIANTS = int(os.getenv("CONTENT_BATCH_MAX_VARIANTS", 24))
+CONTENT_BATCH_MAX_CONCURRENCY = int(os.getenv("CONTENT_BATCH_MAX_CONCURRENCY", 4))
+
+_VARIANT_AXES = (
+    ("tones", "selected_tone"),
+    ("formats", "selected_format"),
+    ("languages", "language"),
+    ("ad_copy_styles", "ad_copy_style"),
+)
+
+
+def build_variant_overrides(batch: ContentBatchRequest) -> list[dict]:
+    """Cartesian product of the provided matrix axes, then the explicit `variants` (duplicates dropped)."""
+    axes = [(field, list(dict.fromkeys(getattr(batch, name)))) for name, field in _VARIANT_AXES if getattr(batch, name)]
+    overrides: list[dict] = []
+    if axes:
+        for combo in itertools.product(*(values for _, values in axes)):
+            overrides.append({field: value for (field, _), value in zip(axes, combo)})
+    for v in batch.variants or []:
+        o = v.model_dump(exclude_none=True)
+        if o:
+            overrides.append(o)
+    if not overrides:
+        overrides.append({})
+    seen, unique = set(), []
+    for o in overrides:
+        key = tuple(sorted((k, str(v)) for k, v in o.items()))
+        if key not in seen:
+            seen.add(key)
+            unique.append(o)
+    return unique
+
+
+async def generate_content_batch(
+    base: ContentGenerationRequest,
+    overrides: list[dict],
+    max_concurrency: Optional[int] = None,
+) -> AsyncIterator[tuple[int, GeneratedContentResponse | None, Exception | None]]:
+    """Generate every variant concurrently and yield (index, result, error) as each finishes.
+
+    USPs and keywords are parsed once for the batch, and the engine-layer
+    candidates (system instruction) are prepared once per
+    distinct (format, language, SEO) key instead of once per variant.
+    """
+    selected_usps = _get_selected_usps_list(base)
+    required_keywords = _parse_required_keywords(base)
+    shared = base.model_copy(update={"selected_usps": selected_usps, "selected_usp": None})
+    requests = [shared.model_copy(update=o) for o in overrides]
+
+    candidates_by_key: dict[str, list[ModelCandidate]] = {}
+    for req in requests:
+        key = _engine_key(req)
+        if key not in candidates_by_key:
+            engine_layer, _ = _build_prompt_layers(req, selected_usps, required_keywords)
+            candidates_by_key[key] = _content_candidates(req, engine_layer)
+
+    limit = max(1, min(max_concurrency or CONTENT_BATCH_MAX_CONCURRENCY, CONTENT_BATCH_MAX_CONCURRENCY))
+    sem = asyncio.Semaphore(limit)
+
+    async def run(index: int, req: ContentGenerationRequest):
+        async with sem:
+            try:
+                result = await _agenerate(req, candidates_by_key[_engine_key(req)], selected_usps, required_keywords)
+                return index, result, None
+            except Exception as e:
+                logging.warning("Batch variant %d failed: %s", index, e)
+                return index, None, e
+
+    tasks = [asyncio.ensure_future(run(i, req)) for i, req in enumerate(requests)]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        # Client went away: stop the variants that are still queued or running, and wait for
+        # their cleanup (limiter slots, metrics) before the generator is gone
+        pending = [t for t in tasks if not t.done()]
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+# =========== STREAMING (SSE) ===========
+_JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class _StreamingFieldReader:
+    """Pull "title" / "content" string values out of a JSON object as it arrives.
+
+    `feed()` takes raw model chunks and returns newly decoded text per field, so
+    the title can be sent once closed and the content forwarded token by token
+    without waiting for the whole object to parse.
+    """
+
+    def __init__(self, fields: tuple[str, ...] = ("title", "content")):
+        self.buffer = ""
+        self._patterns = {f: re.compile(r'"%s"\s*:\s*"' % re.escape(f)) for f in fields}
+        self._pos: dict[str, int] = {}       # next undecoded index inside the string value
+        self.values: dict[str, str] = {f: "" for f in fields}
+        self.closed: set[str] = set()
+
+    def feed(self, chunk: str) -> dict[str, str]:
+        self.buffer += chunk
+        out: dict[str, str] = {}
+        for field, pattern in self._patterns.items():
+            if field in self.closed:
+                continue
+            if field not in self._pos:
+                m = pattern.search(self.buffer)
+                if not m:
+                    continue
+                self._pos[field] = m.end()
+            delta = self._decode(field)
+            if delta:
+                self.values[field] += delta
+                out[field] = delta
+        return out
+
+    def _decode(self, field: str) -> str:
+        buf, i = self.buffer, self._pos[field]
+        out = []
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.closed.add(field)
+                i += 1
+                break
+            if ch != '\\':
+                out.append(ch)
+                i += 1
+                continue
+            # Escape sequence: wait for the rest of it if the chunk split it
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc == 'u':
+                if i + 6 > len(buf):
+                    break
+                try:
+                    code = int(buf[i + 2:i + 6], 16)
+                except ValueError:
+                    out.append(buf[i:i + 6])
+                    i += 6
+                    continue
+                if 0xD800 <= code < 0xDC00:
+                    # High surrogate (emoji etc.): decode together with its pair
+                    if i + 12 > len(buf):
+                        break
+                    pair = buf[i:i + 12]
+                    try:
+                        out.append(json.loads('"%s"' % pair))
+                        i += 12
+                        continue
+                    except ValueError:
+                        pass
+                out.append(chr(code))
+                i += 6
+            else:
+                out.append(_JSON_ESCAPES.get(esc, esc))
+                i += 2
+        self._pos[field] = i
+        return "".join(out)
+
+
+async def stream_marketing_content(request: ContentGenerationRequest) -> AsyncIterator[tuple[str, dict]]:
+    """Stream content generation as (event, payload) pairs for Server-Sent Events.
+
+    Events: "title" once the model has closed the title string, "content" for each
+    body delta, then "final" with the same post-processed `GeneratedContentResponse`
+    the non-streaming endpoint returns (shortened title, truncated/expanded body).
+
+    An empty or undecodable answer ends the stream without "final": with no event
+    sent yet the route answers 400, otherwise an "error" event (400) closes it.
+    """
+    engine_layer, user_layer = _build_prompt_layers(request)
+    prompt = engine_layer + "\n" + user_layer
+
+    if not gateway.is_available():
+        raise LLMUnavailableError("Gemini client not initialized.")
+
+    candidates = _content_candidates(request, engine_layer)
+    reader = _StreamingFieldReader()
+    title_sent = sent = False
+    async for chunk in gateway.astream_content(candidates, user_layer, operation="generate_content"):
+        deltas = reader.feed(chunk)
+        if not title_sent and "title" in reader.closed:
+            title_sent = True
+            sent = True
+            yield "title", {"title": reader.values["title"]}
+        if "content" in deltas:
+            sent = True
+            yield "content", {"delta": deltas["content"]}
+
+    raw_text = reader.buffer
+    data = await _adecode_title_content(raw_text)
+    if data is None:
+        logging.warning("Streamed content was empty or did not match the response schema (%d chars)", len(raw_text))
+        if sent:
+            yield "error", {"status": 400, "detail": "Không thể tạo nội dung, vui lòng thử lại với các thông số khác."}
+        return
+    _observe_draft(request, data)
+    result = await _finalize_async(request, prompt, data, candidates)
+    yield "final", result.model_dump()
+
+
 def choose_ad_copy_style(request) -> AdCopyStyle | None:
     """Auto-detect an ad copy style when user didn't provide one.
 
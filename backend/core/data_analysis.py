@@ -1,10 +1,13 @@
-import json
+import os
+import hashlib
 import logging
-import time
-import random
 from google.genai import types
 from models.schemas import ProductAnalysisResult
-from core.ai_clients import get_gemini_client, GEMINI_API_KEY
+from core.llm_gateway import gateway, ModelCandidate, LLMUnavailableError
+from core.result_cache import get_cache, make_key, normalize_text_key
+from core.singleflight import get_group
+from core.structured_output import json_config, decode_structured, adecode_structured
+from core.json_extract import coerce_to_model
 
 logger = logging.getLogger(__name__)
 # Reduce noisy logs from Google SDK if desired
@@ -14,13 +17,10 @@ try:
 except Exception:
     pass
 
-def analyze_product_data(product_name: str) -> ProductAnalysisResult | None:
-    """
-    Sử dụng Gemini API với chức năng tìm kiếm web để phân tích và trích xuất dữ liệu.
-    """
-    
+
+def _build_prompt(product_name: str) -> str:
     # Kỹ thuật Prompt Engineering
-    prompt = f"""
+    return f"""
     Conduct market research for the product: '{product_name}'.
 Using publicly available search data, analyze and extract the following parameters:
 
@@ -37,119 +37,186 @@ with the following keys: 'usps' (list of strings), 'pain_points' (list of string
 Use Vietnamese language for all outputs.
     """
 
+
+def _search_config():
+    cfg = types.GenerateContentConfig(tools=[{"google_search": {}}]) if hasattr(types, "GenerateContentConfig") else None
+    logger.debug("Gemini config prepared: %s", cfg)
+    return cfg
+
+
+# product_name comes from the request, not from the model
+_SCHEMA_EXCLUDE = ("product_name",)
+
+
+def _candidates() -> list[ModelCandidate]:
+    # Grounded call first (tools can't be combined with response_schema), then
+    # schema-constrained calls without tools on the same model and an older one
+    cfg = _search_config()
+    structured = json_config(ProductAnalysisResult, _SCHEMA_EXCLUDE)
+    return [
+        ModelCandidate("gemini-2.5-flash", cfg),
+        ModelCandidate("gemini-2.5-flash", structured),
+        ModelCandidate("gemini-1.5-flash", structured),
+    ]
+
+
+# Bump automatically whenever the prompt template or model chain changes
+PROMPT_VERSION = hashlib.sha256(
+    (_build_prompt("{product_name}") + "|".join(c.model for c in _candidates())).encode("utf-8")
+).hexdigest()[:12]
+
+PRODUCT_CACHE_TTL_SECONDS = float(os.getenv("PRODUCT_CACHE_TTL_SECONDS", 6 * 60 * 60))
+product_cache = get_cache(
+    "product_analysis",
+    ttl_seconds=PRODUCT_CACHE_TTL_SECONDS,
+    max_entries=int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", 512)),
+)
+
+
+inflight = get_group("analyze_product")
+
+
+def _cache_key(product_name: str) -> str:
+    # Shared by the result cache and single-flight: (normalized name, prompt version)
+    return make_key("analyze_product", normalize_text_key(product_name), PROMPT_VERSION)
+
+
+def _cached_result(product_name: str) -> ProductAnalysisResult | None:
+    data = product_cache.get(_cache_key(product_name))
+    if data is None:
+        return None
     try:
-        client = get_gemini_client()
-        if not client or not GEMINI_API_KEY:
-            return None
+        return ProductAnalysisResult(**{**data, "product_name": product_name})
+    except Exception as e:
+        logger.warning("Ignoring unreadable cached analysis for '%s': %s", product_name, e)
+        return None
+
+
+def _store_result(product_name: str, result: ProductAnalysisResult | None) -> None:
+    # Only cache real analyses; empty results should be retried on the next request
+    if result and (result.usps or result.pain_points):
+        product_cache.set(_cache_key(product_name), result.model_dump())
+
+
+def _normalize(data: dict) -> dict:
+    # Grounded answers are not schema-constrained: coerce types and fill missing fields
+    logger.debug("Parsed Gemini data: %s", data)
+    return coerce_to_model(ProductAnalysisResult, data, fill_missing=True)
+
 
-        cfg = types.GenerateContentConfig(tools=[{"google_search": {}}]) if hasattr(types, "GenerateContentConfig") else None
-        logger.debug("Gemini config prepared: %s", cfg)
-
-        def do_call(model_name: str, use_cfg: bool):
-            if hasattr(client, "models") and hasattr(client.models, "generate_content"):
-                return client.models.generate_content(
-                    model=model_name,
-                    contents=prompt,
-                    config=(cfg if use_cfg else None)
-                )
-            elif hasattr(client, "generate_content"):
-                # Fallback without tools config
-                return client.generate_content(prompt)
+def _has_text(product_name: str, response, last_err) -> bool:
+    if not response or not getattr(response, "text", None):
+        print(f"Gemini API không trả về nội dung văn bản cho sản phẩm: {product_name}")
+        if last_err:
+            print(f"Lỗi API Gemini hoặc lỗi kết nối chung: {last_err}")
+        return False
+    return True
+
+
+def _parse_response(product_name: str, response, last_err) -> ProductAnalysisResult | None:
+    if not _has_text(product_name, response, last_err):
+        return None
+    return decode_structured(
+        response, ProductAnalysisResult, "analyze_product",
+        exclude=_SCHEMA_EXCLUDE, overrides={"product_name": product_name}, normalize=_normalize,
+    )
+
+
+async def _aparse_response(product_name: str, response, last_err) -> ProductAnalysisResult | None:
+    if not _has_text(product_name, response, last_err):
+        return None
+    return await adecode_structured(
+        response, ProductAnalysisResult, "analyze_product",
+        exclude=_SCHEMA_EXCLUDE, overrides={"product_name": product_name}, normalize=_normalize,
+    )
+
+
+def _run_analysis(product_name: str) -> ProductAnalysisResult | None:
+    prompt = _build_prompt(product_name)
+
+    try:
+        if not gateway.is_available():
             return None
 
-        # Retry with exponential backoff and final fallback model/config
         response = None
         last_err = None
-        models_try = [
-            ("gemini-2.5-flash", True),
-            ("gemini-2.5-flash", True),
-            ("gemini-2.5-flash", False),
-            ("gemini-1.5-flash", False),
-        ]
-        for attempt, (model_name, use_cfg) in enumerate(models_try, start=1):
-            try:
-                response = do_call(model_name, use_cfg)
-                if response and getattr(response, "text", None):
-                    break
-                else:
-                    raise RuntimeError("Empty response text from Gemini")
-            except Exception as e:
-                last_err = e
-                msg = str(e)
-                # Backoff only for transient overloads/timeouts
-                if attempt < len(models_try) and any(t in msg for t in ["503", "UNAVAILABLE", "overloaded", "timeout", "temporarily"]):
-                    delay = min(2 ** attempt + random.uniform(0, 0.5), 8)
-                    logging.info("Gemini call failed (attempt %d/%d, model=%s, cfg=%s). Retrying in %.1fs...", attempt, len(models_try), model_name, use_cfg, delay)
-                    time.sleep(delay)
-                    continue
-                else:
-                    logging.warning("Gemini call failed (attempt %d/%d): %s", attempt, len(models_try), msg)
-                    if attempt < len(models_try):
-                        continue
-                    break
-
-        if not response or not getattr(response, "text", None):
-            print(f"Gemini API không trả về nội dung văn bản cho sản phẩm: {product_name}")
-            if last_err:
-                print(f"Lỗi API Gemini hoặc lỗi kết nối chung: {last_err}")
-            return None
-            
         try:
-            json_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-            data = json.loads(json_text)
-        except json.JSONDecodeError as e:
+            response = gateway.generate_content(_candidates(), prompt, operation="analyze_product")
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            last_err = e
+
+        result = _parse_response(product_name, response, last_err)
+        _store_result(product_name, result)
+        return result
+
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        print(f"Lỗi API Gemini hoặc lỗi kết nối chung: {e}")
+        return None
+
+
+async def _run_analysis_async(product_name: str) -> ProductAnalysisResult | None:
+    prompt = _build_prompt(product_name)
 
-            logger.warning("Lỗi phân tích JSON từ Gemini: %s", e)
-            logger.debug("Text gốc gây lỗi: %s", getattr(response, "text", "")[:1000])
-            # Có thể trả về kết quả rỗng nếu không thể đọc được
+    try:
+        if not gateway.is_available():
             return None
 
-        # Normalize fields to expected types (ProductAnalysisResult expects strings for some fields)
-        def ensure_list_of_str(v):
-            if v is None:
-                return []
-            if isinstance(v, list):
-                return [str(x) for x in v]
-            if isinstance(v, str):
-                # try splitting by newline or comma if it looks like a single string list
-                if "\n" in v:
-                    return [s.strip() for s in v.splitlines() if s.strip()]
-                if "," in v:
-                    return [s.strip() for s in v.split(",") if s.strip()]
-                return [v]
-            # fallback: stringify
-            return [str(v)]
-
-        def ensure_str(v):
-            if v is None:
-                return "Chưa xác định"
-            if isinstance(v, str):
-                return v
-            if isinstance(v, list):
-                return ", ".join(str(x) for x in v)
-            if isinstance(v, dict):
-                # Prefer a concise representation
-                try:
-                    return json.dumps(v, ensure_ascii=False)
-                except Exception:
-                    return str(v)
-            return str(v)
-
-        logger.debug("Parsed Gemini data: %s", data)
-
-        usps = ensure_list_of_str(data.get('usps'))
-        pain_points = ensure_list_of_str(data.get('pain_points'))
-        target_persona = ensure_str(data.get('target_persona'))
-        infor_field = ensure_str(data.get('infor'))
-
-        return ProductAnalysisResult(
-            product_name=product_name,
-            usps=usps,
-            pain_points=pain_points,
-            target_persona=target_persona,
-            infor=infor_field,
-        )
-        
+        response = None
+        last_err = None
+        try:
+            response = await gateway.agenerate_content(_candidates(), prompt, operation="analyze_product")
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            last_err = e
+
+        result = await _aparse_response(product_name, response, last_err)
+        _store_result(product_name, result)
+        return result
+
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         print(f"Lỗi API Gemini hoặc lỗi kết nối chung: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def _for_caller(result: ProductAnalysisResult | None, product_name: str) -> ProductAnalysisResult | None:
+    # A coalesced caller may have typed the name differently ("iphone 15" vs "iPhone 15")
+    if result is None or result.product_name == product_name:
+        return result
+    return result.model_copy(update={"product_name": product_name})
+
+
+def analyze_product_data(product_name: str, force_refresh: bool = False) -> ProductAnalysisResult | None:
+    """
+    Sử dụng Gemini API với chức năng tìm kiếm web để phân tích và trích xuất dữ liệu.
+
+    Kết quả được cache theo tên sản phẩm đã chuẩn hoá + PROMPT_VERSION;
+    `force_refresh=True` bỏ qua cache và ghi đè bằng kết quả mới.
+    Các yêu cầu giống hệt nhau đang chạy đồng thời chỉ gọi Gemini một lần.
+    """
+    if not force_refresh:
+        cached = _cached_result(product_name)
+        if cached:
+            logger.info("Product analysis cache hit for '%s'", product_name)
+            return cached
+
+    result = inflight.do(_cache_key(product_name), _run_analysis, product_name)
+    return _for_caller(result, product_name)
+
+
+async def analyze_product_data_async(product_name: str, force_refresh: bool = False) -> ProductAnalysisResult | None:
+    """Async variant of `analyze_product_data`; backoff between retries never holds a thread."""
+    if not force_refresh:
+        cached = _cached_result(product_name)
+        if cached:
+            logger.info("Product analysis cache hit for '%s'", product_name)
+            return cached
+
+    result = await inflight.do_async(_cache_key(product_name), _run_analysis_async, product_name)
+    return _for_caller(result, product_name)
@@ -1,22 +1,27 @@
 import os
-import json
+import time
+import hashlib
 import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from io import BytesIO
-from typing import Optional, Tuple
-from core.ai_clients import get_gemini_client, GEMINI_API_KEY
+from typing import Optional
+from core.ai_clients import GEMINI_API_KEY, LLM_PROVIDER, LLMUnavailableError
+from core.llm_gateway import gateway, ModelCandidate
+from core.structured_output import decode_structured, json_config
+from core.json_extract import coerce_to_model
+from core.result_cache import get_cache, make_key, normalize_text_key
+from core.singleflight import get_group
+from core.document_chunking import split_text, merge_items, merge_keywords, pick_name
 from google.genai import types
 
-# document parsing libraries
-try:
-    import docx
-except Exception:
-    docx = None
-
-try:
-    from pypdf import PdfReader
-except Exception:
-    PdfReader = None
+# document parsing (pypdf / the streaming DOCX reader run in the sandboxed parse workers)
+from core.pdf_extract import PdfReader
+from core.parse_sandbox import DocumentRejectedError, DocumentSource, parse_document, parse_pdf_scan
+from core.ocr import (
+    OCR_BACKEND, OCR_BATCH_PAGES, OCR_MAX_BATCH_BYTES, OCR_MAX_PAGES, OCR_PAGE_CHARS, ocr_enabled, transcribe_batches,
+)
 
 from models.schemas import GeneratedContentResponse, ProductAnalysisResult
 
@@ -25,142 +30,250 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-if not GEMINI_API_KEY:
+# The offline fake provider (LLM_PROVIDER=fake) needs no key
+if not GEMINI_API_KEY and LLM_PROVIDER != "fake":
     raise ValueError("GEMINI_API_KEY không được tìm thấy. Vui lòng tạo file .env.")
 
+_HASH_CHUNK_BYTES = 1024 * 1024
 
-def extract_text_from_docx(file_bytes: bytes) -> str:
-    """Extract text from a .docx file bytes."""
-    if docx is None:
-        logger.warning("python-docx not installed; cannot parse docx files.")
-        return ""
+
+def _read_bytes(source: DocumentSource, limit: Optional[int] = None) -> bytes:
+    """Whole source (or its first `limit` bytes) as bytes; only where an API needs bytes."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:limit] if limit is not None else source)
+    source.seek(0)
+    data = source.read(limit if limit is not None else -1)
+    source.seek(0)
+    return data
+
+
+def extract_text_from_docx(file_bytes: DocumentSource, max_chars: Optional[int] = None) -> str:
+    """Extract paragraphs, tables, text boxes and headers/footers of a .docx (see core.docx_extract) in a parse worker."""
     try:
-        document = docx.Document(BytesIO(file_bytes))
-        return "\n".join([p.text for p in document.paragraphs])
+        return parse_document("docx", file_bytes, max_chars)
+    except DocumentRejectedError:
+        raise
     except Exception as e:
         logger.warning("Error reading DOCX: %s", e)
         return ""
 
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
-    """Extract text from a PDF file bytes."""
+def _pdf_text_with_ocr(file_bytes: DocumentSource, max_chars: Optional[int]) -> tuple[str, bool]:
+    """(text, complete): text layer per page, image-only (scanned) pages filled in by the OCR backend.
+
+    `complete` is False when an OCR batch failed, so the text is missing pages.
+    """
+    scan = parse_pdf_scan(
+        file_bytes, max_chars,
+        max_image_pages=OCR_MAX_PAGES,
+        image_page_chars=OCR_PAGE_CHARS,
+        batch_pages=OCR_BATCH_PAGES,
+        max_batch_bytes=OCR_MAX_BATCH_BYTES,
+    )
+    if scan.skipped:
+        logger.info("OCR: %d scanned page(s) over OCR_MAX_BATCH_BYTES left out", len(scan.skipped))
+    pages = list(scan.pages)
+    texts, failed = transcribe_batches(scan.batches, scan.n_pages, len(scan.skipped))
+    for index, text in texts.items():
+        pages[index] = text
+    if failed:
+        logger.warning("OCR: %d of %d batch(es) failed; their pages are missing from the text", failed, len(scan.batches))
+    if not any(p.strip() for p in pages):
+        return "", not failed
+    text = "\f".join(pages)
+    return (text[:max_chars] if max_chars is not None else text), not failed
+
+
+def _extract_pdf(file_bytes: DocumentSource, max_chars: Optional[int]) -> tuple[str, bool]:
+    """(text, complete); see `extract_text_from_pdf`."""
     if PdfReader is None:
         logger.warning("pypdf not installed; cannot parse PDF files.")
-        return ""
+        return "", True
     try:
-        reader = PdfReader(BytesIO(file_bytes))
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text
+        if ocr_enabled():
+            return _pdf_text_with_ocr(file_bytes, max_chars)
+        return parse_document("pdf", file_bytes, max_chars), True
+    except (DocumentRejectedError, LLMUnavailableError):
+        # Over a sandbox limit: don't fall back to sending the file to the model either.
+        # Model unavailable during OCR: the request gets a 503.
+        raise
     except Exception as e:
         logger.warning("Error reading PDF: %s", e)
-        return ""
+        return "", True
+
+
+def extract_text_from_pdf(file_bytes: DocumentSource, max_chars: Optional[int] = None) -> str:
+    """Extract text from a PDF (bytes or binary file) in a parse worker; stops after `max_chars` characters.
+
+    With OCR enabled, pages without a text layer are sent (alone, as small
+    PDFs) to the OCR backend and their text is merged in page order.
+    """
+    return _extract_pdf(file_bytes, max_chars)[0]
 
 
-def extract_text_from_txt(file_bytes: bytes) -> str:
-    """Extract text from a plain text file bytes."""
+def extract_text_from_txt(file_bytes: DocumentSource, max_chars: Optional[int] = None) -> str:
+    """Extract text from a plain text file (bytes or binary file); at most `max_chars` characters."""
+    # UTF-8 needs at most 4 bytes per character, so the budget bounds the read
+    raw = _read_bytes(file_bytes, max_chars * 4 if max_chars is not None else None)
     for encoding in ("utf-8-sig", "utf-8", "latin-1"):
         try:
-            return file_bytes.decode(encoding, errors="replace")
+            text = raw.decode(encoding, errors="replace")
+            return text[:max_chars] if max_chars is not None else text
         except Exception:
             continue
     return ""
 
 
-def detect_product_name_with_gemini(file_bytes: bytes, file_type: str) -> Tuple[Optional[str], float, Optional[str]]:
-    """Use Gemini to read the original file (PDF/DOC/TXT) directly and detect the main product name.
+def extract_text(file_bytes: DocumentSource, file_type: str, max_chars: Optional[int] = None) -> Optional[str]:
+    """Text of a pdf/docx/txt document ("" if nothing could be read); None for an unsupported type.
 
-    Returns (product_name, confidence, reason).
-    If detection fails, product_name will be None and confidence 0.0.
+    `max_chars` lets extraction stop early. Raises DocumentRejectedError when a
+    PDF/DOCX breaks a parse sandbox limit (timeout, memory, crashed parser).
     """
-    try:
-        client = get_gemini_client()
-        if not client:
-            logger.error("Gemini client not initialized; cannot detect product name from document.")
-            return None, 0.0, None
-
-        if not hasattr(types, "Part"):
-            logger.error("google.genai.types.Part not available; cannot send raw file to Gemini.")
-            return None, 0.0, None
-
-        mime_type = "application/pdf"
-        if file_type == "docx":
-            mime_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        elif file_type == "txt":
-            mime_type = "text/plain"
-
-        doc_part = types.Part.from_bytes(data=file_bytes, mime_type=mime_type)
-
-        prompt = """
-Bạn là một chuyên gia marketing.
-Nhiệm vụ: đọc tài liệu (PDF/DOC/TXT) được gửi kèm và xác định 1 sản phẩm/chương trình/dịch vụ CHÍNH đang được quảng bá.
+    if file_type == 'pdf':
+        return extract_text_from_pdf(file_bytes, max_chars)
+    if file_type == 'docx':
+        return extract_text_from_docx(file_bytes, max_chars)
+    if file_type == 'txt':
+        return extract_text_from_txt(file_bytes, max_chars)
+    return None
+
+
+# ---------- content-addressed caches (SHA-256 of the uploaded bytes) ----------
+# Bump when extraction output changes for the same bytes (page joining, docx paragraphs, ...)
+EXTRACTOR_VERSION = "8"
+DOCUMENT_CACHE_TTL_SECONDS = float(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", 30 * 24 * 60 * 60))
+document_text_cache = get_cache(
+    "document_text",
+    ttl_seconds=DOCUMENT_CACHE_TTL_SECONDS,
+    max_entries=int(os.getenv("DOCUMENT_TEXT_CACHE_MAX_ENTRIES", 32)),
+    max_disk_bytes=int(os.getenv("DOCUMENT_TEXT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+)
+document_analysis_cache = get_cache(
+    "document_analysis",
+    ttl_seconds=DOCUMENT_CACHE_TTL_SECONDS,
+    max_entries=int(os.getenv("DOCUMENT_ANALYSIS_CACHE_MAX_ENTRIES", 256)),
+    max_disk_bytes=int(os.getenv("DOCUMENT_ANALYSIS_CACHE_MAX_BYTES", 8 * 1024 * 1024)),
+)
+
+
+# Single-call mode sends at most this many characters of the document
+MAX_TEXT_LENGTH = 15000
+
+# Longer documents are analyzed in chunks (map) and merged locally (reduce)
+DOCUMENT_CHUNKED = os.getenv("DOCUMENT_CHUNKED", "true").lower() in ("1", "true", "yes")
+DOCUMENT_CHUNK_CHARS = int(os.getenv("DOCUMENT_CHUNK_CHARS", 12000))
+DOCUMENT_MAX_CHUNKS = int(os.getenv("DOCUMENT_MAX_CHUNKS", 8))
+DOCUMENT_CHUNK_CONCURRENCY = int(os.getenv("DOCUMENT_CHUNK_CONCURRENCY", 4))
+DOCUMENT_MERGED_MAX_ITEMS = int(os.getenv("DOCUMENT_MERGED_MAX_ITEMS", 8))
+
+
+def _extract_budget() -> int:
+    # Read past the chunk cap so coverage shows what the cap leaves out
+    return DOCUMENT_CHUNK_CHARS * DOCUMENT_MAX_CHUNKS * 2 if DOCUMENT_CHUNKED else MAX_TEXT_LENGTH
+
+
+class _DocumentStats:
+    """Coverage (analyzed / extracted chars) and wall time of document analyses."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.chunked = 0
+        self.chunks = 0
+        self.chunk_failures = 0
+        self.chars_extracted = 0
+        self.chars_analyzed = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def observe(self, extracted: int, analyzed: int, chunks: int, failed: int, seconds: float) -> None:
+        with self._lock:
+            self.documents += 1
+            self.chunked += chunks > 1
+            self.chunks += chunks
+            self.chunk_failures += failed
+            self.chars_extracted += extracted
+            self.chars_analyzed += analyzed
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            n = self.documents
+            return {
+                "documents": n,
+                "chunked_documents": self.chunked,
+                "chunks": self.chunks,
+                "chunk_failures": self.chunk_failures,
+                "coverage": round(self.chars_analyzed / self.chars_extracted, 4) if self.chars_extracted else 0.0,
+                "avg_seconds": round(self.seconds / n, 3) if n else 0.0,
+                "max_seconds": round(self.max_seconds, 3),
+                "chunked_mode": DOCUMENT_CHUNKED,
+                "max_chunks": DOCUMENT_MAX_CHUNKS,
+            }
+
+
+document_stats = _DocumentStats()
+
+
+def document_analysis_stats() -> dict:
+    return document_stats.snapshot()
+
+
+def document_digest(file_bytes: DocumentSource) -> str:
+    if isinstance(file_bytes, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(file_bytes).hexdigest()
+    h = hashlib.sha256()
+    file_bytes.seek(0)
+    for chunk in iter(lambda: file_bytes.read(_HASH_CHUNK_BYTES), b""):
+        h.update(chunk)
+    file_bytes.seek(0)
+    return h.hexdigest()
+
+
+def extract_document_text(file_bytes: DocumentSource, file_type: str, digest: Optional[str] = None) -> Optional[str]:
+    """Text as read for analysis (same budget, so it shares the document_text cache entry).
+
+    "" when an OCR batch failed: the follow-up index is only built from the whole document.
+    """
+    text, complete = _extract_text_cached(file_bytes, file_type, _extract_budget(), digest)
+    return text if complete or text is None else ""
 
-Quy tắc:
-- Nếu có nhiều sản phẩm, hãy chọn sản phẩm làm trọng tâm, được nhắc đến nhiều nhất hoặc rõ nhất.
-- Không bịa thêm tên sản phẩm nếu tài liệu không đề cập.
-
-ĐẦU RA BẮT BUỘC: trả về DUY NHẤT một JSON hợp lệ, KHÔNG thêm chữ nào khác:
-{
-  "product_name": "tên sản phẩm chính hoặc null nếu không rõ",
-  "confidence": 0.0-1.0,
-  "reason": "giải thích ngắn (tối đa 40 từ) vì sao chọn tên này"
-}
-"""
 
-        cfg = types.GenerateContentConfig(response_mime_type="application/json") if hasattr(types, "GenerateContentConfig") else None
+def extract_text_cached(file_bytes: DocumentSource, file_type: str, max_chars: Optional[int] = None, digest: Optional[str] = None) -> Optional[str]:
+    """`extract_text` behind the document_text cache (by content hash + EXTRACTOR_VERSION)."""
+    return _extract_text_cached(file_bytes, file_type, max_chars, digest)[0]
 
-        response = None
-        contents = [doc_part, prompt]
-        if hasattr(client, "models") and hasattr(client.models, "generate_content"):
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=contents,
-                config=cfg,
-            )
-        elif hasattr(client, "generate_content"):
-            response = client.generate_content(contents)
-        else:
-            logger.error("Gemini client missing generate_content for product name detection.")
-            return None, 0.0, None
 
-        text_out = getattr(response, "text", None)
-        if not text_out:
-            logger.warning("Gemini returned empty text for product name detection.")
-            return None, 0.0, None
-
-        try:
-            cleaned = text_out.strip().replace("```json", "").replace("```", "").strip()
-            data = json.loads(cleaned)
-        except Exception as e:
-            logger.warning("Failed to parse JSON from Gemini product name detection: %s", e)
-            logger.debug("Raw response: %s", text_out[:2000])
-            return None, 0.0, None
-
-        name = data.get("product_name") if isinstance(data, dict) else None
-        confidence = float(data.get("confidence") or 0.0) if isinstance(data, dict) else 0.0
-        reason = data.get("reason") if isinstance(data, dict) else None
-        if isinstance(name, str):
-            name = name.strip() or None
-        return name, confidence, reason
-    except Exception as e:
-        logger.error("Error detecting product name with Gemini: %s", e)
-        return None, 0.0, None
+def _extract_text_cached(file_bytes: DocumentSource, file_type: str, max_chars: Optional[int], digest: Optional[str]) -> tuple[Optional[str], bool]:
+    """(text, complete); text missing pages after a failed OCR batch is not cached."""
+    # PDF text depends on which OCR backend filled in the scanned pages
+    ocr = OCR_BACKEND if file_type == "pdf" and ocr_enabled() else ""
+    key = make_key("document_text", digest or document_digest(file_bytes), file_type, EXTRACTOR_VERSION, str(max_chars), ocr)
+    hit = document_text_cache.get(key)
+    if hit is not None and isinstance(hit.get("text"), str):
+        return hit["text"], True
+    if file_type == "pdf":
+        text, complete = _extract_pdf(file_bytes, max_chars)
+    else:
+        text, complete = extract_text(file_bytes, file_type, max_chars), True
+    if text and complete:
+        document_text_cache.set(key, {"text": text})
+    return text, complete
 
 
-def generate_marketing_from_document(product_name: str, file_bytes: bytes, file_type: str) -> Optional[GeneratedContentResponse]:
+def generate_marketing_from_document(product_name: str, file_bytes: DocumentSource, file_type: str) -> Optional[GeneratedContentResponse]:
     """
     Extract text from a PDF/DOCX and use Gemini to generate marketing content (title + content).
     Returns a GeneratedContentResponse on success, otherwise None.
+
+    Documents longer than MAX_TEXT_LENGTH (chunked mode) add the merged USPs/specs
+    of the later sections to the prompt, so they are not lost to the truncation.
     """
     # Reuse extraction logic
-    if file_type == 'pdf':
-        full_document_text = extract_text_from_pdf(file_bytes)
-    elif file_type == 'docx':
-        full_document_text = extract_text_from_docx(file_bytes)
-    elif file_type == 'txt':
-        full_document_text = extract_text_from_txt(file_bytes)
-    else:
+    full_document_text = extract_text_cached(file_bytes, file_type, _extract_budget())
+    if full_document_text is None:
         logger.error("Unsupported file type for marketing generation: %s", file_type)
         return None
 
@@ -168,8 +281,16 @@ def generate_marketing_from_document(product_name: str, file_bytes: bytes, file_
         logger.error("No text extracted from document for marketing generation.")
         return None
 
-    MAX_TEXT_LENGTH = 15000
     truncated_text = full_document_text[:MAX_TEXT_LENGTH]
+    later_facts = ""
+    if DOCUMENT_CHUNKED and len(full_document_text) > MAX_TEXT_LENGTH and gateway.is_available():
+        data, _, _, _ = _analyze_chunked(product_name, full_document_text[MAX_TEXT_LENGTH:])
+        if data is not None:
+            later_facts = (
+                "\nKey facts from later sections of the document:\n"
+                + "".join(f"- {u}\n" for u in data["usps"])
+                + (f"- Specs: {data['infor']}\n" if data.get("infor") else "")
+            )
 
     prompt = f"""
 You are a professional marketing copywriter. Based ONLY on the provided document content, produce a concise marketing package for the product '{product_name}'.
@@ -182,59 +303,28 @@ Document Content:
 ---
 {truncated_text}
 ---
-
+{later_facts}
 Produce high-quality, persuasive ad copy suitable for use as an ad creative or short landing paragraph. Do not include analysis or metadata — only return the JSON object.
 """
 
     logger.info("Sending document to Gemini to generate marketing content (len=%d)...", len(truncated_text))
 
     try:
-        client = get_gemini_client()
-        if not client:
+        if not gateway.is_available():
             logger.error("Gemini client not initialized; cannot generate marketing content.")
             return None
-        resp = None
-        cfg = types.GenerateContentConfig(response_mime_type="application/json") if hasattr(types, "GenerateContentConfig") else None
-        if hasattr(client, "models") and hasattr(client.models, "generate_content"):
-            resp = client.models.generate_content(
-                model='gemini-2.5-flash',
-                contents=prompt,
-                config=cfg
-            )
-        elif hasattr(client, "generate_content"):
-            resp = client.generate_content(prompt)
-        else:
-            logger.error("Gemini client lacks a known generate_content entrypoint.")
-            return None
-
-        text_out = getattr(resp, "text", None)
-        if not text_out:
-            logger.warning("Gemini returned empty text for marketing generation.")
-            return None
-
-        # Try to parse JSON first
-        parsed = None
-        try:
-            parsed = json.loads(text_out.strip())
-        except Exception:
-            # try to clean fences if present
-            cleaned = text_out.strip().replace('```json', '').replace('```', '').strip()
-            try:
-                parsed = json.loads(cleaned)
-            except Exception:
-                parsed = None
-
-        if parsed and isinstance(parsed, dict):
-            title = parsed.get('title') or parsed.get('headline') or f"{product_name}"
-            content = parsed.get('content') or parsed.get('body') or json.dumps(parsed)
-            return GeneratedContentResponse(title=title, content=content, prompt_used=prompt)
-
-        # If parsing failed, fall back to using the full text as content
-        # and derive a short title from the first sentence.
-        fallback_content = text_out.strip()
-        first_line = fallback_content.split('\n')[0][:120]
-        title_guess = first_line if first_line else product_name
-        return GeneratedContentResponse(title=title_guess, content=fallback_content, prompt_used=prompt)
+        cfg = json_config(GeneratedContentResponse, exclude=("prompt_used",))
+        resp = gateway.generate_content(
+            [ModelCandidate('gemini-2.5-flash', cfg)], prompt, operation="document_marketing"
+        )
+
+        result = decode_structured(
+            resp, GeneratedContentResponse, "document_marketing",
+            exclude=("prompt_used",), overrides={"prompt_used": prompt},
+        )
+        if result is None:
+            logger.warning("Gemini returned no usable marketing content for %s.", product_name)
+        return result
 
     except Exception as e:
         logger.error("Error generating marketing content from document: %s", e)
@@ -262,222 +352,255 @@ Sử dụng tiếng Việt cho tất cả các mô tả.
     logger.info("Running competitive analysis for product '%s' (keywords: %s)", product_name, competitor_keywords)
 
     try:
-        client = get_gemini_client()
-        if not client or not GEMINI_API_KEY:
+        if not gateway.is_available():
             logger.error("Gemini client or API key missing for competitive analysis.")
             return None
 
         cfg = types.GenerateContentConfig(tools=[{"google_search": {}}]) if hasattr(types, "GenerateContentConfig") else None
 
-        response = None
-        if hasattr(client, "models") and hasattr(client.models, "generate_content"):
-            response = client.models.generate_content(
-                model='gemini-2.5-flash',
-                contents=prompt,
-                config=cfg
-            )
-        elif hasattr(client, "generate_content"):
-            response = client.generate_content(prompt)
-        else:
-            logger.error("Gemini client missing generate_content for competitive analysis.")
-            return None
+        response = gateway.generate_content(
+            [ModelCandidate('gemini-2.5-flash', cfg)], prompt, operation="competitive_analysis"
+        )
 
-        if not response or not getattr(response, "text", None):
-            logger.warning("Gemini returned no text for competitive analysis of %s", product_name)
-            return None
-
-        # Parse JSON, allowing for code fences
-        try:
-            json_text = response.text.strip().replace('```json', '').replace('```', '').strip()
-            data = json.loads(json_text)
-        except Exception as e:
-            logger.warning("Failed to parse JSON from Gemini competitive analysis: %s", e)
-            logger.debug("Raw response: %s", getattr(response, "text", "")[:2000])
-            return None
-
-        # Normalization helpers
-        def ensure_list_of_str(v):
-            if v is None:
-                return []
-            if isinstance(v, list):
-                return [str(x) for x in v]
-            if isinstance(v, str):
-                if "\n" in v:
-                    return [s.strip() for s in v.splitlines() if s.strip()]
-                if "," in v:
-                    return [s.strip() for s in v.split(",") if s.strip()]
-                return [v]
-            return [str(v)]
-
-        def ensure_str(v):
-            if v is None:
-                return "Chưa xác định"
-            if isinstance(v, str):
-                return v
-            if isinstance(v, list):
-                return ", ".join(str(x) for x in v)
-            if isinstance(v, dict):
-                try:
-                    return json.dumps(v, ensure_ascii=False)
-                except Exception:
-                    return str(v)
-            return str(v)
-
-        usps = ensure_list_of_str(data.get('usps'))
-        pain_points = ensure_list_of_str(data.get('pain_points'))
-        target_persona = ensure_str(data.get('target_persona'))
-        infor_field = ensure_str(data.get('infor'))
-
-        try:
-            return ProductAnalysisResult(
-                product_name=product_name,
-                usps=usps,
-                pain_points=pain_points,
-                target_persona=target_persona,
-                infor=infor_field,
-            )
-        except Exception as e:
-            logger.error("Error constructing ProductAnalysisResult: %s", e)
-            return None
+        # Grounded call (google_search) can't carry response_schema: validate locally, one repair call if needed
+        result = decode_structured(
+            response, ProductAnalysisResult, "competitive_analysis",
+            exclude=("product_name",), overrides={"product_name": product_name},
+        )
+        if result is None:
+            logger.warning("No valid competitive analysis for %s", product_name)
+        return result
 
     except Exception as e:
         logger.error("Error running competitive analysis: %s", e)
         return None
 
 
-def generate_product_analysis_from_document(product_name: str, file_bytes: bytes, file_type: str) -> ProductAnalysisResult | None:
-    """
-    Extract text from an uploaded document (PDF/DOCX) and analyze it to produce
-    a ProductAnalysisResult (usps, pain_points, target_persona, infor).
-
-    This function mirrors the output shape of `data_analysis.analyze_product_data` so
-    downstream marketing generation can re-use the same schema.
-    """
-    # If product_name is missing/empty, use Gemini to detect it directly from the original file
-    effective_product_name = product_name.strip() if product_name else ""
-    detection_reason = None
-    detection_conf = 0.0
-    if not effective_product_name:
-        detected_name, detection_conf, detection_reason = detect_product_name_with_gemini(file_bytes, file_type)
-        if detected_name:
-            effective_product_name = detected_name
-            logger.info("Detected product name from document via Gemini: '%s' (confidence=%.2f)", detected_name, detection_conf)
-        else:
-            logger.warning("Gemini could not confidently detect product name; falling back to generic label.")
-            effective_product_name = "Sản phẩm"
-
-    # Extract text for detailed analysis (Gemini ở trên đọc file gốc để lấy tên;
-    # phần còn lại vẫn dùng text trích xuất để giữ nguyên prompt hiện tại.)
-    if file_type == 'pdf':
-        full_document_text = extract_text_from_pdf(file_bytes)
-    elif file_type == 'docx':
-        full_document_text = extract_text_from_docx(file_bytes)
-    elif file_type == 'txt':
-        full_document_text = extract_text_from_txt(file_bytes)
+def _document_analysis_prompt(product_name: str, document_text: Optional[str]) -> str:
+    """Analysis prompt; with no product_name the model also names the main product (same answer)."""
+    if product_name:
+        name_input = f'- product_name: "{product_name}"'
+        name_key = ""
+        name_rule = ""
     else:
-        logger.error("Unsupported file type for product analysis: %s", file_type)
-        return None
-
-    if not full_document_text:
-        logger.error("No text extracted from document for product analysis.")
-        return None
-
-    MAX_TEXT_LENGTH = 15000
-    truncated_text = full_document_text[:MAX_TEXT_LENGTH]
+        name_input = "- product_name: (chưa biết — xác định từ tài liệu)"
+        name_key = '"product_name" (chuỗi), '
+        name_rule = (
+            '0) "product_name": tên sản phẩm/chương trình/dịch vụ CHÍNH được quảng bá trong tài liệu '
+            "(được nhắc đến nhiều nhất hoặc rõ nhất). Không bịa tên nếu tài liệu không đề cập — khi đó trả về chuỗi rỗng.\n"
+        )
+    if document_text is not None:
+        doc_input = f"- document_text:\n---\n{document_text}\n---"
+        source = '"document_text"'
+    else:
+        doc_input = "- document: tệp tài liệu được gửi kèm"
+        source = "tài liệu được gửi kèm"
 
-    prompt = f"""
+    return f"""
 Bạn là một chuyên gia phân tích sản phẩm dành cho mục đích marketing. Dựa CHỈ trên nội dung tài liệu được cung cấp dưới đây và tên sản phẩm, hãy trích xuất các thông tin cấu trúc phù hợp để phục vụ việc tạo nội dung quảng cáo và định vị sản phẩm.
 
 Input:
-- product_name: "{effective_product_name}"
-- document_text:
----
-{truncated_text}
----
+{name_input}
+{doc_input}
 
 Yêu cầu đầu ra (bắt buộc):
-Trả về DUY NHẤT một OBJECT JSON hợp lệ có các khóa: "usps" (mảng các chuỗi), "pain_points" (mảng các chuỗi), "target_persona" (chuỗi), và "infor" (chuỗi gồm tối đa 5 từ khóa/cụm, cách nhau bằng dấu phẩy).
+Trả về DUY NHẤT một OBJECT JSON hợp lệ có các khóa: {name_key}"usps" (mảng các chuỗi), "pain_points" (mảng các chuỗi), "target_persona" (chuỗi), và "infor" (chuỗi gồm tối đa 5 từ khóa/cụm, cách nhau bằng dấu phẩy).
 
 Quy tắc:
-1) "usps": trả về 3–6 điểm bán hàng nổi bật (mỗi mục ngắn 3–20 từ). Nếu không đủ thông tin, trả về những gì suy luận được.
+{name_rule}1) "usps": trả về 3–6 điểm bán hàng nổi bật (mỗi mục ngắn 3–20 từ). Nếu không đủ thông tin, trả về những gì suy luận được.
 2) "pain_points": trả về 3–6 điểm đau khách hàng (mỗi mục 3–20 từ). Nếu không có, trả về mảng rỗng.
 3) "target_persona": một đoạn 1–3 câu (20–60 từ) mô tả khách hàng mục tiêu.
 4) "infor": tối đa 5 từ khoá/ngắn cụm, là các thông số kỹ thuật hoặc tính năng nổi bật.
-5) Chỉ dựa trên "document_text" và "product_name" — KHÔNG thêm thông tin từ Internet.
+5) Chỉ dựa trên {source} và "product_name" — KHÔNG thêm thông tin từ Internet.
 6) Trả về duy nhất JSON, không có chú thích, không có markdown hoặc code fences.
 """
 
-    logger.info("Generating product analysis from document for '%s' (len=%d)...", effective_product_name, len(truncated_text))
 
+# Bump automatically whenever either prompt variant or the model changes
+ANALYSIS_PROMPT_VERSION = hashlib.sha256(
+    (
+        _document_analysis_prompt("{product_name}", "{document_text}")
+        + _document_analysis_prompt("", "{document_text}")
+        + _document_analysis_prompt("", None)
+        + "gemini-2.5-flash"
+    ).encode("utf-8")
+).hexdigest()[:12]
+
+inflight = get_group("analyze_document")
+
+
+def _analysis_key(digest: str, file_type: str, product_name: str) -> str:
+    # Shared by the result cache and single-flight
+    chunking = f"{DOCUMENT_CHUNKED}:{DOCUMENT_CHUNK_CHARS}:{DOCUMENT_MAX_CHUNKS}:{DOCUMENT_MERGED_MAX_ITEMS}"
+    return make_key("document_analysis", digest, file_type, normalize_text_key(product_name), EXTRACTOR_VERSION, ANALYSIS_PROMPT_VERSION, chunking)
+
+
+def generate_product_analysis_from_document(product_name: str, file_bytes: DocumentSource, file_type: str, force_refresh: bool = False, digest: Optional[str] = None) -> ProductAnalysisResult | None:
+    """
+    Extract text from an uploaded document (PDF/DOCX) and analyze it to produce
+    a ProductAnalysisResult (usps, pain_points, target_persona, infor).
+
+    This function mirrors the output shape of `data_analysis.analyze_product_data` so
+    downstream marketing generation can re-use the same schema.
+
+    Single model call: when product_name is empty the main product name is part
+    of the same structured answer (no separate detection call on the raw file).
+    Scanned pages are transcribed on their own by the OCR backend (core.ocr); the
+    raw file is only sent when no text comes out at all.
+
+    Results are cached by the SHA-256 of the file bytes (+ product_name and
+    prompt version), so re-uploading the same brochure skips parsing and the
+    model call; `force_refresh=True` bypasses the cache. Identical uploads
+    running concurrently share one analysis.
+
+    `file_bytes` may be the upload's file handle (parsed in place, never copied
+    into memory); pass `digest` when the caller already hashed it.
+    """
+    digest = digest or document_digest(file_bytes)
+    key = _analysis_key(digest, file_type, product_name or "")
+    if not force_refresh:
+        cached = document_analysis_cache.get(key)
+        if cached:
+            try:
+                result = ProductAnalysisResult(**cached)
+                logger.info("Document analysis cache hit for %s (%s)", digest[:12], result.product_name)
+                return result
+            except Exception as e:
+                logger.warning("Ignoring invalid cached document analysis: %s", e)
+    return inflight.do(key, _run_document_analysis, product_name, file_bytes, file_type, digest, key)
+
+
+def _call_analysis(product_name: str, contents, operation: str) -> Optional[dict]:
+    exclude = ("product_name",) if product_name else ()
+    cfg = json_config(ProductAnalysisResult, exclude=exclude)
+    response = gateway.generate_content([ModelCandidate('gemini-2.5-flash', cfg)], contents, operation=operation)
+    result = decode_structured(
+        response, ProductAnalysisResult, operation,
+        exclude=exclude, overrides={"product_name": product_name} if product_name else None,
+    )
+    if result is None:
+        logger.warning("No valid %s answer for %s", operation, product_name or "<auto>")
+        return None
+    return result.model_dump()
+
+
+def _analyze_single(product_name: str, document_text: str, file_bytes: DocumentSource) -> tuple[Optional[dict], int]:
+    """One call on the first MAX_TEXT_LENGTH characters (or on the raw PDF when there is no text)."""
+    if document_text:
+        truncated_text = document_text[:MAX_TEXT_LENGTH]
+        logger.info("Generating product analysis from document for '%s' (len=%d)...", product_name or "<auto>", len(truncated_text))
+        return _call_analysis(product_name, _document_analysis_prompt(product_name, truncated_text), "document_analysis"), len(truncated_text)
+    # Nothing extractable (OCR disabled or failed): Gemini reads the PDF itself, still in the same call
+    logger.info("No text layer in PDF; sending the raw file for analysis.")
+    contents = [
+        types.Part.from_bytes(data=_read_bytes(file_bytes), mime_type="application/pdf"),
+        _document_analysis_prompt(product_name, None),
+    ]
+    return _call_analysis(product_name, contents, "document_analysis"), 0
+
+
+def _analyze_chunk(product_name: str, chunk: str, index: int, total: int) -> Optional[dict]:
+    prompt = _document_analysis_prompt(product_name, chunk) + (
+        f"\nLưu ý: đây là phần {index}/{total} của một tài liệu dài. Chỉ trích xuất những gì có trong phần này; "
+        "các phần khác được phân tích riêng và gộp lại sau.\n"
+    )
     try:
-        client = get_gemini_client()
-        if not client:
-            logger.error("Gemini client not initialized; cannot generate product analysis from document.")
-            return None
+        data = _call_analysis(product_name, prompt, "document_analysis_chunk")
+    except LLMUnavailableError:
+        # Circuit open / queue deadline: the whole request should get 503, not a partial merge
+        raise
+    except Exception as e:
+        logger.warning("Chunk %d/%d of document analysis failed: %s", index, total, e)
+        return None
+    return data
 
-        cfg = types.GenerateContentConfig(response_mime_type="application/json") if hasattr(types, "GenerateContentConfig") else None
 
-        response = None
-        if hasattr(client, "models") and hasattr(client.models, "generate_content"):
-            response = client.models.generate_content(
-                model='gemini-2.5-flash',
-                contents=prompt,
-                config=cfg
-            )
-        elif hasattr(client, "generate_content"):
-            response = client.generate_content(prompt)
-        else:
-            logger.error("Gemini client missing generate_content for document product analysis.")
-            return None
+def _analyze_chunked(product_name: str, document_text: str) -> tuple[Optional[dict], int, int, int]:
+    """Map: one extraction call per chunk (concurrent, under the gateway limiter). Reduce: merge locally.
+
+    Returns (merged data or None, analyzed chars, chunk count, failed chunks).
+    """
+    chunks = split_text(document_text, DOCUMENT_CHUNK_CHARS)
+    if len(chunks) > DOCUMENT_MAX_CHUNKS:
+        logger.info("Document has %d chunks; analyzing the first %d (DOCUMENT_MAX_CHUNKS)", len(chunks), DOCUMENT_MAX_CHUNKS)
+        chunks = chunks[:DOCUMENT_MAX_CHUNKS]
+    total = len(chunks)
+    logger.info("Generating chunked product analysis for '%s' (%d chunks, %d chars)...", product_name or "<auto>", total, len(document_text))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(DOCUMENT_CHUNK_CONCURRENCY, total))) as pool:
+        # Each task gets its own copy of the request context (request id for the cost log)
+        futures = [
+            pool.submit(contextvars.copy_context().run, _analyze_chunk, product_name, chunk, i + 1, total)
+            for i, chunk in enumerate(chunks)
+        ]
+        parts = [f.result() for f in futures]
+
+    ok = [p for p in parts if p is not None]
+    analyzed = sum(len(c) for c, p in zip(chunks, parts) if p is not None)
+    failed = total - len(ok)
+    if not ok:
+        return None, 0, total, failed
+
+    personas = [p.get("target_persona") for p in ok if p.get("target_persona") not in (None, "", "Chưa xác định")]
+    merged = {
+        "product_name": pick_name(p.get("product_name") for p in ok),
+        "usps": merge_items((p.get("usps") or [] for p in ok), DOCUMENT_MERGED_MAX_ITEMS),
+        "pain_points": merge_items((p.get("pain_points") or [] for p in ok), DOCUMENT_MERGED_MAX_ITEMS),
+        # The opening sections usually describe the audience; later ones are specs
+        "target_persona": personas[0] if personas else "Chưa xác định",
+        "infor": merge_keywords(p.get("infor") or "" for p in ok),
+    }
+    return merged, analyzed, total, failed
+
+
+def _run_document_analysis(product_name: str, file_bytes: DocumentSource, file_type: str, digest: str, key: str) -> ProductAnalysisResult | None:
+    started = time.monotonic()
+    effective_product_name = product_name.strip() if product_name else ""
 
-        if not response or not getattr(response, "text", None):
-            logger.warning("Gemini returned no text for document product analysis of %s", product_name)
+    full_document_text, complete = _extract_text_cached(file_bytes, file_type, _extract_budget(), digest)
+    if full_document_text is None:
+        logger.error("Unsupported file type for product analysis: %s", file_type)
+        return None
+    if not complete:
+        key = None  # pages lost to a failed OCR batch: answer this request, cache nothing
+    if not full_document_text and file_type != 'pdf':
+        logger.error("No text extracted from document for product analysis.")
+        return None
+
+    try:
+        if not gateway.is_available():
+            logger.error("Gemini client not initialized; cannot generate product analysis from document.")
             return None
 
-        # Parse and normalize
-        try:
-            json_text = response.text.strip().replace('```json', '').replace('```', '').strip()
-            data = json.loads(json_text)
-        except Exception as e:
-            logger.warning("Failed to parse JSON from Gemini document analysis: %s", e)
-            logger.debug("Raw response: %s", getattr(response, "text", "")[:2000])
+        if DOCUMENT_CHUNKED and len(full_document_text) > MAX_TEXT_LENGTH:
+            data, analyzed, n_chunks, failed = _analyze_chunked(effective_product_name, full_document_text)
+        else:
+            data, analyzed = _analyze_single(effective_product_name, full_document_text, file_bytes)
+            n_chunks, failed = 1, int(data is None)
+        seconds = time.monotonic() - started
+        document_stats.observe(len(full_document_text), analyzed, n_chunks, failed, seconds)
+        if data is None:
             return None
 
-        # Reuse normalization helpers (same behavior as data_analysis.analyze_product_data)
-        def ensure_list_of_str(v):
-            if v is None:
-                return []
-            if isinstance(v, list):
-                return [str(x) for x in v]
-            if isinstance(v, str):
-                if "\n" in v:
-                    return [s.strip() for s in v.splitlines() if s.strip()]
-                if "," in v:
-                    return [s.strip() for s in v.split(",") if s.strip()]
-                return [v]
-            return [str(v)]
-
-        def ensure_str(v):
-            if v is None:
-                return "Chưa xác định"
-            if isinstance(v, str):
-                return v
-            if isinstance(v, list):
-                return ", ".join(str(x) for x in v)
-            if isinstance(v, dict):
-                try:
-                    return json.dumps(v, ensure_ascii=False)
-                except Exception:
-                    return str(v)
-            return str(v)
-
-        usps = ensure_list_of_str(data.get('usps'))
-        pain_points = ensure_list_of_str(data.get('pain_points'))
-        target_persona = ensure_str(data.get('target_persona'))
-        infor_field = ensure_str(data.get('infor'))
+        if not effective_product_name:
+            detected = data.get("product_name")
+            detected = detected.strip() if isinstance(detected, str) else ""
+            if detected and detected.lower() not in ("null", "none"):
+                effective_product_name = detected
+                logger.info("Detected product name from document: '%s'", detected)
+            else:
+                logger.warning("Could not detect product name from document; falling back to generic label.")
+                effective_product_name = "Sản phẩm"
+                key = None  # don't pin a generic label; the next upload may detect the name
+
+        data = coerce_to_model(ProductAnalysisResult, data, fill_missing=True)
+        usps = data['usps']
+        pain_points = data['pain_points']
+        target_persona = data['target_persona']
+        infor_field = data['infor']
 
         try:
-            return ProductAnalysisResult(
+            result = ProductAnalysisResult(
                 product_name=effective_product_name,
                 usps=usps,
                 pain_points=pain_points,
@@ -487,7 +610,17 @@ Quy tắc:
         except Exception as e:
             logger.error("Error constructing ProductAnalysisResult from document: %s", e)
             return None
-
+        if key is not None:
+            document_analysis_cache.set(key, result.model_dump())
+        logger.info(
+            "Document analysis for '%s' done in %.2fs (%d chunk(s), coverage %.0f%% of %d chars)",
+            effective_product_name, seconds, n_chunks,
+            100.0 * analyzed / len(full_document_text) if full_document_text else 100.0, len(full_document_text),
+        )
+        return result
+
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         logger.error("Error generating product analysis from document: %s", e)
         return None
@@ -0,0 +1,100 @@
+"""Split long documents into chunks and merge per-chunk analyses.
+
+Used by the map-reduce mode of core.document_analysis. The split prefers page
+breaks (`\\f`, emitted by the PDF extractor), then blank lines, then line
+breaks, so a chunk rarely cuts a spec table or heading in half. The merge
+keeps the USPs and pain points mentioned by the most chunks. Near-duplicates
+(same item worded slightly differently in two sections) count once.
+"""
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Iterable, Optional
+
+_BOUNDARIES = ("\f", "\n\n", "\n", ". ")
+_NON_WORD_RE = re.compile(r"[^\w\s]", re.UNICODE)
+# Two items at or above this similarity (after normalization) are the same point
+NEAR_DUPLICATE_RATIO = 0.82
+
+
+def split_text(text: str, chunk_chars: int) -> list[str]:
+    """Greedy chunks of at most `chunk_chars`, cut at the strongest boundary available."""
+    chunks: list[str] = []
+    rest = text.strip()
+    while len(rest) > chunk_chars:
+        window = rest[:chunk_chars]
+        cut = -1
+        for sep in _BOUNDARIES:
+            pos = window.rfind(sep)
+            # Don't accept a boundary that leaves a tiny chunk
+            if pos >= chunk_chars // 2:
+                cut = pos + len(sep)
+                break
+        if cut <= 0:
+            cut = chunk_chars
+        chunks.append(rest[:cut].strip())
+        rest = rest[cut:].strip()
+    if rest:
+        chunks.append(rest)
+    return [c for c in chunks if c]
+
+
+def _norm(item: str) -> str:
+    item = unicodedata.normalize("NFC", item).lower()
+    return " ".join(_NON_WORD_RE.sub(" ", item).split())
+
+
+def _same(a: str, b: str) -> bool:
+    if not a or not b:
+        return a == b
+    if a in b or b in a:
+        return True
+    return SequenceMatcher(None, a, b).ratio() >= NEAR_DUPLICATE_RATIO
+
+
+def merge_items(lists: Iterable[list[str]], limit: int) -> list[str]:
+    """Union of the lists without near-duplicates, most-mentioned first (ties keep document order)."""
+    groups: list[tuple[str, str]] = []   # (representative, normalized)
+    votes: Counter = Counter()
+    for items in lists:
+        seen_here: set[int] = set()
+        for raw in items:
+            text = str(raw).strip()
+            if not text:
+                continue
+            norm = _norm(text)
+            for gi, (_, gnorm) in enumerate(groups):
+                if _same(norm, gnorm):
+                    break
+            else:
+                groups.append((text, norm))
+                gi = len(groups) - 1
+            if gi not in seen_here:
+                votes[gi] += 1
+                seen_here.add(gi)
+    order = sorted(range(len(groups)), key=lambda gi: (-votes[gi], gi))
+    return [groups[gi][0] for gi in order[:limit]]
+
+
+def merge_keywords(values: Iterable[str], limit: int = 5) -> str:
+    """`infor` fields are comma-separated keyword lists; merge them the same way."""
+    return ", ".join(merge_items(([k for k in v.split(",")] for v in values if v), limit))
+
+
+def pick_name(names: Iterable[Optional[str]]) -> Optional[str]:
+    """Most frequent product name across chunks (first seen wins ties)."""
+    counts: Counter = Counter()
+    first: dict[str, str] = {}
+    for name in names:
+        if isinstance(name, str) and name.strip() and name.strip().lower() not in ("null", "none"):
+            key = _norm(name)
+            first.setdefault(key, name.strip())
+            counts[key] += 1
+    if not counts:
+        return None
+    best = max(counts, key=lambda k: (counts[k], -list(first).index(k)))
+    return first[best]
+
+
+__all__ = ["split_text", "merge_items", "merge_keywords", "pick_name", "NEAR_DUPLICATE_RATIO"]
@@ -0,0 +1,513 @@
+"""Per-user vector index over uploaded documents, for follow-up questions.
+
+After /api/analyze_document the extracted text is split into chunks
+(core.document_chunking), embedded and stored under the file's SHA-256. A
+follow-up ("now pull out battery specs") embeds the question, takes the top-k
+chunks by cosine similarity and sends only those to the model, instead of
+re-uploading the file and sending 15,000 characters again.
+
+Embedders (DOCUMENT_INDEX_EMBEDDER):
+    hashing  local: word and character 3-gram features hashed into a fixed
+             number of dimensions, weighted by the document's own IDF (default;
+             no model call, works offline and with Vietnamese diacritics)
+    gemini   Gemini text embeddings; falls back to hashing when the client is
+             not configured
+Other embedders register with `register_embedder`. Each index records the
+embedder that built it, and questions are embedded with the same one.
+
+Storage: one `.npz` per (user, document) under DOCUMENT_INDEX_DIR (vectors plus
+a JSON blob with the chunks), so every worker on the host sees the same index.
+The oldest documents beyond DOCUMENT_INDEX_MAX_DOCUMENTS per user are dropped.
+Recently used indexes stay in an in-process LRU.
+"""
+import os
+import json
+import math
+import re
+import time
+import zlib
+import hashlib
+import logging
+import tempfile
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from core.ai_clients import get_gemini_client, llm_slot
+from core.llm_gateway import gateway, ModelCandidate
+from core.document_chunking import split_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = Path(__file__).resolve().parents[1] / ".cache" / "document_index"
+DOCUMENT_INDEX = os.getenv("DOCUMENT_INDEX", "true").lower() in ("1", "true", "yes")
+DOCUMENT_INDEX_DIR = os.getenv("DOCUMENT_INDEX_DIR", str(DEFAULT_INDEX_DIR))
+DOCUMENT_INDEX_EMBEDDER = os.getenv("DOCUMENT_INDEX_EMBEDDER", "hashing").strip().lower()
+DOCUMENT_INDEX_EMBED_MODEL = os.getenv("DOCUMENT_INDEX_EMBED_MODEL", "text-embedding-004")
+DOCUMENT_INDEX_HASH_DIM = int(os.getenv("DOCUMENT_INDEX_HASH_DIM", 4096))
+DOCUMENT_INDEX_CHUNK_CHARS = int(os.getenv("DOCUMENT_INDEX_CHUNK_CHARS", 1200))
+DOCUMENT_INDEX_TOP_K = int(os.getenv("DOCUMENT_INDEX_TOP_K", 4))
+DOCUMENT_INDEX_MAX_TOP_K = 12
+DOCUMENT_INDEX_MAX_DOCUMENTS = int(os.getenv("DOCUMENT_INDEX_MAX_DOCUMENTS", 20))
+DOCUMENT_INDEX_MEMORY_DOCUMENTS = int(os.getenv("DOCUMENT_INDEX_MEMORY_DOCUMENTS", 64))
+
+# Bump when chunking or the hashing features change (old indexes are rebuilt on the next upload)
+INDEX_VERSION = "1"
+# What a follow-up used to cost: the file re-read up to the single-call window
+REUPLOAD_CONTEXT_CHARS = 15000
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Documents are keyed by the upload's SHA-256; the id becomes a file name
+_DOCUMENT_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class EmbedderUnavailableError(RuntimeError):
+    """The index was built with an embedder this process cannot load; the document must be re-uploaded."""
+
+
+def is_document_id(document_id: str) -> bool:
+    return bool(_DOCUMENT_ID_RE.match(document_id or ""))
+
+
+# ---------- embedders ----------
+class Embedder(ABC):
+    """Texts -> L2-normalised float32 rows. `lexical` embedders get IDF weighting from the index."""
+
+    name = "base"
+    lexical = False
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+def _fold(text: str) -> str:
+    """Lowercase without diacritics ("Pin sạc" -> "pin sac"); đ has no decomposition."""
+    text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def _normalize_rows(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.where(norms == 0, 1.0, norms)
+
+
+class HashingEmbedder(Embedder):
+    """Signed feature hashing of words, word pairs and character 3-grams (crc32: stable across processes)."""
+
+    name = "hashing"
+    lexical = True
+
+    def __init__(self, dim: int = DOCUMENT_INDEX_HASH_DIM):
+        self.dim = dim
+
+    def _features(self, text: str) -> list[str]:
+        words = _WORD_RE.findall(_fold(text))
+        feats = list(words)
+        feats += [a + " " + b for a, b in zip(words, words[1:])]
+        for w in words:
+            if len(w) > 3:
+                padded = f"<{w}>"
+                feats += ["#" + padded[i:i + 3] for i in range(len(padded) - 2)]
+        return feats
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: dict[int, float] = {}
+            for feat in self._features(text):
+                h = zlib.crc32(feat.encode("utf-8"))
+                idx = h % self.dim
+                counts[idx] = counts.get(idx, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+            for idx, c in counts.items():
+                # Sublinear tf: a term repeated in a spec table shouldn't drown the rest
+                out[row, idx] = math.copysign(1.0 + math.log(abs(c)), c) if c else 0.0
+        return _normalize_rows(out)
+
+
+class GeminiEmbedder(Embedder):
+    name = "gemini"
+    batch_size = 100
+
+    def __init__(self, model: str = DOCUMENT_INDEX_EMBED_MODEL):
+        self.model = model
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        client = get_gemini_client()
+        if client is None:
+            raise RuntimeError("Gemini client not configured")
+        rows: list[list[float]] = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            with llm_slot("gemini", self.model, operation="embed_document"):
+                result = client.models.embed_content(model=self.model, contents=batch)
+            rows += [list(e.values) for e in result.embeddings]
+        return _normalize_rows(np.asarray(rows, dtype=np.float32))
+
+
+_EMBEDDERS: dict[str, Callable[[], Embedder]] = {
+    "hashing": HashingEmbedder,
+    "gemini": GeminiEmbedder,
+}
+_embedder_lock = threading.Lock()
+_embedder_instances: dict[str, Embedder] = {}
+
+
+def register_embedder(name: str, factory: Callable[[], Embedder]) -> None:
+    _EMBEDDERS[name.lower()] = factory
+
+
+def get_embedder(name: Optional[str] = None) -> Embedder:
+    name = (name or DOCUMENT_INDEX_EMBEDDER).lower()
+    if name == "gemini" and name not in _embedder_instances and get_gemini_client() is None:
+        logger.info("DOCUMENT_INDEX_EMBEDDER=gemini but no Gemini client; using the hashing embedder")
+        name = "hashing"
+    with _embedder_lock:
+        embedder = _embedder_instances.get(name)
+        if embedder is None:
+            factory = _EMBEDDERS.get(name)
+            if factory is None:
+                raise ValueError(f"Unknown embedder '{name}' (available: {', '.join(sorted(_EMBEDDERS))})")
+            embedder = _embedder_instances[name] = factory()
+        return embedder
+
+
+# ---------- index ----------
+@dataclass
+class DocumentIndex:
+    document_id: str
+    embedder: str
+    chunks: list[str]
+    vectors: np.ndarray                       # (n_chunks, dim), L2-normalised
+    idf: Optional[np.ndarray] = None          # lexical embedders only
+    filename: str = ""
+    product_name: str = ""
+    chars: int = 0
+    indexed_at: float = field(default_factory=time.time)
+
+    def summary(self) -> dict:
+        return {
+            "document_id": self.document_id,
+            "filename": self.filename,
+            "product_name": self.product_name,
+            "chunks": len(self.chunks),
+            "chars": self.chars,
+            "embedder": self.embedder,
+            "indexed_at": self.indexed_at,
+        }
+
+
+@dataclass
+class ChunkHit:
+    index: int
+    score: float
+    text: str
+
+
+def _idf(vectors: np.ndarray) -> np.ndarray:
+    df = np.count_nonzero(vectors, axis=0).astype(np.float32)
+    n = vectors.shape[0]
+    return (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+
+
+def build_index(document_id: str, text: str, filename: str = "", product_name: str = "",
+                embedder: Optional[Embedder] = None) -> DocumentIndex:
+    embedder = embedder or get_embedder()
+    chunks = split_text(text, DOCUMENT_INDEX_CHUNK_CHARS)
+    vectors = embedder.embed(chunks) if chunks else np.zeros((0, 1), dtype=np.float32)
+    idf = None
+    if embedder.lexical and len(chunks):
+        # Terms in every chunk (brand name, boilerplate) say little about where an answer is
+        idf = _idf(vectors)
+        vectors = _normalize_rows(vectors * idf)
+    return DocumentIndex(document_id, embedder.name, chunks, vectors.astype(np.float32), idf,
+                         filename, product_name, len(text))
+
+
+def search_index(index: DocumentIndex, query: str, top_k: int = DOCUMENT_INDEX_TOP_K) -> list[ChunkHit]:
+    """Top-k chunks by cosine similarity, best first."""
+    if not index.chunks or not query.strip():
+        return []
+    try:
+        embedder = get_embedder(index.embedder)
+    except ValueError as e:
+        raise EmbedderUnavailableError(str(e)) from e
+    if embedder.name != index.embedder:
+        raise EmbedderUnavailableError(f"Index was built with the '{index.embedder}' embedder, which is not available")
+    q = embedder.embed([query])
+    if index.idf is not None:
+        q = _normalize_rows(q * index.idf)
+    scores = index.vectors @ q[0]
+    k = max(1, min(top_k, len(index.chunks)))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [ChunkHit(int(i), float(scores[i]), index.chunks[int(i)]) for i in top]
+
+
+# ---------- storage ----------
+class _IndexStore:
+    """`.npz` files per user, with an in-process LRU in front."""
+
+    def __init__(self, root: str, memory_documents: int):
+        self.root = Path(root)
+        self.memory_documents = memory_documents
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[tuple[str, str], DocumentIndex]" = OrderedDict()
+
+    @staticmethod
+    def _user_dir_name(user_email: str) -> str:
+        # Emails stay out of file names
+        return hashlib.sha256((user_email or "").strip().lower().encode("utf-8")).hexdigest()[:24]
+
+    def _user_dir(self, user_email: str) -> Path:
+        return self.root / self._user_dir_name(user_email)
+
+    def _path(self, user_email: str, document_id: str) -> Path:
+        if not is_document_id(document_id):
+            raise ValueError(f"Invalid document id {document_id[:16]!r}")
+        return self._user_dir(user_email) / f"{document_id}.npz"
+
+    def _remember(self, key: tuple[str, str], index: DocumentIndex) -> None:
+        with self._lock:
+            self._memory[key] = index
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_documents:
+                self._memory.popitem(last=False)
+
+    @staticmethod
+    def _meta(index: DocumentIndex) -> dict:
+        return {"version": INDEX_VERSION, "chunk_chars": DOCUMENT_INDEX_CHUNK_CHARS, **index.summary(), "chunks": index.chunks}
+
+    def save(self, user_email: str, index: DocumentIndex) -> None:
+        path = self._path(user_email, index.document_id)
+        key = (self._user_dir_name(user_email), index.document_id)
+        self._remember(key, index)
+        folder = self._user_dir(user_email)
+        try:
+            folder.mkdir(parents=True, exist_ok=True)
+            meta = np.frombuffer(json.dumps(self._meta(index), ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+            arrays = {"vectors": index.vectors, "meta": meta}
+            if index.idf is not None:
+                arrays["idf"] = index.idf
+            fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                # Hashing vectors are mostly zeros: compressed they are a fraction of the raw size
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp, path)
+            self._evict(user_email)
+        except OSError as e:
+            logger.warning("Could not persist document index %s: %s", index.document_id[:12], e)
+
+    def _evict(self, user_email: str) -> None:
+        files = sorted(self._user_dir(user_email).glob("*.npz"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in files[DOCUMENT_INDEX_MAX_DOCUMENTS:]:
+            with self._lock:
+                self._memory.pop((self._user_dir_name(user_email), old.stem), None)
+            old.unlink(missing_ok=True)
+
+    @staticmethod
+    def _read_meta(data) -> dict:
+        return json.loads(data["meta"].tobytes().decode("utf-8"))
+
+    def get(self, user_email: str, document_id: str) -> Optional[DocumentIndex]:
+        if not is_document_id(document_id):
+            return None
+        key = (self._user_dir_name(user_email), document_id)
+        with self._lock:
+            index = self._memory.get(key)
+            if index is not None:
+                self._memory.move_to_end(key)
+                return index
+        path = self._path(user_email, document_id)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = self._read_meta(data)
+                if meta.get("version") != INDEX_VERSION or meta.get("chunk_chars") != DOCUMENT_INDEX_CHUNK_CHARS:
+                    return None
+                index = DocumentIndex(
+                    document_id=document_id,
+                    embedder=meta["embedder"],
+                    chunks=meta["chunks"],
+                    vectors=data["vectors"],
+                    idf=data["idf"] if "idf" in data.files else None,
+                    filename=meta.get("filename", ""),
+                    product_name=meta.get("product_name", ""),
+                    chars=meta.get("chars", 0),
+                    indexed_at=meta.get("indexed_at", 0.0),
+                )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable document index %s: %s", path.name, e)
+            return None
+        self._remember(key, index)
+        return index
+
+    def touch(self, user_email: str, document_id: str) -> None:
+        try:
+            os.utime(self._path(user_email, document_id))
+        except (OSError, ValueError):
+            pass
+
+    def list_user(self, user_email: str) -> list[dict]:
+        out = []
+        for path in self._user_dir(user_email).glob("*.npz"):
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    meta = self._read_meta(data)
+            except (OSError, ValueError, KeyError):
+                continue
+            if meta.get("version") != INDEX_VERSION:
+                continue
+            summary = {k: meta.get(k) for k in ("document_id", "filename", "product_name", "chars", "embedder", "indexed_at")}
+            summary["chunks"] = len(meta.get("chunks") or [])
+            out.append(summary)
+        return sorted(out, key=lambda d: d.get("indexed_at") or 0, reverse=True)
+
+    def delete(self, user_email: str, document_id: str) -> bool:
+        if not is_document_id(document_id):
+            return False
+        with self._lock:
+            self._memory.pop((self._user_dir_name(user_email), document_id), None)
+        try:
+            self._path(user_email, document_id).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+
+index_store = _IndexStore(DOCUMENT_INDEX_DIR, DOCUMENT_INDEX_MEMORY_DOCUMENTS)
+
+
+class _IndexStats:
+    """Documents indexed and how much context follow-up questions send vs a re-upload."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.indexed = 0
+        self.reused = 0
+        self.chunks = 0
+        self.index_seconds = 0.0
+        self.queries = 0
+        self.context_chars = 0
+        self.reupload_chars = 0
+
+    def observe_index(self, chunks: int, seconds: float) -> None:
+        with self._lock:
+            self.indexed += 1
+            self.chunks += chunks
+            self.index_seconds += seconds
+
+    def observe_reuse(self) -> None:
+        with self._lock:
+            self.reused += 1
+
+    def observe_query(self, context_chars: int, document_chars: int) -> None:
+        with self._lock:
+            self.queries += 1
+            self.context_chars += context_chars
+            self.reupload_chars += min(document_chars, REUPLOAD_CONTEXT_CHARS)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": DOCUMENT_INDEX,
+                "embedder": DOCUMENT_INDEX_EMBEDDER,
+                "indexed": self.indexed,
+                "reused": self.reused,
+                "chunks": self.chunks,
+                "avg_index_seconds": round(self.index_seconds / self.indexed, 3) if self.indexed else 0.0,
+                "queries": self.queries,
+                "avg_context_chars": round(self.context_chars / self.queries) if self.queries else 0,
+                "context_share": round(self.context_chars / self.reupload_chars, 4) if self.reupload_chars else 0.0,
+            }
+
+
+index_stats_tracker = _IndexStats()
+
+
+# ---------- API ----------
+def index_document(user_email: str, document_id: str, text: str, filename: str = "", product_name: str = "") -> Optional[DocumentIndex]:
+    """Index extracted text for a user (no-op when this version of the index already exists)."""
+    if not DOCUMENT_INDEX or not text:
+        return None
+    existing = index_store.get(user_email, document_id)
+    if existing is not None:
+        index_store.touch(user_email, document_id)
+        index_stats_tracker.observe_reuse()
+        return existing
+    started = time.monotonic()
+    index = build_index(document_id, text, filename, product_name)
+    index_store.save(user_email, index)
+    seconds = time.monotonic() - started
+    index_stats_tracker.observe_index(len(index.chunks), seconds)
+    logger.info("Indexed document %s for follow-ups: %d chunk(s) via %s in %.2fs",
+                document_id[:12], len(index.chunks), index.embedder, seconds)
+    return index
+
+
+def get_document_index(user_email: str, document_id: str) -> Optional[DocumentIndex]:
+    return index_store.get(user_email, document_id)
+
+
+def list_document_indexes(user_email: str) -> list[dict]:
+    return index_store.list_user(user_email)
+
+
+def delete_document_index(user_email: str, document_id: str) -> bool:
+    return index_store.delete(user_email, document_id)
+
+
+def _query_prompt(index: DocumentIndex, question: str, hits: list[ChunkHit]) -> str:
+    # Excerpts in document order reads more naturally than score order
+    excerpts = "\n\n".join(
+        f"[Đoạn {h.index + 1}/{len(index.chunks)}]\n{h.text}" for h in sorted(hits, key=lambda h: h.index)
+    )
+    source = index.filename or "tài liệu đã tải lên"
+    product = f" (sản phẩm: {index.product_name})" if index.product_name else ""
+    return f"""
+Bạn là một chuyên gia marketing.
+Dưới đây là các đoạn trích liên quan nhất từ "{source}"{product}, theo thứ tự trong tài liệu.
+
+{excerpts}
+
+Yêu cầu của người dùng: {question}
+
+Quy tắc:
+- Chỉ dùng thông tin trong các đoạn trích trên; không bịa thêm thông số.
+- Nếu các đoạn trích không có thông tin cần thiết, nói rõ là tài liệu không đề cập.
+- Trả lời bằng tiếng Việt, trình bày gọn gàng.
+"""
+
+
+def answer_document_question(index: DocumentIndex, question: str, top_k: int = DOCUMENT_INDEX_TOP_K) -> tuple[str, list[ChunkHit], int]:
+    """(answer, chunks used, context chars sent).
+
+    Raises LLMUnavailableError like other gateway calls, and EmbedderUnavailableError
+    when the index can no longer be searched.
+    """
+    hits = search_index(index, question, min(max(1, top_k), DOCUMENT_INDEX_MAX_TOP_K))
+    prompt = _query_prompt(index, question, hits)
+    context_chars = sum(len(h.text) for h in hits)
+    response = gateway.generate_content([ModelCandidate("gemini-2.5-flash")], prompt, operation="document_query")
+    answer = (getattr(response, "text", None) or "").strip()
+    index_stats_tracker.observe_query(context_chars, index.chars)
+    return answer, hits, context_chars
+
+
+def document_index_stats() -> dict:
+    return index_stats_tracker.snapshot()
+
+
+__all__ = [
+    "Embedder", "HashingEmbedder", "GeminiEmbedder", "register_embedder", "get_embedder",
+    "DocumentIndex", "ChunkHit", "build_index", "search_index", "EmbedderUnavailableError", "is_document_id",
+    "index_document", "get_document_index", "list_document_indexes", "delete_document_index",
+    "answer_document_question", "document_index_stats",
+]
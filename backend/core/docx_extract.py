@@ -0,0 +1,215 @@
+"""Streaming .docx text extraction: paragraphs, tables, text boxes, headers/footers.
+
+python-docx builds the whole object model and `document.paragraphs` skips
+tables, where most spec sheets keep their specs. Here `word/document.xml` is
+inflated from the zip and parsed incrementally (ElementTree iterparse).
+Finished elements are dropped as we go, and parsing stops once the character
+budget is reached, so the rest of a large file is never decompressed.
+
+Output, in reading order:
+- one line per paragraph, with a blank line before headings (section
+  boundaries for chunking);
+- one line per table row, cells separated by " | ", with a blank line around
+  each table;
+- text-box paragraphs as their own lines (the VML fallback copy of a text box
+  is skipped);
+- header/footer text after the body (each distinct part once). It only fits
+  the budget when the body is short.
+
+Stdlib only, like core.pdf_extract, so parse workers stay light.
+"""
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Iterator, Optional, Union
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
+_OFFICE_DOCUMENT = "/officeDocument"
+_HEADER_FOOTER = ("/header", "/footer")
+_CELL_SEP = " | "
+
+_P, _R, _T, _TAB, _BR, _CR = W + "p", W + "r", W + "t", W + "tab", W + "br", W + "cr"
+_TBL, _TR, _TC, _SDT, _PSTYLE, _VAL = W + "tbl", W + "tr", W + "tc", W + "sdt", W + "pStyle", W + "val"
+_START_TAGS = frozenset((_P, _TBL, _TR, _TC, _MC_FALLBACK))
+_END_TAGS = frozenset((_P, _T, _TAB, _BR, _CR, _PSTYLE, _TBL, _TR, _TC, _SDT, _MC_FALLBACK))
+_DROP_TAGS = frozenset((_P, _TR, _TBL, _SDT, _MC_FALLBACK))
+
+DocxSource = Union[str, BinaryIO]
+
+
+def _rels(zf: zipfile.ZipFile, part: str) -> list[tuple[str, str]]:
+    """(type, target part name) of a part's relationships."""
+    folder, name = posixpath.split(part)
+    rels_name = posixpath.join(folder, "_rels", name + ".rels")
+    try:
+        root = ET.fromstring(zf.read(rels_name))
+    except KeyError:
+        return []
+    out = []
+    for rel in root.iter(_REL):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target", "")
+        target = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(folder, target))
+        out.append((rel.get("Type", ""), target))
+    return out
+
+
+def _main_part(zf: zipfile.ZipFile) -> str:
+    for rel_type, target in _rels(zf, ""):
+        if rel_type.endswith(_OFFICE_DOCUMENT):
+            return target
+    return "word/document.xml"
+
+
+def _heading_styles(zf: zipfile.ZipFile, main_part: str) -> set[str]:
+    """Style ids whose name is a heading (ids are localized, names are not)."""
+    styles_part = next((t for rel_type, t in _rels(zf, main_part) if rel_type.endswith("/styles")), None)
+    if styles_part is None:
+        return set()
+    try:
+        root = ET.fromstring(zf.read(styles_part))
+    except (KeyError, ET.ParseError):
+        return set()
+    ids = set()
+    for style in root.iter(W + "style"):
+        name = style.find(W + "name")
+        if name is not None and (name.get(W + "val") or "").lower().startswith(("heading", "title")):
+            ids.add(style.get(W + "styleId"))
+    return ids
+
+
+def _iter_blocks(stream: BinaryIO, heading_ids: set[str]) -> Iterator[str]:
+    """Text blocks of one part in document order ("" marks a blank line)."""
+    paragraphs: list[list[str]] = []      # open paragraphs (text boxes nest inside one)
+    headings: list[bool] = []
+    cells: list[list[str]] = []           # open table cells (their paragraphs)
+    rows: list[list[str]] = []            # open table rows (their cell texts)
+    elements: list[ET.Element] = []
+    skip = 0                              # depth inside mc:Fallback (duplicate of mc:Choice)
+
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            elements.append(elem)
+            if tag not in _START_TAGS or (skip and tag != _MC_FALLBACK):
+                continue
+            if tag == _P:
+                paragraphs.append([])
+                headings.append(False)
+            elif tag == _TBL:
+                if not cells:
+                    yield ""
+            elif tag == _TR:
+                rows.append([])
+            elif tag == _TC:
+                cells.append([])
+            else:
+                skip += 1
+            continue
+
+        elements.pop()
+        if tag not in _END_TAGS:
+            continue
+        if tag == _MC_FALLBACK:
+            skip -= 1
+        elif skip:
+            pass
+        elif tag == _T:
+            if paragraphs:
+                paragraphs[-1].append(elem.text or "")
+        elif tag == _TAB:
+            if paragraphs and elements and elements[-1].tag == _R:
+                paragraphs[-1].append("\t")
+        elif tag == _BR or tag == _CR:
+            if paragraphs:
+                paragraphs[-1].append("\n")
+        elif tag == _PSTYLE:
+            if headings:
+                headings[-1] = elem.get(_VAL) in heading_ids
+        elif tag == _P:
+            if paragraphs:
+                text = "".join(paragraphs.pop()).strip()
+                heading = headings.pop()
+                if cells:
+                    if text:
+                        cells[-1].append(text)
+                elif text or not paragraphs:
+                    if heading:
+                        yield ""
+                    yield text
+        elif tag == _TC:
+            if cells:
+                text = " ".join(cells.pop())
+                if rows:
+                    rows[-1].append(text)
+        elif tag == _TR:
+            if rows:
+                row = rows.pop()
+                # Merged cells repeat their text; keep each value once per row
+                row = [c for i, c in enumerate(row) if c and c not in row[:i]]
+                if row:
+                    line = _CELL_SEP.join(row)
+                    if cells:
+                        cells[-1].append(line)   # nested table: part of the outer cell
+                    else:
+                        yield line
+        elif tag == _TBL and not cells:
+            yield ""
+
+        if tag in _DROP_TAGS:
+            elem.clear()
+            if elements:
+                parent = elements[-1]
+                # Drop finished children so the tree never holds more than the open path
+                if len(parent) and parent[-1] is elem:
+                    parent.remove(elem)
+
+
+def _part_text(zf: zipfile.ZipFile, part: str, heading_ids: set[str], budget: Optional[int]) -> tuple[list[str], int]:
+    lines: list[str] = []
+    used = 0
+    with zf.open(part) as stream:
+        for block in _iter_blocks(stream, heading_ids):
+            if not block and (not lines or not lines[-1]):
+                continue  # collapse blank lines
+            lines.append(block)
+            used += len(block) + 1
+            if budget is not None and used >= budget:
+                break
+    return lines, used
+
+
+def extract_docx_text(source: DocxSource, max_chars: Optional[int] = None) -> str:
+    """Text of a .docx (path or seekable binary file), at most `max_chars` characters."""
+    if not isinstance(source, str):
+        source.seek(0)
+    with zipfile.ZipFile(source) as zf:
+        main_part = _main_part(zf)
+        heading_ids = _heading_styles(zf, main_part)
+        lines, used = _part_text(zf, main_part, heading_ids, max_chars)
+        if max_chars is None or used < max_chars:
+            seen: set[str] = set()
+            for rel_type, part in _rels(zf, main_part):
+                if not rel_type.endswith(_HEADER_FOOTER):
+                    continue
+                try:
+                    zf.getinfo(part)
+                except KeyError:
+                    continue
+                remaining = None if max_chars is None else max_chars - used
+                part_lines, part_used = _part_text(zf, part, heading_ids, remaining)
+                text = "\n".join(line for line in part_lines if line)
+                if text and text not in seen:
+                    seen.add(text)
+                    lines.extend(["", text])
+                    used += part_used + 1
+                if max_chars is not None and used >= max_chars:
+                    break
+    text = "\n".join(lines).strip("\n")
+    return text[:max_chars] if max_chars is not None else text
+
+
+__all__ = ["extract_docx_text"]
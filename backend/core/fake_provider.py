@@ -0,0 +1,323 @@
+"""Offline stand-in for the live providers, selected with LLM_PROVIDER=fake.
+
+Answers are canned per operation and valid for the app's schemas, latency is
+drawn from a lognormal distribution and failures are injected at configurable
+rates, so every endpoint can be exercised (load tests, benchmarks, CI) without
+network access or quota. Random draws come from one seeded RNG, so a serial
+run is reproducible.
+
+Env:
+    LLM_FAKE_SEED             RNG seed (default 0)
+    LLM_FAKE_LATENCY_MEDIAN   median seconds per text call (default 1.5)
+    LLM_FAKE_LATENCY_SIGMA    lognormal sigma, 0 = fixed latency (default 0.5)
+    LLM_FAKE_MODEL_LATENCY    JSON per-model median override, e.g. {"gemini-1.5-flash": 0.8}
+    LLM_FAKE_IMAGE_LATENCY    median seconds per image call (default 8)
+    LLM_FAKE_ERROR_RATE       share of calls failing with 503 UNAVAILABLE
+    LLM_FAKE_MALFORMED_RATE   share of answers cut off mid-JSON
+    LLM_FAKE_EMPTY_RATE       share of answers with empty text
+"""
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Optional
+
+from core.ai_clients import LLMProvider
+
+logger = logging.getLogger(__name__)
+
+# 1x1 transparent PNG
+_PLACEHOLDER_PNG_B64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+_SENTENCES = [
+    "Mỗi ngày bắt đầu nhẹ nhàng hơn khi mọi thứ bạn cần đều nằm gọn trong tầm tay.",
+    "Thiết kế tinh gọn giúp bạn mang theo bất cứ đâu mà không thấy vướng víu.",
+    "Hàng nghìn khách hàng đã tin dùng và quay lại mua thêm cho người thân.",
+    "Chất liệu bền bỉ, an toàn và được kiểm định kỹ lưỡng trước khi đến tay bạn.",
+    "Bạn tiết kiệm được thời gian, công sức và cả chi phí trong dài hạn.",
+    "Đừng để những phiền toái nhỏ lấy đi niềm vui mỗi ngày của bạn.",
+    "Trải nghiệm ngay hôm nay để cảm nhận sự khác biệt rõ rệt.",
+    "Ưu đãi dành riêng cho khách hàng đăng ký sớm trong tuần này.",
+]
+
+
+class FakeProviderError(RuntimeError):
+    """Injected provider failure; carries `code` like the SDK errors do."""
+
+    def __init__(self, message: str, code: int = 503):
+        super().__init__(message)
+        self.code = code
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _prompt_text(contents: Any) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_prompt_text(c) for c in contents)
+    text = getattr(contents, "text", None)
+    return text if isinstance(text, str) else ""
+
+
+def _subject(prompt: str) -> str:
+    # First quoted name in the prompt ('...' or product_name: "..."), else a generic label
+    m = re.search(r"'([^'\n]{1,120})'", prompt) or re.search(r'product_name:\s*"([^"\n]{1,120})"', prompt)
+    if m:
+        return m.group(1).strip()
+    m = re.search(r"^Product:\s*(.+)$", prompt, re.M)
+    return m.group(1).strip() if m else "Sản phẩm mẫu"
+
+
+def _words(n: int) -> str:
+    out, total, i = [], 0, 0
+    while total < n:
+        s = _SENTENCES[i % len(_SENTENCES)]
+        out.append(s)
+        total += len(s.split())
+        i += 1
+    return " ".join(out)
+
+
+def _target_words(prompt: str, default: int) -> int:
+    m = re.search(r"Desired Length \(words\):\s*(\d+)", prompt) or re.search(r"at least (\d+) words", prompt)
+    if m:
+        return int(m.group(1))
+    m = re.search(r"Target Length \(words\):\s*(\d+)-(\d+)", prompt)
+    return (int(m.group(1)) + int(m.group(2))) // 2 if m else default
+
+
+_CHUNK_FEATURES = [
+    "Cảnh báo thay lõi lọc tự động",
+    "Vòi nóng lạnh tích hợp",
+    "Tiết kiệm điện ở chế độ chờ",
+    "Lắp đặt miễn phí tại nhà",
+    "Ứng dụng di động theo dõi chất lượng nước",
+    "Vỏ thép không gỉ chống bám bẩn",
+]
+
+
+def _product_analysis(name: str) -> dict:
+    return {
+        "usps": [f"{name} bền bỉ, dùng lâu dài", "Thiết kế gọn nhẹ, dễ mang theo", "Giá hợp lý so với chất lượng"],
+        "pain_points": ["Sản phẩm cũ nhanh hỏng", "Khó tìm hàng chính hãng", "Chi phí bảo trì cao"],
+        "infor": "Chất liệu cao cấp, bảo hành 12 tháng, nhiều màu",
+        "target_persona": "Người đi làm 25–40 tuổi ở thành thị, ưu tiên sự tiện lợi và chất lượng ổn định.",
+    }
+
+
+def _competitor_analysis(name: str) -> dict:
+    return {
+        "product_name": name,
+        "product_analysis": {
+            "usps": ["Thương hiệu quen thuộc", "Mạng lưới phân phối rộng", "Nhiều phiên bản giá"],
+            "key_specs": "Dung lượng tiêu chuẩn, độ bền trung bình, chất liệu nhựa cao cấp.",
+            "quality_feedback": "Đa số hài lòng, một số phản ánh lỗi vặt sau 6 tháng.",
+            "pricing_strategy": "Định giá trung bình, khuyến mãi theo mùa và combo.",
+        },
+        "customer_focus": {
+            "target_persona": "Gia đình trẻ thu nhập trung bình tại các thành phố lớn.",
+            "missed_segments": "Khách hàng cao cấp cần dịch vụ hậu mãi nhanh.",
+            "pain_points": ["Bảo hành chậm", "Tư vấn online chưa nhiệt tình"],
+            "customer_journey": "Mua chủ yếu trên sàn TMĐT, bảo hành tại trung tâm ủy quyền.",
+        },
+        "marketing_strategy": {
+            "key_channels": "Facebook Ads, TikTok, Shopee Live; đăng bài hằng ngày.",
+            "core_messaging": "Tin cậy, tiết kiệm cho mọi gia đình.",
+            "content_creative": "Video ngắn review và hợp tác KOL tầm trung.",
+        },
+        "distribution_market": {
+            "distribution_channels": "Siêu thị, chuỗi điện máy, website riêng, sàn TMĐT.",
+            "market_share_estimate": "Khoảng 15–20% phân khúc phổ thông.",
+        },
+    }
+
+
+def _canned_answer(operation: str, prompt: str) -> str:
+    if operation.endswith("_repair"):
+        # Structured-output repair: re-emit a valid answer for the original operation
+        return _canned_answer(operation[: -len("_repair")], prompt)
+    name = _subject(prompt)
+    if operation in ("analyze_product", "competitive_analysis"):
+        return json.dumps(_product_analysis(name), ensure_ascii=False)
+    if operation == "document_analysis":
+        # Single-pass analysis also names the product when the prompt didn't give one
+        return json.dumps({"product_name": name, **_product_analysis(name)}, ensure_ascii=False)
+    if operation == "document_analysis_chunk":
+        # Same answer per chunk plus one point only this part mentions (exercises the merge)
+        data = {"product_name": name, **_product_analysis(name)}
+        m = re.search(r"phần (\d+)/(\d+)", prompt)
+        if m:
+            data["usps"].append(_CHUNK_FEATURES[(int(m.group(1)) - 1) % len(_CHUNK_FEATURES)])
+        return json.dumps(data, ensure_ascii=False)
+    if operation == "ocr_pages":
+        # One transcript per scanned page in the batch ("gồm N page(s)" in the prompt)
+        m = re.search(r"(\d+) page\(s\)", prompt)
+        n = int(m.group(1)) if m else 1
+        pages = [f"Trang scan {i + 1}: {_SENTENCES[i % len(_SENTENCES)]}" for i in range(n)]
+        return json.dumps({"pages": pages}, ensure_ascii=False)
+    if operation == "analyze_competitor":
+        return json.dumps(_competitor_analysis(name), ensure_ascii=False)
+    if operation == "detect_product_name":
+        return json.dumps({"product_name": "Sản phẩm mẫu", "confidence": 0.9, "reason": "Tên xuất hiện nhiều nhất trong tài liệu."}, ensure_ascii=False)
+    if operation in ("generate_content", "document_marketing"):
+        words = _target_words(prompt, 300 if operation == "generate_content" else 150)
+        content = _words(words)
+        return json.dumps({"title": f"🔥 Bí mật đằng sau {name}!", "content": content, "word_count": len(content.split())}, ensure_ascii=False)
+    if operation == "document_query":
+        return _words(80)
+    if operation == "expand_content":
+        return _words(_target_words(prompt, 300))
+    if operation == "expand_style":
+        return "Studio shot, soft key light from the left, warm palette, shallow depth of field, product centered on a marble surface."
+    return "OK"
+
+
+class FakeProvider(LLMProvider):
+    name = "fake"
+
+    def __init__(
+        self,
+        seed: int = 0,
+        latency_median: float = 1.5,
+        latency_sigma: float = 0.5,
+        model_latency: Optional[dict[str, float]] = None,
+        image_latency: float = 8.0,
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        empty_rate: float = 0.0,
+    ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.model_latency = model_latency or {}
+        self.image_latency = image_latency
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.empty_rate = empty_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "FakeProvider":
+        try:
+            model_latency = json.loads(os.getenv("LLM_FAKE_MODEL_LATENCY", "") or "{}")
+        except ValueError:
+            logger.warning("Ignoring invalid LLM_FAKE_MODEL_LATENCY")
+            model_latency = {}
+        return cls(
+            seed=int(os.getenv("LLM_FAKE_SEED", 0)),
+            latency_median=_env_float("LLM_FAKE_LATENCY_MEDIAN", 1.5),
+            latency_sigma=_env_float("LLM_FAKE_LATENCY_SIGMA", 0.5),
+            model_latency={str(k): float(v) for k, v in model_latency.items()},
+            image_latency=_env_float("LLM_FAKE_IMAGE_LATENCY", 8.0),
+            error_rate=_env_float("LLM_FAKE_ERROR_RATE", 0.0),
+            malformed_rate=_env_float("LLM_FAKE_MALFORMED_RATE", 0.0),
+            empty_rate=_env_float("LLM_FAKE_EMPTY_RATE", 0.0),
+        )
+
+    def is_available(self) -> bool:
+        return True
+
+    def images_available(self) -> bool:
+        return True
+
+    # ---------- simulation ----------
+    def _draw(self, median: float) -> tuple[float, float]:
+        """(latency seconds, uniform roll for fault selection) from the shared RNG."""
+        with self._lock:
+            if self.latency_sigma > 0:
+                latency = self._rng.lognormvariate(math.log(max(median, 1e-6)), self.latency_sigma)
+            else:
+                latency = median
+            return latency, self._rng.random()
+
+    def _plan(self, model: str, contents: Any, operation: str) -> tuple[float, Optional[str]]:
+        """Return (latency, text); text is None when this call should fail with a 503."""
+        latency, roll = self._draw(self.model_latency.get(model, self.latency_median))
+        if roll < self.error_rate:
+            # Overloaded backends fail fast relative to a full answer
+            return latency * 0.2, None
+        roll -= self.error_rate
+        text = _canned_answer(operation, _prompt_text(contents))
+        if roll < self.malformed_rate:
+            text = text[: max(1, int(len(text) * 0.6))]
+        elif roll - self.malformed_rate < self.empty_rate:
+            text = ""
+        return latency, text
+
+    @staticmethod
+    def _response(model: str, contents: Any, text: str) -> Any:
+        prompt_tokens = len(_prompt_text(contents)) // 4 + 1
+        output_tokens = len(text) // 4
+        return SimpleNamespace(
+            text=text,
+            model_version=model,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+            ),
+        )
+
+    @staticmethod
+    def _overloaded(model: str) -> FakeProviderError:
+        return FakeProviderError(f"503 UNAVAILABLE. The model {model} is overloaded (fake provider).")
+
+    # ---------- text ----------
+    def generate(self, model: str, contents: Any, config: Any = None, operation: str = "") -> Any:
+        latency, text = self._plan(model, contents, operation)
+        time.sleep(latency)
+        if text is None:
+            raise self._overloaded(model)
+        return self._response(model, contents, text)
+
+    async def agenerate(self, model: str, contents: Any, config: Any = None, operation: str = "") -> Any:
+        latency, text = self._plan(model, contents, operation)
+        await asyncio.sleep(latency)
+        if text is None:
+            raise self._overloaded(model)
+        return self._response(model, contents, text)
+
+    async def astream(self, model: str, contents: Any, config: Any = None, operation: str = "") -> AsyncIterator[str]:
+        latency, text = self._plan(model, contents, operation)
+        # ~30% of the latency to first token, the rest spread over the chunks
+        await asyncio.sleep(latency * 0.3)
+        if text is None:
+            raise self._overloaded(model)
+        chunks = [text[i:i + 24] for i in range(0, len(text), 24)]
+        step = latency * 0.7 / max(1, len(chunks))
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(step)
+
+    # ---------- images ----------
+    def _image_response(self, n: int) -> Any:
+        latency, roll = self._draw(self.image_latency)
+        time.sleep(latency)
+        if roll < self.error_rate:
+            raise FakeProviderError("503 Service Unavailable (fake image provider).")
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=_PLACEHOLDER_PNG_B64, url=None) for _ in range(max(1, n))])
+
+    def generate_image(self, model: str, prompt: str, size: str = "1024x1024", n: int = 1) -> Any:
+        return self._image_response(n)
+
+    def edit_image(self, model: str, image: Any, prompt: str, size: str = "1024x1024", n: int = 1, **kwargs) -> Any:
+        if hasattr(image, "read"):
+            image.read()
+        return self._image_response(n)
+
+
+__all__ = ["FakeProvider", "FakeProviderError"]
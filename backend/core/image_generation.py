@@ -2,9 +2,11 @@ import os
 import base64
 import logging
 from models.schemas import ImageGenerationResponse
-from typing import Optional
+from typing import BinaryIO, Optional, Union
+from contextlib import nullcontext
 from io import BytesIO
-from core.ai_clients import get_gemini_client, get_openai_client, OPENAI_API_KEY, GEMINI_API_KEY
+from core.ai_clients import get_llm_provider, OPENAI_API_KEY, GEMINI_API_KEY, LLMUnavailableError, llm_slot
+from core.llm_gateway import gateway, ModelCandidate
 
 # setup basic logger
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
@@ -22,8 +24,7 @@ try:
 except Exception as e:
     logger.info("Optional module import failed: %s", e)
 
-gemini_client = get_gemini_client()
-openai_client = get_openai_client()
+provider = get_llm_provider()
 
 
 cloudinary.config(
@@ -35,9 +36,8 @@ cloudinary.config(
 
 # Log availability of keys/clients
 logger.info("GEMINI_API_KEY present: %s", bool(GEMINI_API_KEY))
-logger.info("gemini_client available: %s", bool(gemini_client))
 logger.info("OPENAI_API_KEY present: %s", bool(OPENAI_API_KEY))
-logger.info("openai_client available: %s", bool(openai_client))
+logger.info("LLM provider: %s (text available: %s, images available: %s)", provider.name, provider.is_available(), provider.images_available())
 logger.info("Cloudinary configured: %s", bool(os.getenv("CLOUDINARY_CLOUD_NAME")))
 
 # Known limitations for vision/editing models
@@ -256,88 +256,19 @@ def _expand_style_with_gemini(style_short: str) -> Optional[str]:
     if not style_short:
         return None
 
-    if not gemini_client:
-        logger.info("No gemini_client available; skipping Gemini expansion.")
+    if not gateway.is_available():
+        logger.info("No text provider available; skipping Gemini expansion.")
         return None
 
-    # Try several possible method names and response shapes because different
-    # versions of the google-genai package expose different client APIs.
-    candidates = [
-        "generate_content",
-        "generate",
-        "generate_text",
-        "text_generation",
-        "create",
-    ]
-
-    last_exc = None
-    for method_name in candidates:
-        try:
-            if hasattr(gemini_client, method_name):
-                method = getattr(gemini_client, method_name)
-                logger.info("Calling gemini_client.%s(...) for style expansion", method_name)
-                resp = method(instruction)
-
-                # Try to extract text from common response shapes
-                if resp is None:
-                    logger.warning("Gemini method %s returned None", method_name)
-                    continue
-
-                # Common attribute: text
-                if hasattr(resp, "text"):
-                    text = getattr(resp, "text")
-                    if text:
-                        return text.strip()
-
-                # Some clients return a dict-like or object with 'candidates' or 'output'
-                try:
-                    # dict-like
-                    if isinstance(resp, dict):
-                        # e.g. {'candidates': [{'text': '...'}]}
-                        if "candidates" in resp and resp["candidates"]:
-                            c0 = resp["candidates"][0]
-                            if isinstance(c0, dict) and c0.get("text"):
-                                return c0.get("text").strip()
-                        if "output" in resp and isinstance(resp["output"], str):
-                            return resp["output"].strip()
-
-                    # object with attributes
-                    if hasattr(resp, "candidates") and getattr(resp, "candidates"):
-                        c0 = getattr(resp, "candidates")[0]
-                        if hasattr(c0, "text"):
-                            return getattr(c0, "text").strip()
-                    if hasattr(resp, "output") and isinstance(getattr(resp, "output"), str):
-                        return getattr(resp, "output").strip()
-                except Exception:
-                    # ignore extraction errors and continue trying other methods
-                    pass
-
-                # As a last resort, try str(resp) and use it if non-empty and not huge
-                try:
-                    s = str(resp)
-                    if s and len(s) < 2000:
-                        # clean up common wrappers
-                        return s.strip()
-                except Exception:
-                    pass
-
-        except AttributeError as ae:
-            # method not present or bound method failing
-            last_exc = ae
-            logger.debug("AttributeError calling gemini.%s: %s", method_name, ae)
-        except Exception as e:
-            last_exc = e
-            logger.warning("gemini_client.%s failed: %s", method_name, e)
-
-    # If we reach here, none of the methods produced usable text. Log diagnostic info.
     try:
-        client_type = type(gemini_client)
-        client_dir = dir(gemini_client)
-        logger.warning("Gemini expansion not available. gemini_client type=%s; attrs=%s", client_type, client_dir)
-        if last_exc:
-            logger.warning("Last Gemini exception: %s", last_exc)
+        resp = gateway.generate_content([ModelCandidate("gemini-2.5-flash")], instruction, operation="expand_style")
+        text = getattr(resp, "text", None)
+        if text:
+            return text.strip()
+    except LLMUnavailableError as e:
+        logger.info("Gemini expansion skipped (model unavailable): %s", e)
     except Exception as e:
-        logger.warning("Failed to introspect gemini_client: %s", e)
+        logger.warning("Gemini style expansion failed: %s", e)
 
     logger.info("Gemini expansion not available. Skipping style expansion.")
     return None
@@ -385,19 +316,15 @@ Requirements:
             )
 
         # Gọi OpenAI API
-        if openai_client:
+        if provider.images_available():
             try:
                 print("Calling OpenAI Images API (gpt-image-1)...")
                 allowed_sizes = {"1024x1024", "1024x1536", "1536x1024"}
                 if size not in allowed_sizes:
                     size = "1024x1024"
 
-                resp = openai_client.images.generate(
-                    model="gpt-image-1",
-                    prompt=final_prompt,
-                    size=size,
-                    n=n_images,
-                )
+                with llm_slot(provider.image_limiter, "gpt-image-1", operation="generate_image") as call:
+                    resp = call.response = provider.generate_image("gpt-image-1", final_prompt, size=size, n=n_images)
                 if resp and getattr(resp, "data", None) and len(resp.data) > 0:
                     result_data = resp.data[0]
                     url = getattr(result_data, "url", None)
@@ -459,10 +386,14 @@ Requirements:
 
 # Thêm hàm upload Cloudinary
 
-def upload_to_cloudinary(image_bytes: bytes, public_id_prefix: str = "ref") -> Optional[str]:
-    """Upload ảnh lên Cloudinary và trả về public URL."""
+def upload_to_cloudinary(image_bytes: Union[bytes, str, BinaryIO], public_id_prefix: str = "ref") -> Optional[str]:
+    """Upload ảnh lên Cloudinary và trả về public URL.
+
+    Nhận bytes, đường dẫn file hoặc file handle (SDK tự đọc theo từng phần, không cần copy sang bytes).
+    """
     try:
-        with BytesIO(image_bytes) as img_buffer:
+        source = BytesIO(image_bytes) if isinstance(image_bytes, (bytes, bytearray)) else nullcontext(image_bytes)
+        with source as img_buffer:
             response = cloudinary.uploader.upload(
                 img_buffer,
                 folder="marketing_agency/references", 
@@ -479,16 +410,16 @@ def upload_to_cloudinary(image_bytes: bytes, public_id_prefix: str = "ref") -> O
 def generate_marketing_poster(
     product_name: str,
     style_short: Optional[str] = None,
-    # Thêm ảnh gốc và tùy chọn mask
-    original_image_bytes: Optional[bytes] = None,
+    # Thêm ảnh gốc và tùy chọn mask; ảnh gốc có thể là bytes hoặc file handle (không copy sang bytes)
+    original_image_bytes: Optional[Union[bytes, BinaryIO]] = None,
     original_image_path: Optional[str] = None,
     mask_image_bytes: Optional[bytes] = None, 
     size: str = "1024x1024",
     n_images: int = 1
 ) -> Optional[ImageGenerationResponse]:
     try:
-        # Kiểm tra ảnh gốc (bắt buộc cho Edit)
-        if not original_image_bytes:
+        # Kiểm tra ảnh gốc (bắt buộc cho Edit); đường dẫn file đã lưu được ưu tiên, không cần giữ bytes
+        if not original_image_bytes and not original_image_path:
             # Enforce requirement: editing requires a reference/original image
             raise Exception("Reference image is required for editing.")
 
@@ -525,7 +456,7 @@ def generate_marketing_poster(
         final_prompt += limitations
 
         # Gọi OpenAI Images Edit API
-        if openai_client:
+        if provider.images_available():
             try:
                 edit_model = "gpt-image-1"
                 logger.info("Calling OpenAI Images Edit API (%s)...", edit_model)
@@ -534,26 +465,29 @@ def generate_marketing_poster(
                 if size not in allowed_sizes:
                     size = "1024x1024"
 
-                # Prepare image input: prefer path if provided (saved on disk), else use bytes
+                # Prepare image input: prefer path if provided (saved on disk), else the bytes or handle
                 opened_file = None
                 try:
                     if original_image_path:
                         opened_file = open(original_image_path, "rb")
                         image_input = opened_file
                         logger.info("Using saved image path for OpenAI request: %s", original_image_path)
-                    else:
+                    elif isinstance(original_image_bytes, (bytes, bytearray)):
                         image_input = BytesIO(original_image_bytes)
+                    else:
+                        image_input = original_image_bytes
 
                     mask_file = BytesIO(mask_image_bytes) if mask_image_bytes else None
 
-                    resp = openai_client.images.edit(
-                        model=edit_model,
-                        image=image_input,
-                        prompt=final_prompt,
-                        size=size,
-                        n=n_images,
-                        quality="medium",
-                    )
+                    with llm_slot(provider.image_limiter, edit_model, operation="edit_image") as call:
+                        resp = call.response = provider.edit_image(
+                            edit_model,
+                            image_input,
+                            final_prompt,
+                            size=size,
+                            n=n_images,
+                            quality="medium",
+                        )
 
                     if resp and getattr(resp, "data", None) and len(resp.data) > 0:
                         result_data = resp.data[0]
@@ -578,6 +512,8 @@ def generate_marketing_poster(
                 finally:
                     if opened_file:
                         opened_file.close()
+            except LLMUnavailableError:
+                raise
             except Exception as e:
                 logger.error("OpenAI Images Edit error: %s", e)
                 
@@ -589,6 +525,8 @@ def generate_marketing_poster(
             reference_url=None
         )
         
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         err = str(e)
         logger.error("Error in generate_marketing_poster: %s", err)
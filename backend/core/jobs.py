@@ -0,0 +1,337 @@
+"""Background jobs for long-running generations (poster edits, grounded analyses).
+
+An endpoint called with `?async=true` stores a job row and returns its id at
+once. A small pool of asyncio workers in every app process claims queued
+rows, runs the registered handler and stores the result. On failure it stores
+the error and the HTTP status the synchronous endpoint would have returned.
+Rows live in the application DB, so jobs survive a restart. A running job
+holds a lease that its worker renews. A job whose lease ran out (the worker
+died) is queued again, up to JOB_MAX_ATTEMPTS runs. Rows are deleted
+JOB_TTL_SECONDS after they were submitted/finished.
+
+Handlers take the JSON payload and return a JSON-serialisable dict. Sync
+handlers run in a worker thread and async handlers run on the loop. At
+shutdown an async handler is cancelled and its job re-queued; a sync handler's
+thread can't be stopped, so it gets JOB_SHUTDOWN_GRACE_SECONDS to finish and
+store its own result. An
+exception may carry `status_code` / `detail` (e.g. FastAPI's HTTPException).
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Optional
+
+from sqlalchemy import func
+
+from db import SessionLocal
+from models.job import Job
+from core.llm_metrics import bind_request, reset_request
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", 24 * 3600))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 2))
+# Idle workers also poll, so jobs submitted by another process are picked up
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1.0))
+# How long shutdown waits for a sync handler's thread to finish (keep it below the lease)
+JOB_SHUTDOWN_GRACE_SECONDS = float(os.getenv("JOB_SHUTDOWN_GRACE_SECONDS", 10))
+_PURGE_EVERY_SECONDS = 60.0
+
+Handler = Callable[[dict], Any]
+
+
+class JobQueue:
+    """DB-backed queue plus the asyncio worker pool of this process."""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self._handlers: dict[str, Handler] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._active: set[str] = set()
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = defaultdict(int)
+
+    # ---------- registry / submit / poll ----------
+    def register(self, kind: str, handler: Optional[Handler] = None):
+        """Register `handler` for `kind`; usable as a decorator."""
+        def deco(fn: Handler) -> Handler:
+            self._handlers[kind] = fn
+            return fn
+        return deco(handler) if handler is not None else deco
+
+    def submit(self, kind: str, payload: dict) -> str:
+        if kind not in self._handlers:
+            raise KeyError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with SessionLocal() as db:
+            db.add(Job(
+                id=job_id,
+                kind=kind,
+                status="queued",
+                payload_json=json.dumps(payload, ensure_ascii=False),
+                attempts=0,
+                expires_at=time.time() + JOB_TTL_SECONDS,
+            ))
+            db.commit()
+        self._count("submitted")
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with SessionLocal() as db:
+            job = db.get(Job, job_id)
+            if job is None or job.expires_at < time.time():
+                return None
+            return {
+                "id": job.id,
+                "kind": job.kind,
+                "status": job.status,
+                "attempts": job.attempts,
+                "created_at": job.created_at,
+                "started_at": job.started_at,
+                "finished_at": job.finished_at,
+                "result": json.loads(job.result_json) if job.result_json else None,
+                "error": job.error,
+                "error_status": job.error_status,
+            }
+
+    # ---------- DB transitions ----------
+    def _claim(self) -> Optional[tuple[str, str, dict]]:
+        with SessionLocal() as db:
+            for _ in range(5):
+                row = (
+                    db.query(Job.id, Job.kind, Job.payload_json)
+                    .filter(Job.status == "queued")
+                    .order_by(Job.created_at, Job.id)
+                    .first()
+                )
+                if row is None:
+                    return None
+                # Conditional update: only one worker (of any process) wins the row
+                won = (
+                    db.query(Job)
+                    .filter(Job.id == row.id, Job.status == "queued")
+                    .update({
+                        Job.status: "running",
+                        Job.attempts: Job.attempts + 1,
+                        Job.lease_until: time.time() + JOB_LEASE_SECONDS,
+                        Job.started_at: func.now(),
+                    }, synchronize_session=False)
+                )
+                db.commit()
+                if won:
+                    return row.id, row.kind, json.loads(row.payload_json)
+        return None
+
+    def _finish(self, job_id: str, result: Optional[dict] = None, error: Optional[str] = None, error_status: Optional[int] = None) -> None:
+        with SessionLocal() as db:
+            db.query(Job).filter(Job.id == job_id).update({
+                Job.status: "failed" if error is not None else "succeeded",
+                Job.result_json: json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                Job.error: error,
+                Job.error_status: error_status,
+                Job.lease_until: None,
+                Job.finished_at: func.now(),
+                Job.expires_at: time.time() + JOB_TTL_SECONDS,
+            }, synchronize_session=False)
+            db.commit()
+
+    def _release(self, job_id: str) -> None:
+        # Shutdown mid-run: hand the job back without counting the interrupted attempt
+        with SessionLocal() as db:
+            db.query(Job).filter(Job.id == job_id, Job.status == "running").update({
+                Job.status: "queued",
+                Job.attempts: Job.attempts - 1,
+                Job.lease_until: None,
+            }, synchronize_session=False)
+            db.commit()
+
+    def _renew(self, job_ids: list[str]) -> None:
+        with SessionLocal() as db:
+            db.query(Job).filter(Job.id.in_(job_ids), Job.status == "running").update(
+                {Job.lease_until: time.time() + JOB_LEASE_SECONDS}, synchronize_session=False
+            )
+            db.commit()
+
+    def _recover(self) -> int:
+        """Re-queue running jobs whose worker stopped renewing the lease (crash/restart)."""
+        now = time.time()
+        with SessionLocal() as db:
+            lost = db.query(Job).filter(Job.status == "running", Job.lease_until < now)
+            requeued = lost.filter(Job.attempts < JOB_MAX_ATTEMPTS).update(
+                {Job.status: "queued", Job.lease_until: None}, synchronize_session=False
+            )
+            failed = lost.filter(Job.attempts >= JOB_MAX_ATTEMPTS).update({
+                Job.status: "failed",
+                Job.error: "Tiến trình xử lý bị gián đoạn quá số lần cho phép.",
+                Job.error_status: 500,
+                Job.lease_until: None,
+                Job.finished_at: func.now(),
+                Job.expires_at: now + JOB_TTL_SECONDS,
+            }, synchronize_session=False)
+            db.commit()
+        if requeued or failed:
+            logger.warning("Recovered %d job(s) with an expired lease (%d re-queued, %d failed)", requeued + failed, requeued, failed)
+            self._count("requeued", requeued)
+        return requeued + failed
+
+    def _purge(self) -> int:
+        with SessionLocal() as db:
+            n = db.query(Job).filter(Job.expires_at < time.time(), Job.status != "running").delete(synchronize_session=False)
+            db.commit()
+        return n
+
+    # ---------- workers ----------
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        await asyncio.to_thread(self._recover)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._housekeeping(), name="job-housekeeping"))
+        logger.info("Job queue started with %d worker(s)", self.workers)
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop = self._wake = None
+
+    async def _worker(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                claimed = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                logger.error("Job claim failed: %s", e)
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*claimed)
+
+    async def _run(self, job_id: str, kind: str, payload: dict) -> None:
+        handler = self._handlers.get(kind)
+        self._active.add(job_id)
+        # Model calls made by the job are logged under the job id
+        token = bind_request(job_id, f"job:{kind}")
+        started = time.monotonic()
+        work = None
+        try:
+            if handler is None:
+                raise LookupError(f"Không có handler cho loại job '{kind}'")
+            if asyncio.iscoroutinefunction(handler):
+                result = await handler(payload)
+                await asyncio.to_thread(self._finish, job_id, result)
+                self._count("succeeded")
+                ok = True
+            else:
+                # A thread can't be cancelled: it stores its own outcome, the worker only waits for it
+                work = asyncio.ensure_future(asyncio.to_thread(self._run_sync, job_id, kind, handler, payload))
+                ok = await asyncio.shield(work)
+            if ok:
+                logger.info("Job %s (%s) done in %.1fs", job_id, kind, time.monotonic() - started)
+        except asyncio.CancelledError:
+            if work is None:
+                await asyncio.to_thread(self._release, job_id)
+            else:
+                await self._drain(job_id, kind, work)
+            raise
+        except Exception as e:
+            await asyncio.to_thread(self._fail, job_id, kind, e)
+        finally:
+            reset_request(token)
+            self._active.discard(job_id)
+
+    def _run_sync(self, job_id: str, kind: str, handler: Handler, payload: dict) -> bool:
+        try:
+            result = handler(payload)
+        except Exception as e:
+            self._fail(job_id, kind, e)
+            return False
+        self._finish(job_id, result)
+        self._count("succeeded")
+        return True
+
+    def _fail(self, job_id: str, kind: str, e: Exception) -> None:
+        detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+        logger.error("Job %s (%s) failed: %s", job_id, kind, detail)
+        self._finish(job_id, None, str(detail), int(getattr(e, "status_code", 500) or 500))
+        self._count("failed")
+
+    async def _drain(self, job_id: str, kind: str, work: asyncio.Future) -> None:
+        """Shutdown while a sync handler runs: give its thread a grace period instead of re-queuing.
+
+        Re-queuing would run (and bill) the job a second time while the thread
+        is still calling the model. A thread that outlives the grace period
+        keeps the row `running`: it stores the outcome if the process lives on,
+        otherwise the lease expires and recovery re-queues the job.
+        """
+        try:
+            await asyncio.wait_for(asyncio.shield(work), JOB_SHUTDOWN_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Job %s (%s) still running after %.0fs shutdown grace; leaving it to its lease", job_id, kind, JOB_SHUTDOWN_GRACE_SECONDS)
+        except Exception as e:
+            logger.error("Job %s (%s) failed during shutdown: %s", job_id, kind, e)
+
+    async def _housekeeping(self) -> None:
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                if self._active:
+                    await asyncio.to_thread(self._renew, list(self._active))
+                await asyncio.to_thread(self._recover)
+                if time.monotonic() - last_purge > _PURGE_EVERY_SECONDS:
+                    last_purge = time.monotonic()
+                    purged = await asyncio.to_thread(self._purge)
+                    if purged:
+                        logger.info("Purged %d expired job(s)", purged)
+            except Exception as e:
+                logger.error("Job housekeeping failed: %s", e)
+
+    # ---------- stats ----------
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    def stats(self) -> dict:
+        try:
+            with SessionLocal() as db:
+                by_status = dict(db.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+        except Exception as e:
+            logger.warning("Job stats query failed: %s", e)
+            by_status = {}
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "workers": self.workers if self._tasks else 0,
+            "active": len(self._active),
+            "by_status": by_status,
+            "process": counters,
+        }
+
+
+job_queue = JobQueue()
+
+
+def job_stats() -> dict:
+    return job_queue.stats()
+
+
+__all__ = ["JobQueue", "job_queue", "job_stats"]
@@ -0,0 +1,262 @@
+"""Tolerant JSON extraction for model answers.
+
+One implementation for every caller (structured output, providers, document
+analysis). Extraction is tiered so the common case costs one C-level parse:
+
+1. `json.loads` on the stripped text;
+2. `raw_decode` from the first `{` outside code fences, so prose before or
+   after the object ("Dưới đây là kết quả:", grounding notes) is skipped
+   without walking characters in Python;
+3. the same after a regex pass that drops trailing commas, with a non-strict
+   decoder that accepts raw newlines/tabs inside strings;
+4. closing a truncated object (output cut at max_output_tokens), last resort.
+
+`coerce_to_model` then maps the result onto a Pydantic model (list/str
+coercion of present fields, optional filling of missing ones).
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+from typing import Any, Optional, Union, get_args, get_origin
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Appends first-pass failures (raw model text) as JSONL, the format of benchmarks/json_corpus.jsonl
+JSON_EXTRACT_CAPTURE_PATH = os.getenv("JSON_EXTRACT_CAPTURE_PATH")
+JSON_EXTRACT_CAPTURE_MAX_BYTES = int(os.getenv("JSON_EXTRACT_CAPTURE_MAX_BYTES", 5 * 1024 * 1024))
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?[ \t]*")
+# A string literal (kept as is) or a comma that only precedes a closing bracket (dropped)
+_TRAILING_COMMA_RE = re.compile(r'("(?:[^"\\]|\\.)*")|,\s*(?=[}\]])', re.S)
+_STRICT = json.JSONDecoder()
+_LENIENT = json.JSONDecoder(strict=False)
+# Objects further into the text are tried only when earlier '{' don't start one
+_MAX_STARTS = 16
+
+_capture_lock = threading.Lock()
+
+
+class JSONExtractError(ValueError):
+    """No JSON value could be recovered from the text."""
+
+
+def strip_fences(text: str) -> str:
+    return _FENCE_RE.sub("", text.lstrip("\ufeff")).strip()
+
+
+def _drop_trailing_commas(text: str) -> str:
+    return _TRAILING_COMMA_RE.sub(lambda m: m.group(1) or "", text)
+
+
+def _close_truncated(text: str) -> Optional[str]:
+    """Close the strings/brackets left open by a cut-off answer; None if it was not cut off."""
+    stack: list[str] = []
+    in_string = escape = False
+    last_comma = -1
+    comma_stack: list[str] = []
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack:
+                return None
+            stack.pop()
+            if not stack:
+                return None  # complete value; failure was elsewhere
+        elif ch == ",":
+            last_comma, comma_stack = i, list(stack)
+    if not stack:
+        return None
+    if in_string:
+        # Drop a dangling backslash so the added quote isn't escaped
+        tail = (text[:-1] if escape else text) + '"'
+    else:
+        tail = text
+    stripped = tail.rstrip()
+    if stripped.endswith(":"):
+        stripped += " null"
+    elif stripped.endswith(","):
+        stripped = stripped[:-1]
+    candidate = stripped + "".join(reversed(stack))
+    try:
+        _LENIENT.decode(candidate)
+        return candidate
+    except json.JSONDecodeError:
+        pass
+    # Cut inside a key or a bare literal: fall back to the last complete member
+    if last_comma == -1:
+        return None
+    return text[:last_comma] + "".join(reversed(comma_stack))
+
+
+def _decode_at(text: str, start: int, allow_truncated: bool) -> Any:
+    try:
+        return _STRICT.raw_decode(text, start)[0]
+    except json.JSONDecodeError:
+        pass
+    fixed = _drop_trailing_commas(text[start:])
+    try:
+        return _LENIENT.raw_decode(fixed)[0]
+    except json.JSONDecodeError:
+        pass
+    if allow_truncated:
+        closed = _close_truncated(fixed)
+        if closed is not None:
+            try:
+                return _LENIENT.raw_decode(closed)[0]
+            except json.JSONDecodeError:
+                pass
+    raise JSONExtractError(f"no JSON value at offset {start}")
+
+
+def extract_json(text: Optional[str], expect: type = dict, allow_truncated: bool = True) -> Any:
+    """First JSON value of type `expect` (dict or list) found in `text`; raises JSONExtractError."""
+    if not text or not text.strip():
+        raise JSONExtractError("empty text")
+    cleaned = strip_fences(text)
+    try:
+        value = json.loads(cleaned)
+    except json.JSONDecodeError:
+        value = None
+        opener = "{" if expect is dict else "["
+        start = cleaned.find(opener)
+        for _ in range(_MAX_STARTS):
+            if start == -1:
+                break
+            try:
+                value = _decode_at(cleaned, start, allow_truncated)
+                break
+            except JSONExtractError:
+                start = cleaned.find(opener, start + 1)
+        if value is None:
+            raise JSONExtractError("no JSON object found" if expect is dict else "no JSON array found")
+    # Some answers wrap the single requested object in a list
+    if expect is dict and isinstance(value, list) and len(value) == 1 and isinstance(value[0], dict):
+        value = value[0]
+    if not isinstance(value, expect):
+        raise JSONExtractError(f"expected a JSON {expect.__name__}, got {type(value).__name__}")
+    return value
+
+
+def extract_object(text: Optional[str], allow_truncated: bool = True) -> dict:
+    return extract_json(text, dict, allow_truncated)
+
+
+# ---------- normalization ----------
+def ensure_list_of_str(v) -> list[str]:
+    if v is None:
+        return []
+    if isinstance(v, list):
+        return [str(x) for x in v]
+    if isinstance(v, str):
+        # try splitting by newline or comma if it looks like a single string list
+        if "\n" in v:
+            return [s.strip() for s in v.splitlines() if s.strip()]
+        if "," in v:
+            return [s.strip() for s in v.split(",") if s.strip()]
+        return [v]
+    # fallback: stringify
+    return [str(v)]
+
+
+def ensure_str(v, default: str = "Chưa xác định") -> str:
+    if v is None:
+        return default
+    if isinstance(v, str):
+        return v
+    if isinstance(v, list):
+        return ", ".join(str(x) for x in v)
+    if isinstance(v, dict):
+        # Prefer a concise representation
+        try:
+            return json.dumps(v, ensure_ascii=False)
+        except Exception:
+            return str(v)
+    return str(v)
+
+
+def _field_kind(annotation: Any) -> tuple[str, Any]:
+    # Unwrap Optional[X]
+    if get_origin(annotation) is Union:
+        args = [a for a in get_args(annotation) if a is not type(None)]
+        if len(args) == 1:
+            annotation = args[0]
+    if annotation is str:
+        return "str", None
+    if get_origin(annotation) is list and get_args(annotation) in ((str,), ()):
+        return "list_str", None
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return "model", annotation
+    return "other", None
+
+
+def coerce_to_model(model: type[BaseModel], data: dict, fill_missing: bool = False) -> dict:
+    """Coerce the fields of `data` towards `model`'s types (lists of str, str, nested models).
+
+    Present values are converted (a comma/newline string becomes a list, a list
+    becomes a joined string). Missing required fields are only filled when
+    `fill_missing` is set, so validation can still flag a genuinely incomplete answer.
+    """
+    out = dict(data)
+    for name, field in model.model_fields.items():
+        kind, sub = _field_kind(field.annotation)
+        present = out.get(name) is not None
+        if not present and not (fill_missing and field.is_required()):
+            continue
+        if kind == "str":
+            out[name] = ensure_str(out.get(name))
+        elif kind == "list_str":
+            out[name] = ensure_list_of_str(out.get(name))
+        elif kind == "model":
+            value = out.get(name)
+            if isinstance(value, dict) or not present:
+                out[name] = coerce_to_model(sub, value if isinstance(value, dict) else {}, fill_missing)
+    return out
+
+
+# ---------- corpus capture ----------
+def capture_sample(text: str, operation: str = "", error: str = "") -> None:
+    """Record a raw answer that failed first-pass parsing (JSON_EXTRACT_CAPTURE_PATH)."""
+    if not JSON_EXTRACT_CAPTURE_PATH or not text:
+        return
+    line = json.dumps({
+        "id": f"captured-{int(time.time() * 1000)}",
+        "operation": operation,
+        "kind": "captured",
+        "error": error,
+        "text": text,
+    }, ensure_ascii=False)
+    try:
+        with _capture_lock:
+            if os.path.exists(JSON_EXTRACT_CAPTURE_PATH) and os.path.getsize(JSON_EXTRACT_CAPTURE_PATH) > JSON_EXTRACT_CAPTURE_MAX_BYTES:
+                return
+            with open(JSON_EXTRACT_CAPTURE_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        logger.debug("JSON sample capture failed: %s", e)
+
+
+__all__ = [
+    "JSONExtractError",
+    "strip_fences",
+    "extract_json",
+    "extract_object",
+    "ensure_list_of_str",
+    "ensure_str",
+    "coerce_to_model",
+    "capture_sample",
+]
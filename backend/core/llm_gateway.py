@@ -0,0 +1,572 @@
+"""Single entry point for Gemini text calls.
+
+Every core module used to carry its own retry/fallback loop. The gateway keeps
+one circuit breaker per model name (closed -> open -> half-open) and applies one
+shared, env-configurable retry policy, so a model that is known to be down is
+skipped instead of being rediscovered by every request.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Optional, Sequence
+
+from core.ai_clients import (
+    get_llm_provider,
+    LLMUnavailableError,
+    LLMQueueTimeout,
+    llm_slot,
+    allm_slot,
+    estimate_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Hedging: fixed delay if set, else the running p90 once enough samples exist
+_hedge_delay_env = os.getenv("LLM_HEDGE_DELAY_SECONDS")
+LLM_HEDGE_DELAY_SECONDS: Optional[float] = float(_hedge_delay_env) if _hedge_delay_env else None
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", 12.0))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+
+
+class CircuitBreaker:
+    """Per-model health tracker.
+
+    After `failure_threshold` consecutive transient failures the circuit opens and
+    calls are rejected for `reset_timeout` seconds. Then exactly one probe is let
+    through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, model: str, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.model = model
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+            # Half-open: only a single probe at a time
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("Circuit for model '%s' closed again", self.model)
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    logger.warning("Circuit for model '%s' opened after %d failure(s)", self.model, self._failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Give back a half-open probe slot without judging model health."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def snapshot(self) -> dict:
+        return {
+            "model": self.model,
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retry_after": round(self.retry_after(), 1),
+        }
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    attempts_per_model: int = 2
+    base_delay: float = 2.0
+    max_delay: float = 8.0
+    jitter: float = 0.5
+    transient_markers: tuple = (
+        "503", "429", "UNAVAILABLE", "RESOURCE_EXHAUSTED", "DEADLINE_EXCEEDED",
+        "overloaded", "timeout", "temporarily",
+    )
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(
+            max_attempts=int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", 4)),
+            attempts_per_model=int(os.getenv("LLM_RETRY_ATTEMPTS_PER_MODEL", 2)),
+            base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", 2.0)),
+            max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", 8.0)),
+        )
+
+    def is_transient(self, error: BaseException) -> bool:
+        code = getattr(error, "code", None) or getattr(error, "status_code", None)
+        if code in (429, 500, 502, 503, 504):
+            return True
+        msg = str(error)
+        return any(t in msg for t in self.transient_markers)
+
+    def delay(self, attempt: int) -> float:
+        return min(self.base_delay * (2 ** (attempt - 1)) + random.uniform(0, self.jitter), self.max_delay)
+
+
+class LatencyWindow:
+    """Rolling window of successful call latencies for one (operation, model)."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+@dataclass(frozen=True)
+class ModelCandidate:
+    """One entry of a fallback chain: a model name plus the config to call it with."""
+    model: str
+    config: Any = None
+
+
+class LLMGateway:
+    def __init__(self, policy: Optional[RetryPolicy] = None, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._latency: dict[tuple[str, str], LatencyWindow] = {}
+        self._hedges: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            b = self._breakers.get(model)
+            if b is None:
+                b = CircuitBreaker(model, self.failure_threshold, self.reset_timeout)
+                self._breakers[model] = b
+            return b
+
+    def health(self) -> list[dict]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [b.snapshot() for b in breakers]
+
+    # ---------- latency ----------
+    def record_latency(self, operation: str, model: str, seconds: float) -> None:
+        key = (operation, model)
+        with self._lock:
+            window = self._latency.get(key)
+            if window is None:
+                window = LatencyWindow()
+                self._latency[key] = window
+        window.add(seconds)
+
+    def latency_quantile(self, operation: str, model: str, q: float, min_samples: int = 1) -> Optional[float]:
+        window = self._latency.get((operation, model))
+        if window is None or len(window) < min_samples:
+            return None
+        return window.quantile(q)
+
+    def latency_stats(self) -> list[dict]:
+        with self._lock:
+            items = list(self._latency.items())
+        return [
+            {
+                "operation": op,
+                "model": model,
+                "samples": len(w),
+                "p50_seconds": round(w.quantile(0.5) or 0.0, 3),
+                "p90_seconds": round(w.quantile(0.9) or 0.0, 3),
+            }
+            for (op, model), w in items
+        ]
+
+    @staticmethod
+    def is_available() -> bool:
+        return get_llm_provider().is_available()
+
+    # ---------- plan ----------
+    def _plan(self, candidates: Sequence[ModelCandidate], attempts_per_model: Optional[int] = None) -> "_CallPlan":
+        return _CallPlan(self, candidates, attempts_per_model or self.policy.attempts_per_model)
+
+    def _unavailable(self, candidates: Sequence[ModelCandidate]) -> LLMUnavailableError:
+        waits = [self.breaker(c.model).retry_after() for c in candidates]
+        retry_after = min(waits) if waits else None
+        models = ", ".join(dict.fromkeys(c.model for c in candidates))
+        return LLMUnavailableError(f"All candidate models are unavailable: {models}", retry_after=retry_after or None)
+
+    def _on_error(self, plan: "_CallPlan", breaker: CircuitBreaker, cand: ModelCandidate, attempt: int, error: Exception) -> None:
+        """Update breaker state and tell the plan whether the same model is worth retrying."""
+        if self.policy.is_transient(error):
+            breaker.record_failure()
+            logger.info("Gemini call failed (attempt %d, model=%s): %s", attempt, cand.model, error)
+            plan.backoff(self.policy.delay(attempt))
+            return
+        breaker.release_probe()
+        logger.warning("Gemini call failed (attempt %d, model=%s): %s", attempt, cand.model, error)
+        # Non-transient (bad config, invalid argument...): retrying the same call won't help
+        plan.skip_candidate()
+
+    # ---------- sync ----------
+    def generate_content(
+        self,
+        candidates: Sequence[ModelCandidate],
+        contents: Any,
+        operation: str = "",
+        attempts_per_model: Optional[int] = None,
+    ) -> Any:
+        """Call the first healthy candidate, falling back through the chain.
+
+        Returns the first response carrying text, else the last response received.
+        Raises the last error if every attempt raised, or LLMUnavailableError if
+        no attempt could be made because all circuits are open.
+        """
+        provider = get_llm_provider()
+        response = None
+        last_error: Optional[Exception] = None
+        attempted = False
+        tokens = estimate_tokens(contents)
+        plan = self._plan(candidates, attempts_per_model)
+        for attempt, cand, breaker in plan:
+            attempted = True
+            if plan.pending_delay:
+                time.sleep(plan.pending_delay)
+            try:
+                with llm_slot(provider.text_limiter, cand.model, tokens, operation=operation, attempt=attempt) as call:
+                    started = time.monotonic()
+                    response = call.response = provider.generate(cand.model, contents, cand.config, operation)
+                    self.record_latency(operation, cand.model, time.monotonic() - started)
+            except LLMQueueTimeout:
+                # Our own backpressure, not a model failure: keep breaker state untouched
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                last_error = e
+                self._on_error(plan, breaker, cand, attempt, e)
+                continue
+            breaker.record_success()
+            if response is not None and getattr(response, "text", None):
+                return response
+            logger.warning("Empty response text from Gemini (op=%s, model=%s)", operation, cand.model)
+        if not attempted:
+            raise self._unavailable(candidates)
+        if response is None and last_error is not None:
+            raise last_error
+        return response
+
+    # ---------- async ----------
+    async def agenerate_content(
+        self,
+        candidates: Sequence[ModelCandidate],
+        contents: Any,
+        operation: str = "",
+        attempts_per_model: Optional[int] = None,
+    ) -> Any:
+        """Async twin of `generate_content` using the provider's async path and `asyncio.sleep` backoff."""
+        provider = get_llm_provider()
+        response = None
+        last_error: Optional[Exception] = None
+        attempted = False
+        tokens = estimate_tokens(contents)
+        plan = self._plan(candidates, attempts_per_model)
+        for attempt, cand, breaker in plan:
+            attempted = True
+            if plan.pending_delay:
+                await asyncio.sleep(plan.pending_delay)
+            try:
+                async with allm_slot(provider.text_limiter, cand.model, tokens, operation=operation, attempt=attempt) as call:
+                    started = time.monotonic()
+                    response = call.response = await provider.agenerate(cand.model, contents, cand.config, operation)
+                    self.record_latency(operation, cand.model, time.monotonic() - started)
+            except LLMQueueTimeout:
+                breaker.release_probe()
+                raise
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # Cancelled mid-call: don't leave a half-open probe hanging
+                    breaker.release_probe()
+                    raise
+                last_error = e
+                self._on_error(plan, breaker, cand, attempt, e)
+                continue
+            breaker.record_success()
+            if response is not None and getattr(response, "text", None):
+                return response
+            logger.warning("Empty response text from Gemini (op=%s, model=%s)", operation, cand.model)
+        if not attempted:
+            raise self._unavailable(candidates)
+        if response is None and last_error is not None:
+            raise last_error
+        return response
+
+    async def astream_content(
+        self,
+        candidates: Sequence[ModelCandidate],
+        contents: Any,
+        operation: str = "",
+        attempts_per_model: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """Stream text chunks from the first healthy candidate.
+
+        Failover to the next attempt only happens before the first chunk is
+        yielded; once text has reached the caller an error is re-raised as-is.
+        """
+        provider = get_llm_provider()
+        last_error: Optional[Exception] = None
+        attempted = False
+        tokens = estimate_tokens(contents)
+        plan = self._plan(candidates, attempts_per_model)
+        for attempt, cand, breaker in plan:
+            attempted = True
+            if plan.pending_delay:
+                await asyncio.sleep(plan.pending_delay)
+            started = False
+            try:
+                async with allm_slot(provider.text_limiter, cand.model, tokens, operation=operation, attempt=attempt) as call:
+                    async for text in provider.astream(cand.model, contents, cand.config, operation):
+                        started = True
+                        call.streamed_chars += len(text)
+                        yield text
+            except LLMQueueTimeout:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                if started:
+                    if self.policy.is_transient(e):
+                        breaker.record_failure()
+                    else:
+                        breaker.release_probe()
+                    raise
+                last_error = e
+                self._on_error(plan, breaker, cand, attempt, e)
+                continue
+            except BaseException:
+                # Consumer went away (GeneratorExit / cancellation)
+                breaker.release_probe()
+                raise
+            breaker.record_success()
+            if started:
+                return
+            logger.warning("Empty streamed response from Gemini (op=%s, model=%s)", operation, cand.model)
+        if not attempted:
+            raise self._unavailable(candidates)
+        if last_error is not None:
+            raise last_error
+
+    # ---------- hedging ----------
+    def hedge_delay(self, operation: str, model: str) -> float:
+        """Fixed LLM_HEDGE_DELAY_SECONDS if set, else the running p90 of `model` for `operation`."""
+        if LLM_HEDGE_DELAY_SECONDS is not None:
+            return LLM_HEDGE_DELAY_SECONDS
+        p90 = self.latency_quantile(operation, model, 0.9, min_samples=LLM_HEDGE_MIN_SAMPLES)
+        return p90 if p90 is not None else LLM_HEDGE_DEFAULT_DELAY
+
+    def _hedge_counters(self, operation: str) -> dict[str, int]:
+        with self._lock:
+            counters = self._hedges.get(operation)
+            if counters is None:
+                counters = dict.fromkeys(
+                    ("calls", "hedges_started", "primary_wins", "hedge_wins", "fallback_wins", "failures"), 0
+                )
+                self._hedges[operation] = counters
+            return counters
+
+    def hedge_stats(self) -> dict[str, dict]:
+        with self._lock:
+            items = [(op, dict(c)) for op, c in self._hedges.items()]
+        out = {}
+        for op, c in items:
+            started = c["hedges_started"]
+            c["hedge_win_ratio"] = round(c["hedge_wins"] / started, 3) if started else 0.0
+            out[op] = c
+        return out
+
+    async def ahedge(
+        self,
+        candidates: Sequence[ModelCandidate],
+        contents: Any,
+        accept: Callable[[Any], Any],
+        operation: str = "",
+        delay: Optional[float] = None,
+    ) -> Any:
+        """Race candidates for tail latency and return the first accepted value.
+
+        `candidates[0]` starts immediately. If nothing acceptable has arrived
+        after `delay` seconds (default: `hedge_delay`), the next candidate is
+        started in parallel; further candidates only start when every running
+        leg has failed. `accept(response)` returns the parsed value, or None to
+        reject it (e.g. unparseable JSON). Losing legs are cancelled.
+        Returns None if a response arrived but none was accepted; otherwise
+        raises the last error.
+        """
+        if not candidates:
+            raise ValueError("ahedge needs at least one candidate")
+        if delay is None:
+            delay = self.hedge_delay(operation, candidates[0].model)
+        counters = self._hedge_counters(operation)
+        with self._lock:
+            counters["calls"] += 1
+
+        legs: dict[asyncio.Task, int] = {}
+        next_idx = 0
+        hedge_idx: Optional[int] = None
+        rejected = False
+        last_error: Optional[BaseException] = None
+
+        def launch() -> int:
+            nonlocal next_idx
+            idx = next_idx
+            next_idx += 1
+            task = asyncio.ensure_future(
+                self.agenerate_content([candidates[idx]], contents, operation=operation, attempts_per_model=1)
+            )
+            legs[task] = idx
+            return idx
+
+        launch()
+        try:
+            while legs:
+                timeout = delay if hedge_idx is None and next_idx < len(candidates) else None
+                done, _ = await asyncio.wait(legs, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_idx = launch()
+                    with self._lock:
+                        counters["hedges_started"] += 1
+                    logger.info("Hedging %s: started %s after %.2fs", operation, candidates[hedge_idx].model, delay)
+                    continue
+                for task in done:
+                    idx = legs.pop(task)
+                    try:
+                        value = accept(task.result())
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if value is None:
+                        rejected = True
+                        continue
+                    outcome = "primary_wins" if idx == 0 else "hedge_wins" if idx == hedge_idx else "fallback_wins"
+                    with self._lock:
+                        counters[outcome] += 1
+                    return value
+                if not legs and next_idx < len(candidates):
+                    launch()
+        finally:
+            for task in legs:
+                task.cancel()
+            if legs:
+                await asyncio.gather(*legs, return_exceptions=True)
+
+        with self._lock:
+            counters["failures"] += 1
+        if rejected or last_error is None:
+            return None
+        raise last_error
+
+
+class _CallPlan:
+    """Iterates (attempt_no, candidate, breaker) under the retry policy.
+
+    Candidates whose circuit is open are skipped. `pending_delay` is the backoff
+    to honour before the next attempt and is only non-zero when that attempt
+    re-tries the model that just failed (switching models needs no backoff).
+    """
+
+    def __init__(self, gw: LLMGateway, candidates: Sequence[ModelCandidate], attempts_per_model: int):
+        self._gw = gw
+        self._candidates = list(candidates)
+        self._attempts_per_model = attempts_per_model
+        self._skip = False
+        self._delay = 0.0
+        self._last_model: Optional[str] = None
+        self.pending_delay = 0.0
+
+    def skip_candidate(self) -> None:
+        self._skip = True
+
+    def backoff(self, delay: float) -> None:
+        self._delay = delay
+
+    def __iter__(self):
+        policy = self._gw.policy
+        attempt = 0
+        for cand in self._candidates:
+            b = self._gw.breaker(cand.model)
+            self._skip = False
+            for _ in range(self._attempts_per_model):
+                if attempt >= policy.max_attempts or self._skip:
+                    break
+                if not b.allow_request():
+                    break
+                attempt += 1
+                self.pending_delay = self._delay if cand.model == self._last_model else 0.0
+                self._delay = 0.0
+                self._last_model = cand.model
+                yield attempt, cand, b
+            if attempt >= policy.max_attempts:
+                return
+
+
+gateway = LLMGateway(
+    policy=RetryPolicy.from_env(),
+    failure_threshold=int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", 3)),
+    reset_timeout=float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30)),
+)
+
+
+__all__ = [
+    "LLMUnavailableError",
+    "CircuitBreaker",
+    "RetryPolicy",
+    "ModelCandidate",
+    "LatencyWindow",
+    "LLMGateway",
+    "gateway",
+]
@@ -0,0 +1,299 @@
+"""Per-call accounting for model calls: latency, tokens, estimated cost, outcome.
+
+Every call made under `llm_slot` / `allm_slot` (core/ai_clients.py) produces
+one `LLMCall`. Calls are aggregated in-process into counters and latency
+histograms (served as Prometheus text at /api/metrics) and, when
+LLM_CALL_LOG_PATH is set, appended as JSON lines to a size-rotated local log
+together with the id and path of the HTTP request that triggered them.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from logging.handlers import RotatingFileHandler
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# USD per 1M tokens. Override/extend with LLM_PRICING_JSON='{"model": {"input": .., "output": .., "cached": ..}}'
+PRICING: dict[str, dict[str, float]] = {
+    "gemini-2.5-flash": {"input": 0.30, "output": 2.50, "cached": 0.075},
+    "gemini-1.5-flash": {"input": 0.075, "output": 0.30, "cached": 0.01875},
+    "gemini-1.5-flash-8b": {"input": 0.0375, "output": 0.15, "cached": 0.01},
+    "gpt-image-1": {"input": 5.00, "output": 40.00, "cached": 1.25},
+}
+try:
+    PRICING.update(json.loads(os.getenv("LLM_PRICING_JSON", "") or "{}"))
+except ValueError:
+    logger.warning("Ignoring invalid LLM_PRICING_JSON")
+
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+
+# Set per HTTP request by the middleware in main.py
+_request_ctx: contextvars.ContextVar[tuple[str, str]] = contextvars.ContextVar("llm_request_ctx", default=("", ""))
+
+
+def bind_request(request_id: str, route: str) -> contextvars.Token:
+    return _request_ctx.set((request_id, route))
+
+
+def reset_request(token: contextvars.Token) -> None:
+    _request_ctx.reset(token)
+
+
+class LLMCall:
+    """One model call; the caller attaches `response` (or `streamed_chars`) before the slot exits."""
+
+    def __init__(self, provider: str, model: Optional[str], operation: str = "", attempt: int = 1, estimated_prompt_tokens: float = 0):
+        self.provider = provider
+        self.model = model or ""
+        self.operation = operation or "unknown"
+        self.attempt = attempt
+        self.estimated_prompt_tokens = int(estimated_prompt_tokens)
+        self.response: Any = None
+        self.streamed_chars = 0
+        self.outcome = "ok"
+        self.error: Optional[str] = None
+        self.request_id, self.route = _request_ctx.get()
+        self._started: Optional[float] = None
+        self.latency_seconds = 0.0
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+
+    def finish(self, error: Optional[BaseException] = None, outcome: Optional[str] = None) -> None:
+        if self._started is not None:
+            self.latency_seconds = time.monotonic() - self._started
+        if outcome:
+            self.outcome = outcome
+        elif error is not None:
+            self.outcome = "error" if isinstance(error, Exception) else "cancelled"
+        elif not self._has_output():
+            self.outcome = "empty"
+        if error is not None:
+            self.error = type(error).__name__
+
+    def _has_output(self) -> bool:
+        if self.streamed_chars:
+            return True
+        r = self.response
+        if r is None:
+            return False
+        if getattr(r, "data", None):
+            return True
+        return bool(getattr(r, "text", None))
+
+    def usage(self) -> tuple[int, int, int, bool]:
+        """(prompt, output, cached, estimated) token counts from the provider's usage block."""
+        r = self.response
+        meta = getattr(r, "usage_metadata", None)
+        if meta is not None:
+            prompt = getattr(meta, "prompt_token_count", None) or 0
+            output = (getattr(meta, "candidates_token_count", None) or 0) + (getattr(meta, "thoughts_token_count", None) or 0)
+            cached = getattr(meta, "cached_content_token_count", None) or 0
+            return int(prompt), int(output), int(cached), False
+        usage = getattr(r, "usage", None)
+        if usage is not None:
+            prompt = getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", None) or 0
+            output = getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", None) or 0
+            return int(prompt), int(output), 0, False
+        # No usage block (streams, legacy SDK): fall back to ~4 chars/token
+        output = self.streamed_chars // 4 if self.streamed_chars else len(getattr(r, "text", None) or "") // 4
+        return self.estimated_prompt_tokens, output, 0, True
+
+    def cost_usd(self, prompt: int, output: int, cached: int) -> float:
+        price = PRICING.get(self.model)
+        if not price:
+            return 0.0
+        uncached = max(0, prompt - cached)
+        return (
+            uncached * price.get("input", 0.0)
+            + cached * price.get("cached", price.get("input", 0.0))
+            + output * price.get("output", 0.0)
+        ) / 1_000_000
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class LLMMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: dict[tuple, int] = {}       # (provider, model, operation, outcome)
+        self.tokens: dict[tuple, int] = {}      # (provider, model, operation, kind)
+        self.cost: dict[tuple, float] = {}      # (provider, model, operation)
+        self.latency: dict[tuple, _Histogram] = {}
+        self.structured: dict[tuple, int] = {}  # (operation, outcome): ok / repaired / failed / empty
+        self._log = self._open_log()
+
+    @staticmethod
+    def _open_log() -> Optional[logging.Logger]:
+        path = os.getenv("LLM_CALL_LOG_PATH")
+        if not path:
+            return None
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=int(os.getenv("LLM_CALL_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+                backupCount=int(os.getenv("LLM_CALL_LOG_BACKUPS", 5)),
+                encoding="utf-8",
+            )
+        except Exception as e:
+            logger.warning("LLM call log disabled (%s): %s", path, e)
+            return None
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        call_log = logging.getLogger("llm_calls")
+        call_log.setLevel(logging.INFO)
+        call_log.propagate = False
+        call_log.addHandler(handler)
+        return call_log
+
+    def record(self, call: LLMCall) -> None:
+        prompt, output, cached, estimated = call.usage()
+        cost = call.cost_usd(prompt, output, cached)
+        key = (call.provider, call.model, call.operation)
+        with self._lock:
+            ck = key + (call.outcome,)
+            self.calls[ck] = self.calls.get(ck, 0) + 1
+            for kind, n in (("prompt", prompt), ("output", output), ("cached", cached)):
+                if n:
+                    tk = key + (kind,)
+                    self.tokens[tk] = self.tokens.get(tk, 0) + n
+            self.cost[key] = self.cost.get(key, 0.0) + cost
+            if call.latency_seconds:
+                self.latency.setdefault(key, _Histogram()).observe(call.latency_seconds)
+        if self._log is not None:
+            self._log.info(json.dumps({
+                "ts": round(time.time(), 3),
+                "request_id": call.request_id,
+                "route": call.route,
+                "provider": call.provider,
+                "model": call.model,
+                "operation": call.operation,
+                "attempt": call.attempt,
+                "outcome": call.outcome,
+                "error": call.error,
+                "latency_seconds": round(call.latency_seconds, 4),
+                "prompt_tokens": prompt,
+                "output_tokens": output,
+                "cached_tokens": cached,
+                "tokens_estimated": estimated,
+                "cost_usd": round(cost, 6),
+            }, ensure_ascii=False))
+
+    def record_structured(self, operation: str, outcome: str) -> None:
+        key = (operation or "unknown", outcome)
+        with self._lock:
+            self.structured[key] = self.structured.get(key, 0) + 1
+
+    # ---------- export ----------
+    def render_prometheus(self) -> str:
+        def labels(provider, model, operation, **extra) -> str:
+            pairs = {"provider": provider, "model": model, "operation": operation, **extra}
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs.items()) + "}"
+
+        with self._lock:
+            calls = dict(self.calls)
+            tokens = dict(self.tokens)
+            cost = dict(self.cost)
+            latency = {k: (list(h.buckets), h.count, h.sum) for k, h in self.latency.items()}
+            structured = dict(self.structured)
+
+        lines = [
+            "# HELP llm_calls_total Model calls by outcome.",
+            "# TYPE llm_calls_total counter",
+        ]
+        for (p, m, op, outcome), n in sorted(calls.items()):
+            lines.append(f"llm_calls_total{labels(p, m, op, outcome=outcome)} {n}")
+        lines += ["# HELP llm_tokens_total Tokens reported by the provider (or estimated).", "# TYPE llm_tokens_total counter"]
+        for (p, m, op, kind), n in sorted(tokens.items()):
+            lines.append(f"llm_tokens_total{labels(p, m, op, kind=kind)} {n}")
+        lines += ["# HELP llm_cost_usd_total Estimated spend from the PRICING table.", "# TYPE llm_cost_usd_total counter"]
+        for (p, m, op), usd in sorted(cost.items()):
+            lines.append(f"llm_cost_usd_total{labels(p, m, op)} {usd:.6f}")
+        lines += ["# HELP llm_call_latency_seconds Model call latency (excludes limiter queueing).", "# TYPE llm_call_latency_seconds histogram"]
+        for (p, m, op), (buckets, count, total) in sorted(latency.items()):
+            for bound, n in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"llm_call_latency_seconds_bucket{labels(p, m, op, le=str(bound))} {n}")
+            lines.append(f"llm_call_latency_seconds_bucket{labels(p, m, op, le='+Inf')} {count}")
+            lines.append(f"llm_call_latency_seconds_sum{labels(p, m, op)} {total:.6f}")
+            lines.append(f"llm_call_latency_seconds_count{labels(p, m, op)} {count}")
+        lines += ["# HELP llm_structured_output_total Structured (JSON) answers by parse outcome.", "# TYPE llm_structured_output_total counter"]
+        for (op, outcome), n in sorted(structured.items()):
+            lines.append(f'llm_structured_output_total{{operation="{_escape(op)}",outcome="{_escape(outcome)}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list[dict]:
+        """Per (model, operation) totals, most expensive first."""
+        with self._lock:
+            rows: dict[tuple, dict] = {}
+            for (p, m, op, outcome), n in self.calls.items():
+                row = rows.setdefault((p, m, op), {"provider": p, "model": m, "operation": op, "calls": 0, "errors": 0})
+                row["calls"] += n
+                if outcome != "ok":
+                    row["errors"] += n
+            for (p, m, op, kind), n in self.tokens.items():
+                rows.setdefault((p, m, op), {"provider": p, "model": m, "operation": op, "calls": 0, "errors": 0})[f"{kind}_tokens"] = n
+            for key, row in rows.items():
+                row["cost_usd"] = round(self.cost.get(key, 0.0), 6)
+                h = self.latency.get(key)
+                row["avg_latency_seconds"] = round(h.sum / h.count, 3) if h and h.count else 0.0
+        return sorted(rows.values(), key=lambda r: r["cost_usd"], reverse=True)
+
+    def structured_stats(self) -> dict:
+        """Per operation: parse outcomes, share needing a repair call, share wasted (no usable answer)."""
+        with self._lock:
+            counts = dict(self.structured)
+        out: dict[str, dict] = {}
+        for (op, outcome), n in counts.items():
+            out.setdefault(op, {"ok": 0, "repaired": 0, "failed": 0, "empty": 0})[outcome] = n
+        for row in out.values():
+            total = sum(row.values())
+            row["parse_failure_rate"] = round((row["repaired"] + row["failed"]) / total, 4) if total else 0.0
+            row["wasted_rate"] = round((row["failed"] + row["empty"]) / total, 4) if total else 0.0
+        return out
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = LLMMetrics()
+
+
+def record_structured(operation: str, outcome: str) -> None:
+    metrics.record_structured(operation, outcome)
+
+
+def record_call(call: LLMCall) -> None:
+    try:
+        metrics.record(call)
+    except Exception as e:
+        # Accounting must never break the call path
+        logger.warning("Failed to record LLM call metrics: %s", e)
+
+
+__all__ = [
+    "LLMCall",
+    "LLMMetrics",
+    "PRICING",
+    "metrics",
+    "record_call",
+    "record_structured",
+    "bind_request",
+    "reset_request",
+]
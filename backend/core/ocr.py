@@ -0,0 +1,243 @@
+"""Text for image-only (scanned) PDF pages, from a pluggable OCR/vision backend.
+
+core.parse_sandbox classifies pages and copies the image-only ones into small
+PDFs (`ScannedPdf.batches`). `transcribe_batches` sends each batch to the
+configured backend and returns the text per page index, which
+core.document_analysis merges back into the native text layer. A 40-page
+catalogue with 4 scanned spec sheets costs 4 pages of vision input, not 40.
+
+Backends (OCR_BACKEND):
+    gemini  Gemini reads the batch PDF and returns one transcript per page (default;
+            answered offline by the fake provider when LLM_PROVIDER=fake)
+    stub    deterministic local text, no model call (tests, benchmarks)
+    none    OCR disabled: image-only pages stay empty
+Other engines (Tesseract, a cloud OCR API) register with `register_ocr_backend`.
+
+Env:
+    OCR_MAX_PAGES         image-only pages sent per document (default 20)
+    OCR_BATCH_PAGES       pages per backend call (default 8)
+    OCR_MAX_BATCH_BYTES   size cap of one batch PDF; larger batches are split, a
+                          single page over the cap is skipped (default 8 MB)
+    OCR_PAGE_CHARS        characters an image-only page is expected to yield, for
+                          the extraction budget (default 1500)
+    OCR_CONCURRENCY       batches in flight per document (default 2)
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from pydantic import BaseModel
+
+from core.ai_clients import LLM_PROVIDER, LLMUnavailableError
+from core.llm_gateway import gateway, ModelCandidate
+from core.structured_output import decode_structured, json_config
+
+logger = logging.getLogger(__name__)
+
+OCR_BACKEND = os.getenv("OCR_BACKEND", "gemini").strip().lower()
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", 20))
+OCR_BATCH_PAGES = int(os.getenv("OCR_BATCH_PAGES", 8))
+OCR_MAX_BATCH_BYTES = int(os.getenv("OCR_MAX_BATCH_BYTES", 8 * 1024 * 1024))
+OCR_PAGE_CHARS = int(os.getenv("OCR_PAGE_CHARS", 1500))
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", 2))
+
+OCR_PROMPT = """
+Tài liệu PDF gửi kèm gồm {n} page(s) được scan (ảnh, không có lớp text).
+Nhiệm vụ: chép lại NGUYÊN VĂN chữ trên từng trang, theo thứ tự đọc.
+
+Quy tắc:
+- Không dịch, không tóm tắt, không thêm nội dung không có trên trang.
+- Bảng: mỗi hàng một dòng, các ô cách nhau bằng " | ".
+- Trang không có chữ: trả về chuỗi rỗng cho trang đó.
+
+Trả về JSON {{"pages": [...]}} với đúng {n} phần tử, theo thứ tự trang.
+"""
+
+
+class OCRPages(BaseModel):
+    pages: list[str]
+
+
+class OCRBackend(ABC):
+    """Turns a PDF of image-only pages into one text per page."""
+
+    name = "base"
+
+    @abstractmethod
+    def transcribe(self, pdf_bytes: bytes, n_pages: int) -> list[str]:
+        raise NotImplementedError
+
+
+class GeminiVisionOCR(OCRBackend):
+    name = "gemini"
+
+    def __init__(self, model: str = "gemini-2.5-flash"):
+        self.model = model
+
+    def transcribe(self, pdf_bytes: bytes, n_pages: int) -> list[str]:
+        # Imported here so the stub backend works without the SDK types
+        from google.genai import types
+
+        contents = [types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"), OCR_PROMPT.format(n=n_pages)]
+        response = gateway.generate_content(
+            [ModelCandidate(self.model, json_config(OCRPages))], contents, operation="ocr_pages"
+        )
+        result = decode_structured(response, OCRPages, "ocr_pages")
+        if result is None:
+            raise ValueError("OCR answer is empty or does not match the schema")
+        pages = result.pages
+        if len(pages) != n_pages:
+            logger.warning("OCR returned %d page(s) for a batch of %d", len(pages), n_pages)
+        return (pages + [""] * n_pages)[:n_pages]
+
+
+class StubOCR(OCRBackend):
+    """Deterministic text, no model call: exercises routing and merging offline."""
+
+    name = "stub"
+
+    def transcribe(self, pdf_bytes: bytes, n_pages: int) -> list[str]:
+        return [f"[OCR] Trang scan {i + 1}/{n_pages}: thông số kỹ thuật, bảo hành 12 tháng." for i in range(n_pages)]
+
+
+_BACKENDS: dict[str, Callable[[], OCRBackend]] = {
+    "gemini": GeminiVisionOCR,
+    "stub": StubOCR,
+}
+_backend_lock = threading.Lock()
+_backend: Optional[OCRBackend] = None
+
+
+def register_ocr_backend(name: str, factory: Callable[[], OCRBackend]) -> None:
+    _BACKENDS[name.lower()] = factory
+
+
+def ocr_enabled() -> bool:
+    return OCR_BACKEND != "none" and OCR_MAX_PAGES > 0
+
+
+def get_ocr_backend() -> Optional[OCRBackend]:
+    """The configured backend (created once), or None when OCR is disabled."""
+    global _backend
+    if not ocr_enabled():
+        return None
+    with _backend_lock:
+        if _backend is None:
+            factory = _BACKENDS.get(OCR_BACKEND)
+            if factory is None:
+                raise ValueError(f"Unknown OCR_BACKEND '{OCR_BACKEND}' (available: {', '.join(sorted(_BACKENDS))})")
+            _backend = factory()
+            logger.info("OCR backend: %s (provider %s)", _backend.name, LLM_PROVIDER)
+        return _backend
+
+
+class _OCRStats:
+    """Pages and bytes sent to the OCR backend, vs the documents' page counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.document_pages = 0
+        self.pages_sent = 0
+        self.bytes_sent = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.skipped_pages = 0
+        self.seconds = 0.0
+
+    def observe(self, n_pages: int, skipped: int) -> None:
+        with self._lock:
+            self.documents += 1
+            self.document_pages += n_pages
+            self.skipped_pages += skipped
+
+    def observe_batch(self, pages: int, size: int, ok: bool, seconds: float) -> None:
+        with self._lock:
+            self.batches += 1
+            self.failed_batches += not ok
+            self.pages_sent += pages
+            self.bytes_sent += size
+            self.seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "backend": OCR_BACKEND,
+                "documents": self.documents,
+                "document_pages": self.document_pages,
+                "pages_sent": self.pages_sent,
+                "page_share": round(self.pages_sent / self.document_pages, 4) if self.document_pages else 0.0,
+                "mb_sent": round(self.bytes_sent / (1024 * 1024), 2),
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "skipped_pages": self.skipped_pages,
+                "avg_batch_seconds": round(self.seconds / self.batches, 3) if self.batches else 0.0,
+            }
+
+
+ocr_stats_tracker = _OCRStats()
+
+
+def _transcribe_one(backend: OCRBackend, indices: list[int], data: bytes) -> Optional[dict[int, str]]:
+    """{page index: text} for one batch; None when the batch failed."""
+    start = time.perf_counter()
+    try:
+        texts = backend.transcribe(data, len(indices))
+    except LLMUnavailableError:
+        # Circuit open / queue deadline: the request gets a 503 instead of a document missing pages
+        ocr_stats_tracker.observe_batch(len(indices), len(data), False, time.perf_counter() - start)
+        raise
+    except Exception as e:
+        # One failed batch loses its pages, not the document
+        logger.warning("OCR batch of %d page(s) failed (%s): %s", len(indices), backend.name, e)
+        ocr_stats_tracker.observe_batch(len(indices), len(data), False, time.perf_counter() - start)
+        return None
+    ocr_stats_tracker.observe_batch(len(indices), len(data), True, time.perf_counter() - start)
+    return {i: t.strip() for i, t in zip(indices, texts) if t and t.strip()}
+
+
+def transcribe_batches(batches: list[tuple[list[int], bytes]], n_pages: int = 0, skipped: int = 0) -> tuple[dict[int, str], int]:
+    """({page index: text}, failed batch count) for the image-only pages in `batches` (page indices, PDF bytes).
+
+    Raises LLMUnavailableError when the model can't take calls; other batch
+    failures only lose that batch's pages and are counted.
+    """
+    backend = get_ocr_backend()
+    if backend is None or not batches:
+        return {}, 0
+    ocr_stats_tracker.observe(n_pages, skipped)
+    logger.info("OCR: %d image-only page(s) of %d in %d batch(es) via %s",
+                sum(len(idx) for idx, _ in batches), n_pages, len(batches), backend.name)
+    out: dict[int, str] = {}
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(OCR_CONCURRENCY, len(batches)))) as pool:
+        # Each batch gets its own copy of the request context (request id for the cost log)
+        futures = [pool.submit(contextvars.copy_context().run, _transcribe_one, backend, idx, data) for idx, data in batches]
+        try:
+            for f in futures:
+                texts = f.result()
+                if texts is None:
+                    failed += 1
+                else:
+                    out.update(texts)
+        except LLMUnavailableError:
+            for f in futures:
+                f.cancel()
+            raise
+    return out, failed
+
+
+def ocr_stats() -> dict:
+    return ocr_stats_tracker.snapshot()
+
+
+__all__ = [
+    "OCRBackend", "GeminiVisionOCR", "StubOCR", "register_ocr_backend", "ocr_enabled",
+    "get_ocr_backend", "transcribe_batches", "ocr_stats",
+    "OCR_MAX_PAGES", "OCR_BATCH_PAGES", "OCR_MAX_BATCH_BYTES", "OCR_PAGE_CHARS",
+]
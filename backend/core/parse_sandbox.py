@@ -0,0 +1,418 @@
+"""PDF/DOCX parsing in a pool of sandboxed worker processes.
+
+pypdf and the DOCX XML parser run untrusted uploads. A malformed or decompression-bomb
+file can spin for minutes or allocate gigabytes. In the request thread that
+takes the API worker down with it. Here each parse runs in a reusable worker
+process with:
+
+- a wall-clock timeout (PARSE_TIMEOUT_SECONDS),
+- an RSS cap (PARSE_MAX_RSS_MB), watched by the parent while it waits, with
+  RLIMIT_AS as a POSIX backstop against allocations between two checks,
+- page and character caps (PARSE_MAX_PAGES, PARSE_MAX_CHARS).
+
+`parse_pdf_scan` also classifies PDF pages and returns the image-only ones as
+small PDF batches for OCR (core.ocr); the batches are cut in the worker, so
+the scan itself is never parsed in the API process either.
+
+A worker that times out, goes over the cap or dies is killed and replaced on
+the next checkout; the caller gets `DocumentRejectedError`. Workers are also
+recycled after PARSE_MAX_JOBS_PER_WORKER parses so a slow leak can't build up.
+PARSE_SANDBOX=0 parses in-process (same caps, no isolation).
+
+Like core.pdf_extract, this module only imports the parsers, so workers
+started with forkserver/spawn don't load the rest of the app.
+"""
+import os
+import time
+import queue
+import shutil
+import logging
+import tempfile
+import threading
+import multiprocessing
+from io import BytesIO
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Optional, Union
+
+from core.pdf_extract import extract_pdf_text, pdf_subset, scan_pdf_pages
+from core.docx_extract import extract_docx_text
+
+logger = logging.getLogger(__name__)
+
+PARSE_SANDBOX = os.getenv("PARSE_SANDBOX", "1") != "0"
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", 2))
+PARSE_TIMEOUT_SECONDS = float(os.getenv("PARSE_TIMEOUT_SECONDS", 30))
+PARSE_MAX_RSS_MB = int(os.getenv("PARSE_MAX_RSS_MB", 512))
+PARSE_MAX_PAGES = int(os.getenv("PARSE_MAX_PAGES", 500))
+# Ceiling when the caller asks for the whole document (max_chars=None)
+PARSE_MAX_CHARS = int(os.getenv("PARSE_MAX_CHARS", 2_000_000))
+PARSE_MAX_JOBS_PER_WORKER = int(os.getenv("PARSE_MAX_JOBS_PER_WORKER", 200))
+# forkserver forks workers from a clean process (no copy of the server's threads)
+PARSE_START_METHOD = os.getenv(
+    "PARSE_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn",
+)
+_WATCH_INTERVAL = 0.05
+_COPY_CHUNK_BYTES = 1024 * 1024
+
+# Uploaded bytes or a seekable binary file (the upload's spooled handle, read in place)
+DocumentSource = Union[bytes, BinaryIO]
+
+
+class DocumentRejectedError(ValueError):
+    """The document broke a sandbox limit; `reason` is timeout, memory or crashed."""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+@dataclass
+class ScannedPdf:
+    """Text layer per page plus the image-only pages, batched as small PDFs for OCR."""
+
+    pages: list[str]
+    n_pages: int
+    batches: list[tuple[list[int], bytes]] = field(default_factory=list)
+    skipped: list[int] = field(default_factory=list)   # image-only pages over the batch byte cap
+
+
+# ---------- parsing (runs in the worker) ----------
+def _scan_pdf(source, max_chars: Optional[int], max_pages: int, options: dict) -> dict:
+    scan = scan_pdf_pages(
+        source, max_chars, max_pages,
+        max_image_pages=options.get("max_image_pages", 0),
+        image_page_chars=options.get("image_page_chars", 1500),
+    )
+    batch_pages = max(1, options.get("batch_pages", 8))
+    max_batch_bytes = options.get("max_batch_bytes", 8 * 1024 * 1024)
+    batches, skipped = [], []
+    pending = [scan.image_only[i:i + batch_pages] for i in range(0, len(scan.image_only), batch_pages)]
+    while pending:
+        group = pending.pop(0)
+        data = pdf_subset(source, group)
+        if len(data) <= max_batch_bytes:
+            batches.append((group, data))
+        elif len(group) == 1:
+            skipped.extend(group)
+        else:
+            # Halve oversized batches; a single page over the cap is left out
+            mid = len(group) // 2
+            pending[:0] = [group[:mid], group[mid:]]
+    return {"pages": scan.pages, "n_pages": scan.n_pages, "batches": batches, "skipped": skipped}
+
+
+def parse_file(file_type: str, source, max_chars: Optional[int], max_pages: int, options: Optional[dict] = None) -> Any:
+    if file_type == "pdf":
+        # Sequential: the sandbox pool already runs documents in parallel
+        return extract_pdf_text(source, max_chars, parallel=False, max_pages=max_pages)
+    if file_type == "pdf_scan":
+        return _scan_pdf(source, max_chars, max_pages, options or {})
+    if file_type == "docx":
+        return extract_docx_text(source, max_chars)
+    raise ValueError(f"Unsupported file type for sandboxed parsing: {file_type}")
+
+
+def _vm_size_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _limit_memory(max_rss_mb: int) -> None:
+    try:
+        import resource
+    except ImportError:  # Windows: the parent's RSS watch is the only limit
+        return
+    # Address space (not RSS): leave headroom over the cap so the watch usually fires first
+    base = _vm_size_mb() or 0.0
+    limit = int((base + 2 * max_rss_mb) * 1024 * 1024)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(conn, max_rss_mb: int) -> None:
+    _limit_memory(max_rss_mb)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        try:
+            conn.send(("ok", parse_file(*job)))
+        except MemoryError:
+            # Heap may be fragmented past the cap; report and exit so the parent starts a fresh worker
+            conn.send(("memory", "allocation failed"))
+            return
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# ---------- pool (parent) ----------
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child, PARSE_MAX_RSS_MB), name="parse-worker", daemon=True)
+        self.process.start()
+        child.close()
+        self.jobs = 0
+
+    def rss_mb(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.process.pid}/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(5)
+        self.conn.close()
+
+
+class ParsePool:
+    """Fixed number of parse workers, started on demand and replaced when killed."""
+
+    def __init__(self, size: int = PARSE_WORKERS):
+        self.size = max(1, size)
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: "queue.LifoQueue[_Worker]" = queue.LifoQueue()
+        self._ctx = None
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        self._busy = 0
+        self._peak_rss_mb = 0.0
+
+    def _context(self):
+        with self._lock:
+            if self._ctx is None:
+                self._ctx = multiprocessing.get_context(PARSE_START_METHOD)
+                if PARSE_START_METHOD == "forkserver":
+                    self._ctx.set_forkserver_preload(["core.parse_sandbox"])
+            return self._ctx
+
+    def _checkout(self, blocking: bool = True) -> Optional[_Worker]:
+        if not self._slots.acquire(blocking):
+            return None
+        try:
+            while True:
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if worker.process.is_alive():
+                    return worker
+                worker.kill()
+            worker = _Worker(self._context())
+            with self._lock:
+                self._stats["started"] += 1
+            return worker
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _checkin(self, worker: _Worker, healthy: bool) -> None:
+        try:
+            if not healthy:
+                worker.kill()
+            elif worker.jobs >= PARSE_MAX_JOBS_PER_WORKER:
+                worker.stop()
+                with self._lock:
+                    self._stats["recycled"] += 1
+            else:
+                self._idle.put(worker)
+        finally:
+            self._slots.release()
+
+    def _watch(self, worker: _Worker, deadline: float):
+        """Wait for the worker's answer; (status, payload) where status is ok/error or a kill reason."""
+        while True:
+            if worker.conn.poll(_WATCH_INTERVAL):
+                try:
+                    return worker.conn.recv()
+                except (EOFError, OSError):
+                    return "crashed", f"worker exited with code {worker.process.exitcode}"
+            if not worker.process.is_alive():
+                return "crashed", f"worker exited with code {worker.process.exitcode}"
+            if time.monotonic() > deadline:
+                return "timeout", f"no result after {PARSE_TIMEOUT_SECONDS:.0f}s"
+            rss = worker.rss_mb()
+            if rss is not None:
+                with self._lock:
+                    self._peak_rss_mb = max(self._peak_rss_mb, rss)
+                if rss > PARSE_MAX_RSS_MB:
+                    return "memory", f"worker RSS {rss:.0f} MB over {PARSE_MAX_RSS_MB} MB"
+
+    def parse(self, file_type: str, path: str, max_chars: Optional[int], max_pages: int = PARSE_MAX_PAGES, options: Optional[dict] = None) -> Any:
+        worker = self._checkout()
+        healthy = False
+        started = time.monotonic()
+        with self._lock:
+            self._busy += 1
+        try:
+            worker.jobs += 1
+            worker.conn.send((file_type, path, max_chars, max_pages, options))
+            status, payload = self._watch(worker, started + PARSE_TIMEOUT_SECONDS)
+            healthy = status in ("ok", "error")
+            with self._lock:
+                self._stats[status] += 1
+            if status == "ok":
+                return payload
+            if status == "error":
+                raise ValueError(payload)
+            logger.warning("Parse worker killed (%s) for %s file: %s", status, file_type, payload)
+            raise DocumentRejectedError(payload, status)
+        finally:
+            with self._lock:
+                self._busy -= 1
+            self._checkin(worker, healthy)
+
+    def warm(self) -> None:
+        """Start the free workers ahead of the first upload (a fresh worker takes seconds to import the parsers)."""
+        workers = []
+        try:
+            # Never waits: slots held by running parses are simply skipped
+            while len(workers) < self.size:
+                worker = self._checkout(blocking=False)
+                if worker is None:
+                    break
+                workers.append(worker)
+        finally:
+            for worker in workers:
+                self._checkin(worker, True)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": PARSE_SANDBOX,
+                "workers": self.size,
+                "busy": self._busy,
+                "idle": self._idle.qsize(),
+                "ok": self._stats["ok"],
+                "errors": self._stats["error"],
+                "rejected": {r: self._stats[r] for r in ("timeout", "memory", "crashed")},
+                "workers_started": self._stats["started"],
+                "workers_recycled": self._stats["recycled"],
+                "peak_worker_rss_mb": round(self._peak_rss_mb, 1),
+                "limits": {
+                    "timeout_seconds": PARSE_TIMEOUT_SECONDS,
+                    "max_rss_mb": PARSE_MAX_RSS_MB,
+                    "max_pages": PARSE_MAX_PAGES,
+                    "max_chars": PARSE_MAX_CHARS,
+                },
+            }
+
+
+parse_pool = ParsePool()
+
+
+def _run(file_type: str, source: DocumentSource, max_chars: Optional[int], options: Optional[dict] = None) -> Any:
+    max_chars = PARSE_MAX_CHARS if max_chars is None else min(max_chars, PARSE_MAX_CHARS)
+    if not PARSE_SANDBOX:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = BytesIO(source)
+        source.seek(0)
+        return parse_file(file_type, source, max_chars, PARSE_MAX_PAGES, options)
+
+    # Workers read a private copy by path; an upload's spooled file has no name to share
+    suffix = "pdf" if file_type == "pdf_scan" else file_type
+    fd, path = tempfile.mkstemp(suffix=f".{suffix}")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                f.write(source)
+            else:
+                source.seek(0)
+                shutil.copyfileobj(source, f, _COPY_CHUNK_BYTES)
+                source.seek(0)
+        return parse_pool.parse(file_type, path, max_chars, options=options)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def parse_document(file_type: str, source: DocumentSource, max_chars: Optional[int] = None) -> str:
+    """Text of a pdf/docx upload, parsed under the sandbox limits.
+
+    Raises DocumentRejectedError when a limit is hit and ValueError when the
+    parser itself fails (malformed file).
+    """
+    return _run(file_type, source, max_chars)
+
+
+def parse_pdf_scan(
+    source: DocumentSource,
+    max_chars: Optional[int] = None,
+    max_image_pages: int = 0,
+    image_page_chars: int = 1500,
+    batch_pages: int = 8,
+    max_batch_bytes: int = 8 * 1024 * 1024,
+) -> ScannedPdf:
+    """PDF text layer per page, with up to `max_image_pages` image-only pages cut into OCR batches.
+
+    Same limits and errors as `parse_document`.
+    """
+    options = {
+        "max_image_pages": max_image_pages,
+        "image_page_chars": image_page_chars,
+        "batch_pages": batch_pages,
+        "max_batch_bytes": max_batch_bytes,
+    }
+    result = _run("pdf_scan", source, max_chars, options)
+    return ScannedPdf(
+        pages=result["pages"],
+        n_pages=result["n_pages"],
+        batches=[(list(idx), data) for idx, data in result["batches"]],
+        skipped=result["skipped"],
+    )
+
+
+def parse_stats() -> dict:
+    return parse_pool.stats()
+
+
+def warm_parse_pool() -> None:
+    if PARSE_SANDBOX:
+        try:
+            parse_pool.warm()
+        except Exception as e:
+            logger.warning("Parse worker warm-up failed: %s", e)
+
+
+def shutdown_parse_pool() -> None:
+    parse_pool.close()
+
+
+__all__ = [
+    "DocumentRejectedError",
+    "DocumentSource",
+    "ScannedPdf",
+    "parse_document",
+    "parse_pdf_scan",
+    "parse_pool",
+    "parse_stats",
+    "shutdown_parse_pool",
+    "warm_parse_pool",
+]
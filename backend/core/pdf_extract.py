@@ -0,0 +1,253 @@
+"""PDF text extraction that stops at a character budget.
+
+`iter_pdf_pages` yields page text lazily (pypdf parses a page only when it is
+read), so a caller that keeps the first 15,000 characters of a 200-page
+catalogue only pays for the first few pages. `extract_pdf_text` joins pages
+until the budget is reached. When the budget is large (or None), it reads the
+first pages itself and hands the rest to a process pool in page ranges. Ranges
+are consumed in order and the pool stops once the budget is met.
+
+`scan_pdf_pages` also classifies pages: a page with (almost) no text layer
+but an image XObject is image-only, i.e. a scan. `pdf_subset` copies just
+those pages into a small PDF for the vision/OCR step (core.ocr).
+
+Sources are `bytes`, a path, or a seekable binary file (an upload's spooled
+handle); a file is read in place rather than copied into memory.
+
+This module only depends on pypdf, so pool workers (spawned on Windows) don't
+import the rest of the app.
+"""
+import os
+import logging
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+from dataclasses import dataclass, field
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, Optional, Union
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except Exception:
+    PdfReader = PdfWriter = None
+
+logger = logging.getLogger(__name__)
+
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))
+# Pages read in-process before fanning out; small documents never touch the pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 24))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 16))
+# Fewer characters than this (after stripping) and the page counts as having no text layer
+PDF_MIN_PAGE_TEXT_CHARS = int(os.getenv("PDF_MIN_PAGE_TEXT_CHARS", 16))
+
+PdfSource = Union[bytes, str, BinaryIO]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _open_reader(source: PdfSource):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return PdfReader(BytesIO(source))
+    if isinstance(source, str):
+        return PdfReader(source)
+    source.seek(0)
+    return PdfReader(source)
+
+
+def _page_text(page) -> str:
+    try:
+        return page.extract_text() or ""
+    except Exception as e:
+        logger.warning("Error extracting PDF page text: %s", e)
+        return ""
+
+
+def iter_pdf_pages(source: PdfSource, start: int = 0) -> Iterator[str]:
+    """Text of each page from `start`, parsed on demand."""
+    reader = _open_reader(source)
+    for i in range(start, len(reader.pages)):
+        yield _page_text(reader.pages[i])
+
+
+def _extract_range(path: str, start: int, stop: int) -> list[str]:
+    # Runs in a pool worker; reads the spooled copy instead of receiving the bytes per task
+    reader = PdfReader(path)
+    return [_page_text(reader.pages[i]) for i in range(start, min(stop, len(reader.pages)))]
+
+
+def _fan_out(source: PdfSource, start: int, n_pages: int, parts: list[str], used: int, max_chars: Optional[int]) -> int:
+    """Extract pages [start, n_pages) in the pool, appending to `parts` in page order."""
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    futures = []
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                f.write(source)
+            elif isinstance(source, str):
+                with open(source, "rb") as src:
+                    shutil.copyfileobj(src, f, 1024 * 1024)
+            else:
+                # Chunked copy; the main-thread reader seeks before every read, so moving the position is safe
+                source.seek(0)
+                shutil.copyfileobj(source, f, 1024 * 1024)
+        pool = _get_pool()
+        ranges = [(s, min(s + PDF_PAGES_PER_TASK, n_pages)) for s in range(start, n_pages, PDF_PAGES_PER_TASK)]
+        # Keep at most one range per worker in flight so an early stop wastes little work
+        window = max(1, PDF_EXTRACT_WORKERS)
+        pending = iter(ranges)
+        for s, e in islice(pending, window):
+            futures.append(pool.submit(_extract_range, path, s, e))
+        while futures:
+            for text in futures.pop(0).result():
+                parts.append(text)
+                used += len(text) + 1
+                if max_chars is not None and used >= max_chars:
+                    return used
+            nxt = next(pending, None)
+            if nxt is not None:
+                futures.append(pool.submit(_extract_range, path, *nxt))
+        return used
+    finally:
+        for fut in futures:
+            fut.cancel()
+        # Workers still reading the file keep it alive on POSIX; on Windows removal may fail until they finish
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def extract_pdf_text(source: PdfSource, max_chars: Optional[int] = None, parallel: bool = True, max_pages: Optional[int] = None) -> str:
+    """Text of a PDF, at most `max_chars` characters (None = whole document) from the first `max_pages` pages."""
+    reader = _open_reader(source)
+    n_pages = len(reader.pages) if max_pages is None else min(len(reader.pages), max_pages)
+    parts: list[str] = []
+    used = 0
+    i = 0
+    while i < n_pages:
+        if parallel and PDF_EXTRACT_WORKERS > 1 and i >= PDF_PARALLEL_MIN_PAGES and n_pages - i > PDF_PAGES_PER_TASK:
+            # Average so far says the budget needs many more pages: read the rest in parallel
+            per_page = used / i if i else 0
+            remaining = (max_chars - used) if max_chars is not None else None
+            if remaining is None or per_page == 0 or remaining / per_page > PDF_PAGES_PER_TASK:
+                try:
+                    used = _fan_out(source, i, n_pages, parts, used, max_chars)
+                    break
+                except Exception as e:
+                    # Broken pool (e.g. a worker killed): finish in-process from the first missing page
+                    logger.warning("Parallel PDF extraction failed, continuing in-process: %s", e)
+                    i = len(parts)
+                    used = sum(len(p) + 1 for p in parts)
+                    parallel = False
+                    continue
+        text = _page_text(reader.pages[i])
+        parts.append(text)
+        used += len(text) + 1
+        i += 1
+        if max_chars is not None and used >= max_chars:
+            break
+    if not any(p.strip() for p in parts):
+        # No text layer at all: callers treat "" as "nothing extracted", not a run of page breaks
+        return ""
+    # Form feed between pages (as pdftotext does) so chunking can cut on page boundaries
+    text = "\f".join(parts)
+    return text[:max_chars] if max_chars is not None else text
+
+
+def _has_image(resources, depth: int = 0) -> bool:
+    try:
+        xobjects = resources.get("/XObject") if resources is not None else None
+        if not xobjects:
+            return False
+        xobjects = xobjects.get_object()
+        for name in xobjects:
+            xobj = xobjects[name].get_object()
+            subtype = xobj.get("/Subtype")
+            if subtype == "/Image":
+                return True
+            # Scanners sometimes wrap the page image in a form XObject
+            if subtype == "/Form" and depth < 2 and _has_image(xobj.get("/Resources"), depth + 1):
+                return True
+    except Exception as e:
+        logger.debug("Could not inspect PDF page resources: %s", e)
+    return False
+
+
+def page_is_image_only(page, text: str) -> bool:
+    """No usable text layer, but the page draws an image (a scanned page)."""
+    if len(text.strip()) >= PDF_MIN_PAGE_TEXT_CHARS:
+        return False
+    return _has_image(page.get("/Resources"))
+
+
+@dataclass
+class PdfScan:
+    """Text layer of the pages read, and which of them are image-only."""
+
+    pages: list[str] = field(default_factory=list)
+    image_only: list[int] = field(default_factory=list)
+    n_pages: int = 0
+
+
+def scan_pdf_pages(
+    source: PdfSource,
+    max_chars: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    max_image_pages: int = 0,
+    image_page_chars: int = 1500,
+) -> PdfScan:
+    """Read pages in order, classifying each; stops once the budget is covered.
+
+    Image-only pages (at most `max_image_pages` of them) count `image_page_chars`
+    toward `max_chars`, the text they are expected to yield once OCR'd.
+    """
+    reader = _open_reader(source)
+    total = len(reader.pages)
+    n_pages = total if max_pages is None else min(total, max_pages)
+    scan = PdfScan(n_pages=total)
+    used = 0
+    for i in range(n_pages):
+        page = reader.pages[i]
+        text = _page_text(page)
+        scan.pages.append(text)
+        if len(scan.image_only) < max_image_pages and page_is_image_only(page, text):
+            scan.image_only.append(i)
+            used += image_page_chars
+        else:
+            used += len(text) + 1
+        if max_chars is not None and used >= max_chars:
+            break
+    return scan
+
+
+def pdf_subset(source: PdfSource, page_indices: list[int]) -> bytes:
+    """A new PDF with only the given pages (shared fonts/images copied once)."""
+    reader = _open_reader(source)
+    writer = PdfWriter()
+    for i in page_indices:
+        writer.add_page(reader.pages[i])
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+__all__ = ["iter_pdf_pages", "extract_pdf_text", "shutdown_pool", "PdfScan", "page_is_image_only", "scan_pdf_pages", "pdf_subset"]
@@ -0,0 +1,265 @@
+"""Two-tier TTL cache for expensive model results.
+
+Tier 1 is an in-process LRU (OrderedDict); tier 2 is a small SQLite file so
+entries survive restarts and are shared by every worker on the host. Values are
+JSON-serialisable dicts (e.g. `ProductAnalysisResult.model_dump()`).
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = Path(__file__).resolve().parents[1] / ".cache" / "results.sqlite3"
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", str(DEFAULT_DB_PATH))
+
+
+def normalize_text_key(value: str) -> str:
+    """Case/whitespace/Unicode-insensitive form of a user-typed name ("iPhone 15 " == "iphone  15")."""
+    value = unicodedata.normalize("NFC", value or "")
+    return " ".join(value.lower().split())
+
+
+def make_key(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class _SQLiteStore:
+    """Durable tier shared by all caches; one table keyed by (namespace, key)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._conn is not None:
+            return self._conn
+        try:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            conn.commit()
+            self._conn = conn
+        except Exception as e:
+            logger.warning("Result cache DB unavailable (%s): %s", self.path, e)
+            self._conn = None
+        return self._conn
+
+    def get(self, namespace: str, key: str) -> Optional[tuple[str, float]]:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM result_cache WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                ).fetchone()
+            except Exception as e:
+                logger.warning("Result cache read failed: %s", e)
+                return None
+        return (row[0], row[1]) if row else None
+
+    def set(self, namespace: str, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO result_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (namespace, key, value, expires_at),
+                )
+                conn.commit()
+            except Exception as e:
+                logger.warning("Result cache write failed: %s", e)
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute("DELETE FROM result_cache WHERE namespace = ? AND key = ?", (namespace, key))
+                conn.commit()
+            except Exception as e:
+                logger.warning("Result cache delete failed: %s", e)
+
+    def evict_to(self, namespace: str, max_bytes: int) -> int:
+        """Drop the oldest-written rows of `namespace` until its values fit in `max_bytes`."""
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return 0
+            try:
+                total = conn.execute(
+                    "SELECT COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM result_cache WHERE namespace = ?",
+                    (namespace,),
+                ).fetchone()[0]
+                if total <= max_bytes:
+                    return 0
+                # Same TTL per namespace, so the earliest expiry is the oldest write
+                victims = []
+                for key, size in conn.execute(
+                    "SELECT key, LENGTH(CAST(value AS BLOB)) FROM result_cache WHERE namespace = ? ORDER BY expires_at",
+                    (namespace,),
+                ):
+                    if total <= max_bytes:
+                        break
+                    victims.append((namespace, key))
+                    total -= size
+                conn.executemany("DELETE FROM result_cache WHERE namespace = ? AND key = ?", victims)
+                conn.commit()
+                return len(victims)
+            except Exception as e:
+                logger.warning("Result cache eviction failed: %s", e)
+                return 0
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute("DELETE FROM result_cache WHERE expires_at < ?", (time.time(),))
+                conn.commit()
+            except Exception as e:
+                logger.warning("Result cache purge failed: %s", e)
+
+
+_store = _SQLiteStore(RESULT_CACHE_DB)
+
+
+class ResultCache:
+    """`max_entries` bounds the memory tier; `max_disk_bytes` (optional) bounds this namespace on disk."""
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl_seconds: float,
+        max_entries: int = 512,
+        store: Optional[_SQLiteStore] = _store,
+        max_disk_bytes: Optional[int] = None,
+    ):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._store = store
+        self._memory: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        if store is not None:
+            store.purge_expired()
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return value
+                del self._memory[key]
+
+        row = self._store.get(self.namespace, key) if self._store else None
+        if row is not None and row[1] > now:
+            try:
+                value = json.loads(row[0])
+            except Exception:
+                value = None
+            if isinstance(value, dict):
+                with self._lock:
+                    self._remember(key, value, row[1])
+                    self.hits_disk += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: dict) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self.writes += 1
+        if self._store:
+            self._store.set(self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+            if self.max_disk_bytes:
+                evicted = self._store.evict_to(self.namespace, self.max_disk_bytes)
+                if evicted:
+                    with self._lock:
+                        self.evictions += evicted
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+        if self._store:
+            self._store.delete(self.namespace, key)
+
+    def _remember(self, key: str, value: dict, expires_at: float) -> None:
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.hits_memory + self.hits_disk
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+_caches: dict[str, ResultCache] = {}
+
+
+def get_cache(namespace: str, ttl_seconds: float, max_entries: int = 512, max_disk_bytes: Optional[int] = None) -> ResultCache:
+    """Return the process-wide cache for `namespace`, creating it on first use."""
+    cache = _caches.get(namespace)
+    if cache is None:
+        cache = ResultCache(namespace, ttl_seconds, max_entries, max_disk_bytes=max_disk_bytes)
+        _caches[namespace] = cache
+    return cache
+
+
+def cache_stats() -> dict:
+    return {name: c.stats() for name, c in _caches.items()}
+
+
+__all__ = [
+    "ResultCache",
+    "get_cache",
+    "cache_stats",
+    "make_key",
+    "normalize_text_key",
+]
@@ -0,0 +1,109 @@
+"""In-flight deduplication of identical calls ("single flight").
+
+The first caller for a key runs the work; callers arriving while it is still
+running wait for the same outcome instead of issuing their own model call.
+Both paths share one `concurrent.futures.Future` per key, so a sync caller
+(worker thread) and an async caller (event loop) coalesce with each other too.
+"""
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join_or_lead(self, key: str) -> tuple[concurrent.futures.Future, bool]:
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                return fut, False
+            fut = concurrent.futures.Future()
+            self._calls[key] = fut
+            self.leaders += 1
+            return fut, True
+
+    def _forget(self, key: str, fut: concurrent.futures.Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is fut:
+                del self._calls[key]
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` once per key among concurrent sync/async callers."""
+        fut, leader = self._join_or_lead(key)
+        if not leader:
+            logger.info("Coalesced %s call onto in-flight request", self.name)
+            return fut.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._forget(key, fut)
+
+    async def do_async(self, key: str, coro_fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Async twin of `do`. The work runs as its own task, so a leader that
+        disconnects (is cancelled) does not cancel the result for its followers."""
+        fut, leader = self._join_or_lead(key)
+        if leader:
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+
+            def _settle(t: asyncio.Task) -> None:
+                try:
+                    if t.cancelled():
+                        fut.set_exception(asyncio.CancelledError())
+                    elif t.exception() is not None:
+                        fut.set_exception(t.exception())
+                    else:
+                        fut.set_result(t.result())
+                finally:
+                    self._forget(key, fut)
+
+            task.add_done_callback(_settle)
+            return await asyncio.shield(task)
+        logger.info("Coalesced %s call onto in-flight request", self.name)
+        return await asyncio.shield(asyncio.wrap_future(fut))
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+_groups: dict[str, SingleFlight] = {}
+
+
+def get_group(name: str) -> SingleFlight:
+    group = _groups.get(name)
+    if group is None:
+        group = SingleFlight(name)
+        _groups[name] = group
+    return group
+
+
+def singleflight_stats() -> dict:
+    return {name: g.stats() for name, g in _groups.items()}
+
+
+__all__ = ["SingleFlight", "get_group", "singleflight_stats"]
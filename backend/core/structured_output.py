@@ -0,0 +1,250 @@
+"""Schema-constrained JSON output for structured model calls.
+
+Structured calls send `response_mime_type="application/json"` together with a
+`response_schema` derived from the Pydantic model the caller returns, so the
+model can only emit that shape. Answers are validated against the same model.
+The rare leftover failure (truncated output, or a grounded call that can't
+carry a schema) gets ONE repair call. The raw text and the validation error go
+to a cheap schema-constrained model that only reformats it, so the user does
+not pay for a whole new generation.
+
+Gemini 2.5 rejects `response_schema` together with tools (google_search), so
+grounded candidates keep their tool and rely on validate + repair.
+"""
+import os
+import logging
+from functools import lru_cache
+from typing import Any, Callable, Optional, Sequence, TypeVar
+
+from google.genai import types
+from pydantic import BaseModel, ValidationError
+
+from core.llm_gateway import gateway, ModelCandidate
+from core.llm_metrics import record_structured
+from core.json_extract import JSONExtractError, extract_object, coerce_to_model, capture_sample
+
+logger = logging.getLogger(__name__)
+
+STRUCTURED_REPAIR_ENABLED = os.getenv("STRUCTURED_REPAIR_ENABLED", "true").lower() in ("1", "true", "yes")
+STRUCTURED_REPAIR_MODEL = os.getenv("STRUCTURED_REPAIR_MODEL", "gemini-2.5-flash")
+STRUCTURED_REPAIR_MAX_CHARS = int(os.getenv("STRUCTURED_REPAIR_MAX_CHARS", 30000))
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class StructuredOutputError(ValueError):
+    """The model answer is not a JSON object that validates against the target model."""
+
+
+# ---------- schema ----------
+_TYPES = {
+    "string": "STRING",
+    "integer": "INTEGER",
+    "number": "NUMBER",
+    "boolean": "BOOLEAN",
+    "array": "ARRAY",
+    "object": "OBJECT",
+}
+
+
+def _convert(node: dict, defs: dict) -> dict:
+    # JSON Schema (Pydantic) -> the OpenAPI subset Gemini accepts: no $ref/$defs, no anyOf-null
+    if "$ref" in node:
+        node = {**defs[node["$ref"].rsplit("/", 1)[-1]], **{k: v for k, v in node.items() if k != "$ref"}}
+    if "anyOf" in node:
+        options = [o for o in node["anyOf"] if o.get("type") != "null"]
+        out = _convert(options[0], defs) if len(options) == 1 else {"any_of": [_convert(o, defs) for o in options]}
+        if len(options) < len(node["anyOf"]):
+            out["nullable"] = True
+        if node.get("description"):
+            out.setdefault("description", node["description"])
+        return out
+
+    out: dict = {}
+    if node.get("type") in _TYPES:
+        out["type"] = _TYPES[node["type"]]
+    if node.get("description"):
+        out["description"] = node["description"]
+    if "enum" in node:
+        out["type"] = "STRING"
+        out["enum"] = [str(v) for v in node["enum"]]
+    if node.get("type") == "array" and "items" in node:
+        out["items"] = _convert(node["items"], defs)
+    if node.get("type") == "object" or "properties" in node:
+        props = node.get("properties", {})
+        out["type"] = "OBJECT"
+        out["properties"] = {k: _convert(v, defs) for k, v in props.items()}
+        out["required"] = [k for k in node.get("required", []) if k in props]
+        out["property_ordering"] = list(props)
+    return out
+
+
+@lru_cache(maxsize=None)
+def response_schema(model: type[BaseModel], exclude: tuple[str, ...] = ()) -> dict:
+    """Gemini `response_schema` for `model`, without the `exclude` fields (filled in locally)."""
+    js = model.model_json_schema()
+    root = {
+        **js,
+        "properties": {k: v for k, v in js.get("properties", {}).items() if k not in exclude},
+        "required": [k for k in js.get("required", []) if k not in exclude],
+    }
+    return _convert(root, js.get("$defs", {}))
+
+
+def json_fields(model: type[BaseModel], exclude: Sequence[str] = ()) -> dict:
+    """GenerateContentConfig fields that constrain the answer to `model`."""
+    return {"response_mime_type": "application/json", "response_schema": response_schema(model, tuple(exclude))}
+
+
+def json_config(model: type[BaseModel], exclude: Sequence[str] = (), **fields: Any) -> Any:
+    return types.GenerateContentConfig(**json_fields(model, exclude), **fields)
+
+
+def plain_candidates(candidates: Sequence[ModelCandidate]) -> list[ModelCandidate]:
+    """The same chain without the JSON constraint, for free-text follow-up calls."""
+    out = []
+    for c in candidates:
+        cfg = c.config
+        if cfg is not None and getattr(cfg, "response_schema", None) is not None:
+            cfg = cfg.model_copy(update={"response_mime_type": None, "response_schema": None})
+        out.append(ModelCandidate(c.model, cfg))
+    return out
+
+
+# ---------- parse / validate ----------
+def parse_structured(
+    text: Optional[str],
+    model: type[T],
+    overrides: Optional[dict] = None,
+    normalize: Optional[Callable[[dict], dict]] = None,
+) -> T:
+    """Validate a model answer against `model`; raises StructuredOutputError.
+
+    Near-misses (a string where a list is expected) are coerced before validation;
+    `normalize` may adjust further, `overrides` sets the fields that are not part of the schema.
+    """
+    try:
+        data = extract_object(text)
+    except JSONExtractError as e:
+        raise StructuredOutputError(str(e)) from e
+    data = coerce_to_model(model, data)
+    if normalize is not None:
+        data = normalize(data)
+    try:
+        return model.model_validate({**data, **(overrides or {})})
+    except ValidationError as e:
+        first = e.errors()[0]
+        where = ".".join(str(p) for p in first.get("loc", ())) or "<root>"
+        raise StructuredOutputError(f"{e.error_count()} schema error(s), first at {where}: {first.get('msg')}") from e
+
+
+# ---------- repair ----------
+def _repair_candidates(model: type[BaseModel], exclude: Sequence[str]) -> list[ModelCandidate]:
+    extra = {}
+    if STRUCTURED_REPAIR_MODEL.startswith("gemini-2.5"):
+        # Reformatting needs no reasoning budget
+        extra["thinking_config"] = types.ThinkingConfig(thinking_budget=0)
+    return [ModelCandidate(STRUCTURED_REPAIR_MODEL, json_config(model, exclude, **extra))]
+
+
+def _repair_prompt(raw: str, error: StructuredOutputError) -> str:
+    return (
+        "The TEXT below was meant to be a single JSON object matching the response schema, "
+        f"but it failed validation ({error}). Return that JSON object. Keep every value from the TEXT "
+        "unchanged (same language, same wording); only fix the structure, take missing fields from the TEXT "
+        "(or leave them empty) and drop anything outside the schema.\n\n"
+        f"TEXT:\n{raw[:STRUCTURED_REPAIR_MAX_CHARS]}\n"
+    )
+
+
+def _first_pass(response: Any, model, operation, overrides, normalize):
+    raw = response if isinstance(response, str) else (getattr(response, "text", None) or "")
+    try:
+        result = parse_structured(raw, model, overrides, normalize)
+    except StructuredOutputError as e:
+        if not raw.strip():
+            record_structured(operation, "empty")
+            return raw, None, None
+        logger.warning("Structured output for %s failed validation: %s", operation, e)
+        logger.debug("Raw text: %s", raw[:2000])
+        capture_sample(raw, operation, str(e))
+        return raw, None, e
+    record_structured(operation, "ok")
+    return raw, result, None
+
+
+def _second_pass(repaired: Any, model, operation, overrides, normalize):
+    try:
+        result = parse_structured(getattr(repaired, "text", None), model, overrides, normalize)
+    except StructuredOutputError as e:
+        logger.error("Structured output repair for %s failed: %s", operation, e)
+        record_structured(operation, "failed")
+        return None
+    record_structured(operation, "repaired")
+    return result
+
+
+def decode_structured(
+    response: Any,
+    model: type[T],
+    operation: str,
+    exclude: Sequence[str] = (),
+    overrides: Optional[dict] = None,
+    normalize: Optional[Callable[[dict], dict]] = None,
+) -> Optional[T]:
+    """Validate `response` (or raw text) against `model`; one repair call on failure, else None."""
+    raw, result, error = _first_pass(response, model, operation, overrides, normalize)
+    if result is not None or error is None:
+        return result
+    if not STRUCTURED_REPAIR_ENABLED:
+        record_structured(operation, "failed")
+        return None
+    try:
+        repaired = gateway.generate_content(
+            _repair_candidates(model, exclude), _repair_prompt(raw, error),
+            operation=f"{operation}_repair", attempts_per_model=1,
+        )
+    except Exception as e:
+        logger.error("Structured output repair call for %s failed: %s", operation, e)
+        record_structured(operation, "failed")
+        return None
+    return _second_pass(repaired, model, operation, overrides, normalize)
+
+
+async def adecode_structured(
+    response: Any,
+    model: type[T],
+    operation: str,
+    exclude: Sequence[str] = (),
+    overrides: Optional[dict] = None,
+    normalize: Optional[Callable[[dict], dict]] = None,
+) -> Optional[T]:
+    """Async variant of `decode_structured`; the repair call goes through the gateway's aio path."""
+    raw, result, error = _first_pass(response, model, operation, overrides, normalize)
+    if result is not None or error is None:
+        return result
+    if not STRUCTURED_REPAIR_ENABLED:
+        record_structured(operation, "failed")
+        return None
+    try:
+        repaired = await gateway.agenerate_content(
+            _repair_candidates(model, exclude), _repair_prompt(raw, error),
+            operation=f"{operation}_repair", attempts_per_model=1,
+        )
+    except Exception as e:
+        logger.error("Structured output repair call for %s failed: %s", operation, e)
+        record_structured(operation, "failed")
+        return None
+    return _second_pass(repaired, model, operation, overrides, normalize)
+
+
+__all__ = [
+    "StructuredOutputError",
+    "response_schema",
+    "json_fields",
+    "json_config",
+    "plain_candidates",
+    "parse_structured",
+    "decode_structured",
+    "adecode_structured",
+]
@@ -1,8 +1,11 @@
-from fastapi import FastAPI
+from uuid import uuid4
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware  # <<-- THAY ĐỔI Ở ĐÂY
 from api.router import router as api_router
 from api.auth_router import router as auth_router, get_current_user_email
 from api.history_router import history_router
+from api.uploads import UploadLimitMiddleware
+from core.llm_metrics import bind_request, reset_request
 import sys
 import os
 
@@ -21,6 +24,9 @@ origins = [
     "http://127.0.0.1:5173",
 ]
 
+# Giới hạn kích thước upload ngay khi nhận body (thêm trước CORS để lỗi 413 vẫn có header CORS)
+app.add_middleware(UploadLimitMiddleware)
+
 # Thêm CORSMiddleware vào ứng dụng
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +36,19 @@ app.add_middleware(
     allow_headers=["*"],               # Cho phép tất cả các header
 )
 
+
+@app.middleware("http")
+async def llm_request_context(request: Request, call_next):
+    # Gắn request id + route vào mọi lần gọi model (log chi phí theo request)
+    request_id = request.headers.get("X-Request-ID") or uuid4().hex
+    token = bind_request(request_id, request.url.path)
+    try:
+        response = await call_next(request)
+    finally:
+        reset_request(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(history_router, prefix="/api/history", tags=["History"])
 app.include_router(api_router, prefix="/api", tags=["Core"])
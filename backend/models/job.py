@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, func
+from db import Base
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String(32), primary_key=True)              # uuid4 hex
+    kind = Column(String(64), index=True, nullable=False)  # handler name (generate_poster, analyze_product, ...)
+    status = Column(String(16), index=True, nullable=False, default="queued")  # queued | running | succeeded | failed
+    payload_json = Column(Text, nullable=False)
+    result_json = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    error_status = Column(Integer, nullable=True)          # HTTP status the synchronous endpoint would have returned
+    attempts = Column(Integer, nullable=False, default=0)
+    lease_until = Column(Float, nullable=True)             # epoch seconds; a running job past its lease is re-queued
+    expires_at = Column(Float, index=True, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
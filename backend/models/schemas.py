@@ -74,6 +74,26 @@ class ContentGenerationRequest(BaseModel):
     custom_title: Optional[str] = Field(None, description="(Optional) Tiêu đề gợi ý/tự đặt.")
     key_points: Optional[str] = Field(None, description="(Optional) Mô tả các ý chính / yêu cầu (có thể xuống dòng).")
     required_keywords: Optional[str] = Field(None, description="(Optional) Từ khoá cần có (phân tách bằng dấu phẩy).")
+    candidates: Optional[int] = Field(None, ge=1, le=8, description="(Optional) Sinh song song N bản nháp, chấm điểm cục bộ và trả về bản tốt nhất (tối đa CONTENT_MAX_CANDIDATES).")
+
+
+class ContentVariantOverride(BaseModel):
+    selected_tone: Optional[Tone] = Field(None, description="Giọng điệu thay thế cho biến thể này.")
+    selected_format: Optional[Format] = Field(None, description="Định dạng thay thế cho biến thể này.")
+    language: Optional[str] = Field(None, description="Ngôn ngữ thay thế cho biến thể này.")
+    ad_copy_style: Optional[AdCopyStyle] = Field(None, description="Phong cách ad copy thay thế cho biến thể này.")
+
+
+class ContentBatchRequest(BaseModel):
+    base: ContentGenerationRequest = Field(..., description="Yêu cầu gốc; mỗi biến thể chỉ ghi đè các trường trong ma trận.")
+    # Ma trận: tích Descartes của các trục được cung cấp (trục bỏ trống = giữ giá trị của base)
+    tones: Optional[List[Tone]] = Field(None, description="Các giọng điệu cần tạo.")
+    formats: Optional[List[Format]] = Field(None, description="Các định dạng cần tạo.")
+    languages: Optional[List[str]] = Field(None, description="Các ngôn ngữ cần tạo.")
+    ad_copy_styles: Optional[List[AdCopyStyle]] = Field(None, description="Các phong cách ad copy cần tạo.")
+    # Biến thể chỉ định thủ công, thêm vào sau ma trận
+    variants: Optional[List[ContentVariantOverride]] = Field(None, description="(Optional) Danh sách biến thể cụ thể.")
+    max_concurrency: Optional[int] = Field(None, ge=1, description="(Optional) Số biến thể chạy song song tối đa.")
 
 
 class GeneratedContentResponse(BaseModel):
@@ -82,9 +102,17 @@ class GeneratedContentResponse(BaseModel):
     prompt_used: str = Field(..., description="Prompt đã sử dụng để tạo nội dung (để kiểm tra).")
 
 
+# Structured output của model khi sinh nội dung; word_count là số từ model tự kiểm tra lại
+class ContentDraft(BaseModel):
+    title: str = Field(..., description="Tiêu đề gợi ý.")
+    content: str = Field(..., description="Nội dung Marketing đã được tạo ra.")
+    word_count: int = Field(..., description="Số từ của content do chính model đếm lại; phải nằm trong Target Length.")
+
+
 # ===== Product analysis (requests/responses) =====
 class ProductAnalysisRequest(BaseModel):
     product_name: str = Field(..., description="Tên sản phẩm người dùng nhập vào để phân tích.")
+    force_refresh: Optional[bool] = Field(False, description="(Optional) Bỏ qua kết quả đã cache và phân tích lại từ đầu.")
 
 
 class ProductAnalysisResult(BaseModel):
@@ -105,6 +133,7 @@ class ImageGenerationResponse(BaseModel):
 # ===== Competitor Analysis (requests/responses) =====
 class CompetitorAnalysisRequest(BaseModel):
     competitor_name: str = Field(..., description="Tên đối thủ cạnh tranh cần phân tích.")
+    hedge: Optional[bool] = Field(None, description="Gửi song song sang model dự phòng nếu model chính chậm (mặc định theo COMPETITOR_HEDGING).")
 
 
 class ProductAnalysisSection(BaseModel):
@@ -213,6 +242,54 @@ class ImageRecordOut(BaseModel):
     created_at: datetime
 
 
+# ===== Background jobs =====
+class JobAccepted(BaseModel):
+    job_id: str
+    status: str = "queued"
+    status_url: str = Field(..., description="GET để theo dõi trạng thái và lấy kết quả.")
+
+
+class JobStatusOut(BaseModel):
+    id: str
+    kind: str
+    status: str = Field(..., description="queued | running | succeeded | failed")
+    attempts: int
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[dict[str, Any]] = Field(None, description="Kết quả (cùng cấu trúc với endpoint đồng bộ) khi status = succeeded.")
+    error: Optional[str] = None
+    error_status: Optional[int] = Field(None, description="Mã HTTP mà endpoint đồng bộ sẽ trả về khi lỗi.")
+
+
+# ===== Document follow-up questions (vector index) =====
+class DocumentQueryRequest(BaseModel):
+    question: str = Field(..., min_length=1, max_length=2000, description="Yêu cầu tiếp theo về tài liệu, ví dụ: 'Liệt kê thông số pin'.")
+    top_k: int = Field(4, ge=1, le=12, description="Số đoạn liên quan nhất gửi cho mô hình.")
+
+
+class DocumentChunkOut(BaseModel):
+    index: int = Field(..., description="Vị trí đoạn trong tài liệu (từ 0).")
+    score: float = Field(..., description="Độ tương đồng cosine với câu hỏi.")
+    text: str
+
+
+class DocumentQueryResponse(BaseModel):
+    document_id: str
+    answer: str
+    sources: List[DocumentChunkOut] = Field(..., description="Các đoạn đã gửi cho mô hình, liên quan nhất trước.")
+    context_chars: int = Field(..., description="Số ký tự tài liệu đã gửi (thay vì gửi lại cả file).")
+
+
+class DocumentIndexOut(BaseModel):
+    document_id: str = Field(..., description="SHA-256 của file; cũng có trong header X-Document-Id của /api/analyze_document.")
+    filename: Optional[str] = None
+    product_name: Optional[str] = None
+    chunks: int
+    chars: int
+    embedder: str
+    indexed_at: float
+
 
 __all__ = [
     # enums
@@ -221,6 +298,7 @@ __all__ = [
     # content
     "ContentGenerationRequest",
     "GeneratedContentResponse",
+    "ContentDraft",
     # product
     "ProductAnalysisRequest",
     "ProductAnalysisResult",
@@ -240,4 +318,12 @@ __all__ = [
     "AnalysisRecordOut",
     "ContentRecordOut",
     "ImageRecordOut",
+    # jobs
+    "JobAccepted",
+    "JobStatusOut",
+    # document follow-ups
+    "DocumentQueryRequest",
+    "DocumentChunkOut",
+    "DocumentQueryResponse",
+    "DocumentIndexOut",
 ]
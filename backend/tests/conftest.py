@@ -0,0 +1,40 @@
+"""Offline test setup: the fake LLM provider and throwaway storage.
+
+The environment is set before any app module is imported, since the modules
+read their settings at import time.
+
+    cd backend && python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+_TMP = tempfile.mkdtemp(prefix="vma-tests-")
+
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["LLM_FAKE_LATENCY_MEDIAN"] = "0.01"
+os.environ["LLM_FAKE_LATENCY_SIGMA"] = "0"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'app.db')}"
+os.environ["RESULT_CACHE_DB"] = os.path.join(_TMP, "result_cache.sqlite3")
+os.environ["DOCUMENT_INDEX_DIR"] = os.path.join(_TMP, "document_index")
+os.environ.setdefault("CLOUDINARY_CLOUD_NAME", "test")
+os.environ.setdefault("OCR_BACKEND", "stub")
+
+
+@pytest.fixture
+def provider():
+    """Swap in a fresh FakeProvider for one test; tweak its rates to script failures."""
+    from core.ai_clients import get_llm_provider, set_llm_provider
+    from core.fake_provider import FakeProvider
+
+    previous = get_llm_provider()
+    fake = FakeProvider(latency_median=0.001, latency_sigma=0)
+    set_llm_provider(fake)
+    yield fake
+    set_llm_provider(previous)
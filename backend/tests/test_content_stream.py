@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import core.content_generation as content_generation
+from models.schemas import Format, Tone
+
+REQUEST = {
+    "product_name": "Máy lọc không khí X1",
+    "target_persona": "Gia đình trẻ ở thành phố",
+    "selected_usps": ["Lọc bụi mịn PM2.5", "Chạy êm 22 dB"],
+    "selected_tone": Tone.PROFESSIONAL.value,
+    "selected_format": Format.FACEBOOK_POST.value,
+    "infor": "CADR 350 m³/h, bảo hành 12 tháng",
+    "desired_length": 120,
+}
+
+
+@pytest.fixture
+def client(provider):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as c:
+        yield c
+
+
+def _events(body: str) -> list[tuple[str, dict]]:
+    out = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        out.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return out
+
+
+def test_stream_ends_with_the_final_result(client):
+    r = client.post("/api/generate_content/stream", json=REQUEST)
+    assert r.status_code == 200
+    events = _events(r.text)
+    assert events[0][0] == "title"
+    assert events[-1][0] == "final" and events[-1][1]["content"]
+
+
+def test_unavailable_provider_is_a_503(client, provider, monkeypatch):
+    monkeypatch.setattr(provider, "is_available", lambda: False)
+    r = client.post("/api/generate_content/stream", json=REQUEST)
+    assert r.status_code == 503
+    assert "Retry-After" in r.headers
+
+
+def test_empty_stream_is_a_400(client, monkeypatch):
+    async def nothing(*args, **kwargs):
+        return
+        yield
+
+    monkeypatch.setattr(content_generation.gateway, "astream_content", nothing)
+    assert client.post("/api/generate_content/stream", json=REQUEST).status_code == 400
+
+
+def test_undecodable_answer_after_deltas_ends_with_an_error_event(client, monkeypatch):
+    async def undecodable(response):
+        return None
+
+    monkeypatch.setattr(content_generation, "_adecode_title_content", undecodable)
+    r = client.post("/api/generate_content/stream", json=REQUEST)
+    assert r.status_code == 200
+    events = _events(r.text)
+    assert "final" not in [e for e, _ in events]
+    assert events[-1] == ("error", {"status": 400, "detail": "Không thể tạo nội dung, vui lòng thử lại với các thông số khác."})
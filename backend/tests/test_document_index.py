@@ -0,0 +1,111 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from core.document_index import (
+    EmbedderUnavailableError,
+    HashingEmbedder,
+    build_index,
+    delete_document_index,
+    get_document_index,
+    index_document,
+    is_document_id,
+    search_index,
+)
+
+USER = "tester@example.com"
+SECTIONS = {
+    "battery": "Pin và sạc: dung lượng pin 5000 mAh, sạc nhanh 33W, sạc đầy trong 55 phút.",
+    "display": "Màn hình AMOLED 6.7 inch, độ phân giải 2400x1080, tần số quét 120Hz.",
+    "camera": "Camera chính 50MP khẩu độ f/1.8, quay video 4K 60fps, chống rung OIS.",
+    "warranty": "Bảo hành chính hãng 18 tháng, đổi mới trong 30 ngày nếu lỗi nhà sản xuất.",
+}
+FILLER = "Sản phẩm được thiết kế cho người dùng hiện đại. Đọc kỹ hướng dẫn an toàn trước khi sử dụng. " * 12
+
+
+def _document() -> str:
+    return "\n\n".join(f"{FILLER}\n\n{text}" for text in SECTIONS.values())
+
+
+def _doc_id(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@pytest.fixture
+def index():
+    text = _document()
+    return build_index(_doc_id(text), text, "spec.docx", "X1", embedder=HashingEmbedder())
+
+
+@pytest.mark.parametrize("question, topic", [
+    ("dung lượng pin và thời gian sạc", "battery"),
+    ("màn hình bao nhiêu inch, tần số quét?", "display"),
+    ("camera bao nhiêu MP, quay video 4K?", "camera"),
+    ("chính sách bảo hành", "warranty"),
+])
+def test_search_ranks_the_matching_chunk_first(index, question, topic):
+    hits = search_index(index, question, 3)
+    assert SECTIONS[topic][:20] in hits[0].text
+    scores = [h.score for h in hits]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_search_edge_cases(index):
+    assert search_index(index, "   ") == []
+    assert len(search_index(index, "pin", 100)) == len(index.chunks)
+    assert np.allclose(np.linalg.norm(index.vectors, axis=1), 1.0, atol=1e-5)
+
+
+def test_unavailable_embedder_raises(index):
+    index.embedder = "retired-embedder"
+    with pytest.raises(EmbedderUnavailableError):
+        search_index(index, "pin")
+
+
+def test_store_round_trip_and_id_validation():
+    text = _document()
+    doc_id = _doc_id(text)
+    assert is_document_id(doc_id)
+    assert not is_document_id("../" + doc_id[3:])
+    assert not is_document_id(doc_id.upper())
+
+    assert index_document(USER, doc_id, text, "spec.docx") is not None
+    loaded = get_document_index(USER, doc_id)
+    assert loaded.chunks and loaded.filename == "spec.docx"
+    assert get_document_index("other@example.com", doc_id) is None
+    assert get_document_index(USER, "../../etc/passwd") is None
+    assert not delete_document_index(USER, "../../etc/passwd")
+
+    assert delete_document_index(USER, doc_id)
+    assert get_document_index(USER, doc_id) is None
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    from main import app
+    from api.auth_utils import get_current_user_email
+
+    app.dependency_overrides[get_current_user_email] = lambda: USER
+    with TestClient(app) as c:
+        yield c
+    app.dependency_overrides.pop(get_current_user_email, None)
+
+
+def test_routes_reject_invalid_ids_and_stale_indexes(client):
+    for bad in ("abc", "A" * 64, "..%2F..%2Fetc%2Fpasswd"):
+        assert client.post(f"/api/documents/{bad}/query", json={"question": "pin"}).status_code == 404
+        assert client.delete(f"/api/documents/{bad}").status_code == 404
+
+    text = _document()
+    doc_id = _doc_id(text)
+    index_document(USER, doc_id, text, "spec.docx")
+    r = client.post(f"/api/documents/{doc_id}/query", json={"question": "dung lượng pin", "top_k": 2})
+    assert r.status_code == 200
+    assert len(r.json()["sources"]) == 2
+
+    get_document_index(USER, doc_id).embedder = "retired-embedder"
+    r = client.post(f"/api/documents/{doc_id}/query", json={"question": "pin"})
+    assert r.status_code == 409
+    assert client.delete(f"/api/documents/{doc_id}").status_code == 204
@@ -0,0 +1,81 @@
+import io
+import zipfile
+
+import docx
+import pytest
+
+from core.docx_extract import extract_docx_text
+from benchmarks.bench_parse_sandbox import make_docx_xml
+
+NS = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"'
+)
+
+
+def _spec_sheet() -> bytes:
+    """A python-docx document with a heading, a spec table, a nested table and a header/footer."""
+    d = docx.Document()
+    d.sections[0].header.paragraphs[0].text = "ACME Confidential"
+    d.sections[0].footer.paragraphs[0].text = "acme.vn"
+    d.add_paragraph("Máy lọc không khí X1")
+    d.add_heading("Thông số kỹ thuật", level=1)
+    table = d.add_table(rows=3, cols=2)
+    for r, (k, v) in enumerate([("Thông số", "Giá trị"), ("CADR", "350 m³/h"), ("Độ ồn", "22 dB")]):
+        table.cell(r, 0).text = k
+        table.cell(r, 1).text = v
+    merged = d.add_table(rows=1, cols=3)
+    merged.cell(0, 0).text = "Bảo hành"
+    merged.cell(0, 1).merge(merged.cell(0, 2)).text = "12 tháng"
+    d.add_heading("Hướng dẫn", level=2)
+    d.add_paragraph("Đọc kỹ hướng dẫn trước khi dùng.")
+    buf = io.BytesIO()
+    d.save(buf)
+    return buf.getvalue()
+
+
+def test_tables_headings_and_header_footer():
+    text = extract_docx_text(io.BytesIO(_spec_sheet()))
+    lines = text.split("\n")
+    assert lines[0] == "Máy lọc không khí X1"
+    # A blank line before each heading and around each table
+    assert lines[1:3] == ["", "Thông số kỹ thuật"]
+    assert "Thông số | Giá trị\nCADR | 350 m³/h\nĐộ ồn | 22 dB" in text
+    # Merged cells repeat their text once per grid column; it is kept once
+    assert "Bảo hành | 12 tháng" in lines
+    assert "\n\nHướng dẫn\nĐọc kỹ hướng dẫn trước khi dùng." in text
+    assert text.endswith("ACME Confidential\n\nacme.vn")
+    assert "\n\n\n" not in text
+
+
+def test_budget_stops_early_and_skips_headers():
+    full = extract_docx_text(io.BytesIO(_spec_sheet()))
+    cut = extract_docx_text(io.BytesIO(_spec_sheet()), 40)
+    assert len(cut) <= 40
+    assert full.startswith(cut)
+    assert "ACME" not in cut
+
+
+def test_text_box_once_and_nested_table_inside_cell(tmp_path):
+    path = str(tmp_path / "boxes.docx")
+    body = (
+        f'<w:p {NS}><w:r><w:t>Trước</w:t></w:r>'
+        '<mc:AlternateContent><mc:Choice Requires="wps"><w:r><w:txbxContent>'
+        '<w:p><w:r><w:t>Khuyến mãi 20%</w:t></w:r></w:p>'
+        '</w:txbxContent></w:r></mc:Choice>'
+        '<mc:Fallback><w:r><w:txbxContent><w:p><w:r><w:t>Khuyến mãi 20%</w:t></w:r></w:p>'
+        '</w:txbxContent></w:r></mc:Fallback></mc:AlternateContent></w:p>'
+        f'<w:tbl {NS}><w:tr><w:tc><w:p><w:r><w:t>Ngoài</w:t></w:r></w:p>'
+        '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>a</w:t></w:r></w:p></w:tc>'
+        '<w:tc><w:p><w:r><w:t>b</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+        '</w:tc></w:tr></w:tbl>'
+    )
+    make_docx_xml([body.encode("utf-8")], path)
+    text = extract_docx_text(path)
+    assert text.count("Khuyến mãi 20%") == 1
+    assert "Ngoài a | b" in text
+
+
+def test_not_a_docx():
+    with pytest.raises(zipfile.BadZipFile):
+        extract_docx_text(io.BytesIO(b"plain text"))
@@ -0,0 +1,50 @@
+import pytest
+
+import api.router as router
+from models.schemas import ImageGenerationResponse
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    async def unwritable(upload, dest, max_bytes):
+        return None
+
+    monkeypatch.setattr(router, "save_upload", unwritable)
+    with TestClient(app) as c:
+        yield c
+
+
+def _post(client, query: str = ""):
+    return client.post(
+        f"/api/generate_poster{query}",
+        data={"product_name": "Máy X"},
+        files={"reference_image": ("ref.png", PNG, "image/png")},
+    )
+
+
+def test_unsaved_reference_is_passed_as_the_upload_handle(client, monkeypatch):
+    seen = {}
+
+    def fake_poster(**kwargs):
+        image = kwargs["original_image_bytes"]
+        seen["type"] = type(image)
+        seen["data"] = image.read()
+        return ImageGenerationResponse(image_url="https://example.com/p.png", prompt_used="")
+
+    monkeypatch.setattr(router, "generate_marketing_poster", fake_poster)
+    r = _post(client)
+    assert r.status_code == 200
+    assert seen["type"] is not bytes
+    assert seen["data"] == PNG
+
+
+def test_async_request_is_not_run_synchronously_when_the_reference_cannot_be_saved(client, monkeypatch):
+    monkeypatch.setattr(router, "generate_marketing_poster", lambda **kwargs: pytest.fail("ran synchronously"))
+    r = _post(client, "?async=true")
+    assert r.status_code == 503
+    assert "Retry-After" in r.headers
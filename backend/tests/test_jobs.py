@@ -0,0 +1,132 @@
+import asyncio
+import threading
+
+import pytest
+
+import core.jobs as jobs
+from db import init_db
+from core.jobs import JOB_MAX_ATTEMPTS, JobQueue
+
+
+@pytest.fixture
+def queue():
+    init_db()
+    q = JobQueue(workers=1)
+    q.register("echo", lambda payload: {"echo": payload["value"]})
+    return q
+
+
+def _claim_only(q: JobQueue, job_id: str):
+    claimed = q._claim()
+    assert claimed is not None and claimed[0] == job_id
+    return claimed
+
+
+def test_expired_lease_requeues_then_fails_after_max_attempts(queue, monkeypatch):
+    job_id = queue.submit("echo", {"value": 1})
+    # Leases expire as soon as they are taken: every claimed run looks like a dead worker
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", -1.0)
+
+    for attempt in range(1, JOB_MAX_ATTEMPTS):
+        _claim_only(queue, job_id)
+        assert queue.get(job_id)["status"] == "running"
+        assert queue._recover() == 1
+        job = queue.get(job_id)
+        assert job["status"] == "queued"
+        assert job["attempts"] == attempt
+
+    _claim_only(queue, job_id)
+    assert queue._recover() == 1
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["attempts"] == JOB_MAX_ATTEMPTS
+    assert job["error_status"] == 500
+    assert queue._claim() is None
+
+
+def test_live_lease_is_not_recovered(queue):
+    job_id = queue.submit("echo", {"value": 2})
+    _claim_only(queue, job_id)
+    assert queue._recover() == 0
+    assert queue.get(job_id)["status"] == "running"
+    queue._finish(job_id, {"echo": 2})
+
+
+def test_release_gives_the_attempt_back(queue):
+    job_id = queue.submit("echo", {"value": 3})
+    _claim_only(queue, job_id)
+    queue._release(job_id)
+    job = queue.get(job_id)
+    assert job["status"] == "queued"
+    assert job["attempts"] == 0
+    _claim_only(queue, job_id)
+    queue._finish(job_id, {"echo": 3})
+
+
+def test_workers_run_jobs_and_store_results_and_errors(queue):
+    class Rejected(Exception):
+        status_code = 422
+        detail = "bad input"
+
+    def reject(payload):
+        raise Rejected()
+
+    queue.register("reject", reject)
+
+    async def scenario():
+        await queue.start()
+        try:
+            ok = queue.submit("echo", {"value": 4})
+            bad = queue.submit("reject", {})
+            for _ in range(200):
+                done = [queue.get(j)["status"] for j in (ok, bad)]
+                if all(s in ("succeeded", "failed") for s in done):
+                    break
+                await asyncio.sleep(0.02)
+            return queue.get(ok), queue.get(bad)
+        finally:
+            await queue.stop()
+
+    ok, bad = asyncio.run(scenario())
+    assert ok["status"] == "succeeded"
+    assert ok["result"] == {"echo": 4}
+    assert bad["status"] == "failed"
+    assert bad["error"] == "bad input"
+    assert bad["error_status"] == 422
+
+
+@pytest.mark.parametrize("grace, status_at_stop", [(5.0, "succeeded"), (0.05, "running")])
+def test_shutdown_waits_for_a_running_sync_handler(queue, monkeypatch, grace, status_at_stop):
+    monkeypatch.setattr(jobs, "JOB_SHUTDOWN_GRACE_SECONDS", grace)
+    started, finish = threading.Event(), threading.Event()
+    calls = []
+
+    def slow(payload):
+        calls.append(payload)
+        started.set()
+        finish.wait(5)
+        return {"done": True}
+
+    queue.register("slow", slow)
+
+    async def scenario():
+        await queue.start()
+        job_id = queue.submit("slow", {})
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        asyncio.get_running_loop().call_later(0.2, finish.set)
+        await queue.stop()
+        return job_id, queue.get(job_id)["status"]
+
+    job_id, at_stop = asyncio.run(scenario())
+    # Never handed back to the queue while the thread was still running
+    assert at_stop == status_at_stop
+    job = queue.get(job_id)
+    assert job["status"] == "succeeded" and job["result"] == {"done": True}
+    assert job["attempts"] == 1
+    assert len(calls) == 1
+
+
+def test_submit_unknown_kind(queue):
+    with pytest.raises(KeyError):
+        queue.submit("nope", {})
@@ -0,0 +1,62 @@
+import json
+import os
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+from core.json_extract import JSONExtractError, coerce_to_model, extract_json, extract_object
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "json_corpus.jsonl")
+
+
+def _load_corpus() -> list[dict]:
+    with open(CORPUS, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+SAMPLES = _load_corpus()
+RECOVERABLE = [s for s in SAMPLES if s.get("expect_keys") is not None]
+UNRECOVERABLE = [s for s in SAMPLES if s.get("expect_keys") is None]
+
+
+@pytest.mark.parametrize("sample", RECOVERABLE, ids=[s["id"] for s in RECOVERABLE])
+def test_corpus_sample_is_recovered(sample):
+    data = extract_object(sample["text"])
+    assert isinstance(data, dict)
+    for key in sample["expect_keys"]:
+        assert key in data
+
+
+@pytest.mark.parametrize("sample", UNRECOVERABLE, ids=[s["id"] for s in UNRECOVERABLE])
+def test_corpus_sample_is_rejected(sample):
+    with pytest.raises(JSONExtractError):
+        extract_object(sample["text"])
+
+
+def test_truncated_answer_is_closed_unless_disabled():
+    text = '{"title": "Hook", "content": "Câu đầu tiên. Câu thứ hai bị cắt'
+    assert extract_object(text)["title"] == "Hook"
+    with pytest.raises(JSONExtractError):
+        extract_object(text, allow_truncated=False)
+
+
+def test_extract_json_list():
+    assert extract_json('Kết quả:\n```json\n["a", "b",]\n```', expect=list) == ["a", "b"]
+
+
+class _Inner(BaseModel):
+    note: str
+
+
+class _Outer(BaseModel):
+    usps: list[str]
+    persona: str
+    inner: Optional[_Inner] = None
+
+
+def test_coerce_to_model_converts_present_fields_only():
+    out = coerce_to_model(_Outer, {"usps": "a, b", "persona": ["x", "y"], "inner": {"note": 3}})
+    assert out == {"usps": ["a", "b"], "persona": "x, y", "inner": {"note": "3"}}
+    assert "persona" not in coerce_to_model(_Outer, {"usps": []})
+    assert coerce_to_model(_Outer, {"usps": []}, fill_missing=True)["persona"] == "Chưa xác định"
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from core.ai_clients import LLMUnavailableError
+from core.fake_provider import FakeProviderError
+from core.llm_gateway import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, LLMGateway, ModelCandidate, RetryPolicy
+
+RESET = 0.05
+
+
+def _no_backoff() -> RetryPolicy:
+    return RetryPolicy(max_attempts=4, attempts_per_model=2, base_delay=0.0, max_delay=0.0, jitter=0.0)
+
+
+def test_breaker_opens_after_threshold_then_half_opens_and_closes():
+    b = CircuitBreaker("m", failure_threshold=2, reset_timeout=RESET)
+    b.record_failure()
+    assert b.state == CLOSED
+    b.record_failure()
+    assert b.state == OPEN
+    assert not b.allow_request()
+    assert b.retry_after() > 0
+
+    time.sleep(RESET * 1.5)
+    assert b.state == HALF_OPEN
+    assert b.allow_request()
+    # Only one probe at a time while half-open
+    assert not b.allow_request()
+
+    b.record_success()
+    assert b.state == CLOSED
+    assert b.allow_request()
+
+
+def test_failed_probe_reopens_the_circuit():
+    b = CircuitBreaker("m", failure_threshold=2, reset_timeout=RESET)
+    b.record_failure()
+    b.record_failure()
+    time.sleep(RESET * 1.5)
+    assert b.allow_request()
+    b.record_failure()
+    assert b.state == OPEN
+    assert not b.allow_request()
+
+
+def test_gateway_skips_open_model_until_probe_succeeds(provider):
+    gw = LLMGateway(policy=_no_backoff(), failure_threshold=2, reset_timeout=RESET)
+    candidates = [ModelCandidate("test-breaker-model")]
+
+    provider.error_rate = 1.0
+    with pytest.raises(FakeProviderError):
+        gw.generate_content(candidates, "hello", operation="test")
+    assert gw.breaker("test-breaker-model").state == OPEN
+
+    # Open circuit: no call is made at all
+    with pytest.raises(LLMUnavailableError) as exc:
+        gw.generate_content(candidates, "hello", operation="test")
+    assert exc.value.retry_after
+
+    provider.error_rate = 0.0
+    time.sleep(RESET * 1.5)
+    assert gw.breaker("test-breaker-model").state == HALF_OPEN
+    response = gw.generate_content(candidates, "hello", operation="test")
+    assert response.text
+    assert gw.breaker("test-breaker-model").state == CLOSED
+
+
+def test_gateway_falls_back_to_next_model(provider):
+    gw = LLMGateway(policy=_no_backoff(), failure_threshold=1, reset_timeout=60)
+    gw.breaker("test-primary").record_failure()
+    response = gw.generate_content(
+        [ModelCandidate("test-primary"), ModelCandidate("test-fallback")], "hello", operation="test"
+    )
+    assert response.model_version == "test-fallback"
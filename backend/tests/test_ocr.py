@@ -0,0 +1,78 @@
+import hashlib
+
+import pytest
+
+import core.document_analysis as document_analysis
+import core.parse_sandbox as parse_sandbox
+from core.ai_clients import LLMUnavailableError
+from core.ocr import StubOCR, get_ocr_backend, transcribe_batches
+from core.parse_sandbox import parse_pdf_scan
+from benchmarks.bench_ocr_routing import make_mixed_pdf
+
+N_PAGES = 6
+SCANNED = {1, 4}
+
+
+@pytest.fixture(autouse=True)
+def in_process(monkeypatch):
+    monkeypatch.setattr(parse_sandbox, "PARSE_SANDBOX", False)
+
+
+@pytest.fixture
+def mixed_pdf() -> bytes:
+    return make_mixed_pdf(N_PAGES, SCANNED, 2048, lines_per_page=3)
+
+
+def _failing(exc):
+    def transcribe(self, pdf_bytes, n_pages):
+        raise exc
+    return transcribe
+
+
+def test_only_image_only_pages_are_batched(mixed_pdf):
+    scan = parse_pdf_scan(mixed_pdf, max_image_pages=10, batch_pages=8)
+    assert scan.n_pages == N_PAGES
+    assert [idx for idx, _ in scan.batches] == [sorted(SCANNED)]
+    assert len(scan.batches[0][1]) < len(mixed_pdf)
+    assert not any(scan.pages[i].strip() for i in SCANNED)
+
+
+def test_batches_respect_the_page_count(mixed_pdf):
+    scan = parse_pdf_scan(mixed_pdf, max_image_pages=10, batch_pages=1)
+    assert [idx for idx, _ in scan.batches] == [[1], [4]]
+
+
+def test_stub_text_is_merged_in_page_order(mixed_pdf):
+    assert isinstance(get_ocr_backend(), StubOCR)
+    pages = document_analysis.extract_text_from_pdf(mixed_pdf).split("\f")
+    assert len(pages) == N_PAGES
+    for i, page in enumerate(pages):
+        if i in SCANNED:
+            assert page.startswith("[OCR]")
+        else:
+            assert page.startswith(f"Page {i + 1} line 1")
+    assert pages[1].startswith("[OCR] Trang scan 1/2") and pages[4].startswith("[OCR] Trang scan 2/2")
+
+
+def test_failed_batch_is_counted_and_nothing_is_cached(mixed_pdf, monkeypatch):
+    scan = parse_pdf_scan(mixed_pdf, max_image_pages=10, batch_pages=1)
+    monkeypatch.setattr(StubOCR, "transcribe", _failing(ValueError("bad answer")))
+    texts, failed = transcribe_batches(scan.batches, scan.n_pages)
+    assert texts == {} and failed == 2
+
+    digest = hashlib.sha256(mixed_pdf).hexdigest()
+    key = document_analysis._analysis_key(digest, "pdf", "Máy X")
+    result = document_analysis.generate_product_analysis_from_document("Máy X", mixed_pdf, "pdf", digest=digest)
+    assert result is not None
+    assert document_analysis.document_analysis_cache.get(key) is None
+    assert document_analysis.extract_document_text(mixed_pdf, "pdf", digest) == ""
+
+    monkeypatch.undo()
+    monkeypatch.setattr(parse_sandbox, "PARSE_SANDBOX", False)
+    assert "[OCR]" in document_analysis.extract_document_text(mixed_pdf, "pdf", digest)
+
+
+def test_model_unavailable_during_ocr_propagates(mixed_pdf, monkeypatch):
+    monkeypatch.setattr(StubOCR, "transcribe", _failing(LLMUnavailableError("circuit open", retry_after=5)))
+    with pytest.raises(LLMUnavailableError):
+        document_analysis.extract_text_from_pdf(mixed_pdf)
@@ -0,0 +1,60 @@
+import pytest
+
+import core.parse_sandbox as parse_sandbox
+from core.parse_sandbox import DocumentRejectedError, ParsePool
+from benchmarks.bench_pdf_extract import make_pdf
+from benchmarks.bench_parse_sandbox import make_slow_pdf
+
+# A fresh worker imports the parsers first; the slow PDF takes far longer than this
+WARM_TIMEOUT = 60.0
+SHORT_TIMEOUT = 0.5
+
+
+@pytest.fixture
+def pool():
+    p = ParsePool(size=1)
+    yield p
+    p.close()
+
+
+def _write(tmp_path, name: str, data: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_timeout_kills_the_worker_and_the_pool_recovers(pool, tmp_path, monkeypatch):
+    good = _write(tmp_path, "good.pdf", make_pdf(2))
+    slow = _write(tmp_path, "slow.pdf", make_slow_pdf())
+
+    monkeypatch.setattr(parse_sandbox, "PARSE_TIMEOUT_SECONDS", WARM_TIMEOUT)
+    assert "Page 1" in pool.parse("pdf", good, 5000)
+
+    monkeypatch.setattr(parse_sandbox, "PARSE_TIMEOUT_SECONDS", SHORT_TIMEOUT)
+    with pytest.raises(DocumentRejectedError) as exc:
+        pool.parse("pdf", slow, 5000)
+    assert exc.value.reason == "timeout"
+
+    # The killed worker is replaced on the next checkout
+    monkeypatch.setattr(parse_sandbox, "PARSE_TIMEOUT_SECONDS", WARM_TIMEOUT)
+    assert "Page 1" in pool.parse("pdf", good, 5000)
+    stats = pool.stats()
+    assert stats["rejected"]["timeout"] == 1
+    assert stats["workers_started"] == 2
+    assert stats["ok"] == 2
+
+
+def test_parser_error_is_a_value_error_and_keeps_the_worker(pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_sandbox, "PARSE_TIMEOUT_SECONDS", WARM_TIMEOUT)
+    garbage = _write(tmp_path, "garbage.pdf", b"not a pdf at all" * 100)
+    with pytest.raises(ValueError) as exc:
+        pool.parse("pdf", garbage, 5000)
+    assert not isinstance(exc.value, DocumentRejectedError)
+    assert pool.stats()["errors"] == 1
+    assert pool.stats()["idle"] == 1
+
+
+def test_in_process_mode_applies_the_char_budget(monkeypatch):
+    monkeypatch.setattr(parse_sandbox, "PARSE_SANDBOX", False)
+    text = parse_sandbox.parse_document("pdf", make_pdf(20), 3000)
+    assert 0 < len(text) <= 3000
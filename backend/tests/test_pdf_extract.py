@@ -0,0 +1,26 @@
+import core.parse_sandbox as parse_sandbox
+from core.pdf_extract import extract_pdf_text
+from benchmarks.bench_pdf_extract import make_pdf
+from benchmarks.bench_ocr_routing import make_mixed_pdf
+
+
+def test_pages_are_separated_by_form_feeds():
+    text = extract_pdf_text(make_pdf(3, lines_per_page=2), parallel=False)
+    pages = text.split("\f")
+    assert len(pages) == 3
+    assert pages[2].startswith("Page 3")
+
+
+def test_budget_is_applied():
+    assert len(extract_pdf_text(make_pdf(20), 1000, parallel=False)) == 1000
+
+
+def test_blank_multi_page_pdf_gives_empty_text(monkeypatch):
+    blank = make_mixed_pdf(3, {0, 1, 2}, 256)
+    assert extract_pdf_text(blank, parallel=False) == ""
+
+    # Through the sandboxed path the analysis uses, with OCR off
+    import core.document_analysis as document_analysis
+    monkeypatch.setattr(parse_sandbox, "PARSE_SANDBOX", False)
+    monkeypatch.setattr(document_analysis, "ocr_enabled", lambda: False)
+    assert document_analysis.extract_text_from_pdf(blank) == ""
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from core.ai_clients import LLMQueueTimeout, RateLimiter, _TokenBucket
+
+
+def test_token_bucket_goes_into_debt_and_refills():
+    bucket = _TokenBucket(60)  # one token per second
+    assert bucket.reserve(60) == 0.0
+    wait = bucket.reserve(2)
+    # Two tokens short at one token per second
+    assert 1.9 < wait <= 2.0
+    bucket.refund(2)
+    assert bucket.reserve(1) < 1.0
+
+
+def test_token_bucket_caps_a_single_reservation_at_capacity():
+    bucket = _TokenBucket(60)
+    # A prompt larger than the whole minute budget waits one minute, not forever
+    assert bucket.reserve(10_000) == 0.0
+    assert bucket.reserve(1) <= 1.0
+
+
+def test_queue_timeout_when_all_slots_are_held():
+    lim = RateLimiter("test-queue", max_concurrency=1)
+    lim.acquire(timeout=1)
+    with pytest.raises(LLMQueueTimeout) as exc:
+        lim.acquire(timeout=0.05)
+    assert exc.value.retry_after >= 1.0
+    stats = lim.stats()
+    assert stats["timeouts"] == 1
+    assert stats["queue_depth"] == 0
+    lim.release()
+    assert lim.stats()["in_flight"] == 0
+
+
+def test_released_slot_goes_to_the_oldest_waiter():
+    lim = RateLimiter("test-fifo", max_concurrency=1)
+    lim.acquire()
+    order = []
+
+    def worker(name):
+        lim.acquire(timeout=2)
+        order.append(name)
+        lim.release()
+
+    threads = []
+    for name in ("first", "second"):
+        t = threading.Thread(target=worker, args=(name,))
+        t.start()
+        threads.append(t)
+        # Let the thread join the queue before the next one
+        while lim.stats()["queue_depth"] < len(threads):
+            time.sleep(0.005)
+    lim.release()
+    for t in threads:
+        t.join(2)
+    assert order == ["first", "second"]
+    assert lim.stats()["in_flight"] == 0
+
+
+def test_rpm_wait_past_the_deadline_times_out_and_refunds():
+    lim = RateLimiter("test-rpm", rpm=1)
+    lim.acquire(timeout=1)
+    with pytest.raises(LLMQueueTimeout):
+        lim.acquire(timeout=0.05)
+    # The failed caller gave its slot back
+    assert lim.stats()["in_flight"] == 1
+    lim.release()
+
+
+def test_async_queue_timeout_and_cancellation():
+    lim = RateLimiter("test-async", max_concurrency=1)
+
+    async def scenario():
+        await lim.acquire_async(timeout=1)
+        with pytest.raises(LLMQueueTimeout):
+            await lim.acquire_async(timeout=0.05)
+        waiter = asyncio.create_task(lim.acquire_async(timeout=5))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        lim.release()
+
+    asyncio.run(scenario())
+    stats = lim.stats()
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
@@ -0,0 +1,125 @@
+from enum import Enum
+from typing import Literal, Optional
+
+import pytest
+from pydantic import BaseModel
+
+import core.structured_output as structured_output
+from core.llm_metrics import metrics
+from core.ocr import OCRPages
+from core.structured_output import decode_structured, response_schema
+
+
+class Tone(str, Enum):
+    friendly = "friendly"
+    formal = "formal"
+
+
+class Spec(BaseModel):
+    key: str
+    value: str
+
+
+class Draft(BaseModel):
+    title: str
+    tags: list[str]
+    specs: list[Spec]
+    tone: Tone
+    channel: Literal["facebook", "tiktok"]
+    subtitle: Optional[str] = None
+    prompt_used: str
+
+
+def test_schema_inlines_refs_and_drops_null_options():
+    schema = response_schema(Draft, ("prompt_used",))
+    props = schema["properties"]
+    assert schema["type"] == "OBJECT"
+    assert "prompt_used" not in props and "prompt_used" not in schema["required"]
+    assert schema["property_ordering"] == ["title", "tags", "specs", "tone", "channel", "subtitle"]
+    assert props["tags"] == {"type": "ARRAY", "items": {"type": "STRING"}}
+
+    # $ref -> inline object, no $defs left anywhere
+    spec = props["specs"]["items"]
+    assert spec["type"] == "OBJECT" and spec["required"] == ["key", "value"]
+    assert "$ref" not in str(schema) and "$defs" not in str(schema)
+
+    assert props["tone"] == {"type": "STRING", "enum": ["friendly", "formal"]}
+    assert props["channel"] == {"type": "STRING", "enum": ["facebook", "tiktok"]}
+    # Optional[str] -> nullable string, not an anyOf with a null branch
+    assert props["subtitle"] == {"type": "STRING", "nullable": True}
+    assert "subtitle" not in schema["required"]
+
+
+def _counted(calls: list):
+    real = structured_output.gateway.generate_content
+
+    def generate_content(*args, **kwargs):
+        calls.append(kwargs.get("operation"))
+        return real(*args, **kwargs)
+    return generate_content
+
+
+def _stats(operation: str) -> dict:
+    return dict(metrics.structured_stats().get(operation, {"ok": 0, "repaired": 0, "failed": 0, "empty": 0}))
+
+
+def test_valid_answer_needs_no_repair(provider, monkeypatch):
+    calls = []
+    monkeypatch.setattr(structured_output.gateway, "generate_content", _counted(calls))
+    before = _stats("ocr_pages")
+    result = decode_structured('```json\n{"pages": ["a", "b"]}\n```', OCRPages, "ocr_pages")
+    assert result.pages == ["a", "b"]
+    assert calls == []
+    assert _stats("ocr_pages")["ok"] == before["ok"] + 1
+
+
+def test_one_repair_call_fixes_a_bad_answer(provider, monkeypatch):
+    calls = []
+    monkeypatch.setattr(structured_output.gateway, "generate_content", _counted(calls))
+    before = _stats("ocr_pages")
+    result = decode_structured('{"page": ["sai khóa"]}', OCRPages, "ocr_pages")
+    assert result is not None and len(result.pages) == 1
+    assert calls == ["ocr_pages_repair"]
+    assert _stats("ocr_pages")["repaired"] == before["repaired"] + 1
+
+
+def test_failed_repair_is_not_retried(provider, monkeypatch):
+    calls = []
+    monkeypatch.setattr(structured_output.gateway, "generate_content", _counted(calls))
+    before = _stats("structured_test")
+    # The fake answers an unknown operation's repair with plain text, which fails again
+    assert decode_structured("không phải JSON", OCRPages, "structured_test") is None
+    assert calls == ["structured_test_repair"]
+    assert _stats("structured_test")["failed"] == before["failed"] + 1
+
+
+def test_empty_answer_and_disabled_repair_make_no_call(provider, monkeypatch):
+    calls = []
+    monkeypatch.setattr(structured_output.gateway, "generate_content", _counted(calls))
+    before = _stats("structured_test")
+    assert decode_structured("   ", OCRPages, "structured_test") is None
+    monkeypatch.setattr(structured_output, "STRUCTURED_REPAIR_ENABLED", False)
+    assert decode_structured("{}", OCRPages, "structured_test") is None
+    assert calls == []
+    after = _stats("structured_test")
+    assert after["empty"] == before["empty"] + 1
+    assert after["failed"] == before["failed"] + 1
+
+
+@pytest.mark.parametrize("text", ['{"usps": "a, b"}', "OK"])
+def test_document_analysis_goes_through_the_repair(provider, monkeypatch, text):
+    import core.document_analysis as document_analysis
+
+    calls = []
+
+    def generate_content(candidates, contents, operation, **kwargs):
+        calls.append(operation)
+        if operation == "document_analysis":
+            return type("Response", (), {"text": text})()
+        return provider_call(candidates, contents, operation=operation, **kwargs)
+
+    provider_call = structured_output.gateway.generate_content
+    monkeypatch.setattr(document_analysis.gateway, "generate_content", generate_content)
+    data = document_analysis._call_analysis("Máy X", "tài liệu", "document_analysis")
+    assert calls == ["document_analysis", "document_analysis_repair"]
+    assert data["product_name"] == "Máy X" and data["usps"]